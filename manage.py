@@ -2,14 +2,32 @@ import os
 
 from flask.cli import FlaskGroup
 from online_store.app import create_app
+from online_store.tools.benchmark import benchmark_command
+from online_store.tools.catalogue import export_catalogue_command
+from online_store.tools.datagen import generate_data_command
+from online_store.tools.giftbench import giftbench_command
+from online_store.tools.importtime import import_time_command
+from online_store.tools.loadtest import loadtest_command
+from online_store.tools.microbench import microbench_command
+from online_store.tools.replay import replay_command
+from online_store.tools.searchbench import searchbench_command
 
 # TODO: Use a better approach
 os.environ['FLASK_APP'] = os.environ.get('FLASK_APP', 'online_shop/app.py')
 os.environ['FLASK_ENV'] = os.environ.get('FLASK_ENV', 'development')
 os.environ['FLASK_DEBUG'] = "1"
 
-app = create_app()
-cli = FlaskGroup(app)
+# NOTE: the app is only created when a command needs it, e.g. `run`/`routes`
+cli = FlaskGroup(create_app=create_app)
+cli.add_command(benchmark_command)
+cli.add_command(export_catalogue_command)
+cli.add_command(generate_data_command)
+cli.add_command(giftbench_command)
+cli.add_command(import_time_command)
+cli.add_command(loadtest_command)
+cli.add_command(microbench_command)
+cli.add_command(replay_command)
+cli.add_command(searchbench_command)
 
 if __name__ == "__main__":
     cli()
@@ -4,28 +4,17 @@ import os
 from functools import partial
 from collections import defaultdict
 from pathlib import Path
-from typing import Any, Mapping, Optional
+from typing import TYPE_CHECKING, Any, Mapping, Optional
 from flask import Flask
 from loguru import logger
 
-# Flask middleware and extensions
-from flask_jwt_extended import JWTManager
-from flasgger import Swagger
-from flask_cors import CORS
+if TYPE_CHECKING:  # pragma: no cover
+    from flask_jwt_extended import JWTManager
 
-# SQL and ORM
-from .backend.models.database import db as store_db
-from .backend.models.item import ItemModel  # TODO: refactor, not really needed
-
-# route blueprints
-from .backend.routes.default import default_router as backend_default_router
-from .backend.routes.auth import auth_router as backend_auth_router
-from .backend.routes.gifts import gifts_router as backend_gifts_router
-from .backend.routes.store import store_router as backend_store_router
-from .backend.routes.terms_of_use import terms_of_user_router
-
-# jwt callbacks
-from .backend.utils import jwt_callbacks
+# NOTE: Flask extensions, ORM models and route blueprints are deliberately
+# imported inside the functions below, rather than at module level, so that
+# importing this module (e.g. from `manage.py` or a worker's boot script)
+# stays cheap. Use `python manage.py import-time` to check the import budget.
 
 __author__ = "Liam Deacon"
 __description__ = "Wedding Gift List"
@@ -65,7 +54,7 @@ def load_config(app: Flask, config: Optional[Mapping[str, Any]] = None):
     """
     config = config or {}
     app.config.from_mapping(**config)
-    logger.debug(f'Loaded Flask config from {config}')
+    logger.debug('Loaded Flask config from {}', config)
     # logger.debug(f'User environment is: {os.environ}')
 
     get_config = partial(get_app_config, config=config, app_config=app.config)
@@ -84,6 +73,32 @@ def load_config(app: Flask, config: Optional[Mapping[str, Any]] = None):
     set_config('JWT_BLACKLIST_ENABLED', False)
     set_config('JWT_BLACKLIST_TOKEN_CHECKS', 'access,refresh')
     set_config('FLASK_APP_CONFIG_DIR', Path(__file__).parent)
+    set_config('LOG_FILE', f"{__description__.lower().replace(' ', '_')}.log")
+    set_config('LOG_ENQUEUE')  # default depends on FLASK_ENV, see setup_logging()
+    set_config('LOG_FORMAT', 'text')  # or 'json' for structured logging
+    set_config('LOG_QUEUE_SIZE', 10000)
+    set_config('LOG_SAMPLE_RATES', '')  # e.g. 'DEBUG=100,INFO=10'
+    set_config('SQL_PROFILER_HEADERS')  # default depends on FLASK_ENV
+    set_config('SQL_N_PLUS_ONE_THRESHOLD', 5)
+    set_config('SQL_SLOW_QUERY_THRESHOLD_MS', 100)  # negative disables the slow query log
+    set_config('SQL_SLOW_QUERY_EXPLAIN', True)
+    set_config('SQL_SLOW_QUERY_LOG')  # default is slow_queries.log next to LOG_FILE, '' disables
+    set_config('ITEM_CACHE_SIZE', 10000)  # 0 disables the item cache
+    set_config('ITEMS_RESPONSE_CACHE_SIZE', 256)  # 0 disables the item listing cache
+    set_config('ITEMS_RESPONSE_CACHE_TTL', 60)
+    set_config('CACHE_INVALIDATION_BUS', True)  # SQLite only
+    set_config('CACHE_INVALIDATION_INTERVAL', 0)  # min seconds between checks
+    set_config('SINGLE_FLIGHT_TIMEOUT', 10)  # seconds to wait for identical requests
+    set_config('CATALOGUE_SNAPSHOT')  # e.g. 'catalogue.bin' to serve items via mmap
+    set_config('STOCK_LEDGER_ENABLED', False)  # reserve stock via sharded leases
+    set_config('STOCK_LEDGER_SHARDS', 8)
+    set_config('STOCK_LEDGER_LEASE_SIZE', 100)
+    set_config('STOCK_LEDGER_CONSOLIDATE_INTERVAL', 1)  # seconds
+    set_config('SEARCH_FTS', True)  # SQLite FTS5 index of items, else LIKE
+    set_config('SUGGEST_INDEX', True)  # in-memory prefix index of item names and brands
+    set_config('FACET_PRICE_BUCKETS', '50,100,250,500')  # default price bucket boundaries
+    set_config('FACETS_CACHE_SIZE', 256)  # 0 disables the item facets cache
+    set_config('REQUEST_CAPTURE_FILE')  # e.g. 'requests.ndjson' to capture for replay
 
     try:
         app.config['JWT_BLACKLIST_TOKEN_CHECKS'] = \
@@ -92,12 +107,6 @@ def load_config(app: Flask, config: Optional[Mapping[str, Any]] = None):
         pass
 
     config_dir = Path(app.config['FLASK_APP_CONFIG_DIR'])
-    logfile = f"{__description__.lower().replace(' ', '_')}.log"
-
-    logfile_kwargs = defaultdict(
-        lambda: {"rotation": "10MB", "compression": "zip", "backtrace": False},
-        {"development": {"backtrace": True}}
-    )
 
     environment = app.config['FLASK_ENV']
     config_file = config_dir / f'config/{environment}_env.cfg'
@@ -105,19 +114,61 @@ def load_config(app: Flask, config: Optional[Mapping[str, Any]] = None):
         config_file = environment
 
     try:
-        logger.add(logfile, **logfile_kwargs[environment])
         app.config.from_pyfile(config_file)
-        logger.info(f'Loaded Flask config from "{config_file}"')
+        config_loaded = True
     except IOError as err:
+        config_loaded = False
         logger.exception(err)
 
+    setup_logging(app)
+    if config_loaded:
+        logger.info('Loaded Flask config from "{}"', config_file)
+
     # Note the flask app configuration setup
-    logger.info(f'Running {environment} environment')
-    logger.debug(f'App config is {app.config}')
+    logger.info('Running {} environment', environment)
+    logger.opt(lazy=True).debug('App config is {}', lambda: app.config)
+
+
+def setup_logging(app: Flask) -> int:
+    """Adds the log file sink described by the app's `LOG_*` config.
+
+    Outside of the development environment, log records are by default
+    formatted and written by a background thread using a bounded queue
+    (see `online_store.backend.utils.log`), so that logging I/O, rotation and
+    compression never run inside request threads.
+
+    Returns
+    -------
+    int
+        The loguru handler id of the file sink.
+    """
+    # pylint: disable=import-outside-toplevel
+    from .backend.utils.config import config_flag
+    from .backend.utils.log import add_file_sink
+    from .backend.utils.slow_queries import is_slow_query_record
+
+    environment = app.config['FLASK_ENV']
+    logfile_kwargs = defaultdict(
+        lambda: {"rotation": "10MB", "compression": "zip", "backtrace": False},
+        {"development": {"backtrace": True}}
+    )
+
+    return add_file_sink(app.config['LOG_FILE'],
+                         enqueue=config_flag(app.config, 'LOG_ENQUEUE',
+                                             default=environment != 'development'),
+                         serialize=str(app.config['LOG_FORMAT']).lower() == 'json',
+                         maxsize=int(app.config['LOG_QUEUE_SIZE']),
+                         sample_rates=app.config['LOG_SAMPLE_RATES'],
+                         # slow queries are written to their own log instead
+                         record_filter=lambda record: not is_slow_query_record(record),
+                         **logfile_kwargs[environment])
 
 
-def setup_jwt(app: Flask) -> JWTManager:
+def setup_jwt(app: Flask) -> 'JWTManager':
     """Adds JWT middleware and configures callbacks."""
+    from flask_jwt_extended import JWTManager  # pylint: disable=import-outside-toplevel
+    from .backend.utils import jwt_callbacks  # pylint: disable=import-outside-toplevel
+
     jwt = JWTManager(app)  # TODO: use jwt
 
     # Add the following callbacks for consistent backend JSON API response
@@ -133,43 +184,10 @@ def setup_jwt(app: Flask) -> JWTManager:
     return jwt
 
 
-def create_app(*args, **kwargs) -> Flask:
-    """Function for creating the flask app instance.
-
-    This app currently uses the following middleware/flask extensions:
-
-        - JWTManager (flask-jwt-extended) for JSON web token authentication.
-        - Swagger (flasgger) for interactively viewing the REST API
-          under `/apidocs`.
-        - CORS (flask-cors) for cross origin resource sharing of API requests
-          with external frontends, e.g. Node.js
-
-    .. todo::
-
-        This function is too complex, performing many changes
-        (for instance uses user env and conf files together)
-        and therefore needs refactoring in order to be more easily
-        (and thoroughly) tested.
-
-    """
-    # check for $PORT environment var used by Heroku, falling back as needed
-    # FIXME: shouldn't be needed if $PORT ENV is passed correctly in Dockerfile
-    os.environ['FLASK_RUN_PORT'] = \
-        os.environ.get('PORT', os.environ.get('FLASK_RUN_PORT', '5000'))
-
-    # initialise Flask app, then load config
-    config = kwargs.pop('config', {})
-    app = Flask(__name__, *args, **kwargs)
-    load_config(app, config or {})
-
-    # Apply JWT authentication middleware
-    jwt: JWTManager = setup_jwt(app)  # pylint: disable=unused-variable
-
-    # Apply Cross-Origin-Resource-Sharing middleware
-    # to allowing sharing of API requests with Node.js frontend
-    cors: CORS = CORS(app, resources={r"/api/*": {"origins": "*"}})  # pylint: disable=unused-variable
+def setup_swagger(app: Flask):
+    """Adds Swagger apidocs (flasgger) under `/apidocs`."""
+    from flasgger import Swagger  # pylint: disable=import-outside-toplevel
 
-    # Add Swagger apidocs
     Swagger(app,
             template={
                 "info": {
@@ -204,13 +222,21 @@ def create_app(*args, **kwargs) -> Flask:
                 }
             })
 
-    # Create database resources.
+
+def setup_database(app: Flask):
+    """Initialises the ORM, creating tables and loading products if needed."""
+    # pylint: disable=import-outside-toplevel
+    from .backend.models.database import db as store_db
+    # NOTE: all model modules must be imported so create_all() sees every table
+    from .backend.models import gift, order, user  # noqa: F401 pylint: disable=unused-import
+    from .backend.models.item import ItemModel
+
     store_db.init_app(app)
     with app.app_context():
         store_db.create_all()
 
         # try to load products if table is empty
-        if not ItemModel.query.all():
+        if not ItemModel.query.first():
             product_json_path = Path(__file__).parent.parent / 'products.json'
             logger.info(f'Loading JSON data from {product_json_path}')
             try:
@@ -218,11 +244,119 @@ def create_app(*args, **kwargs) -> Flask:
             except FileNotFoundError as err:
                 logger.warning(f'Cannot load JSON data due to: {err}')
 
-    # # Register blueprint routes.
+
+def register_blueprints(app: Flask):
+    """Registers the route blueprints with the app."""
+    # pylint: disable=import-outside-toplevel
+    from .backend.routes.default import default_router as backend_default_router
+    from .backend.routes.auth import auth_router as backend_auth_router
+    from .backend.routes.gifts import gifts_router as backend_gifts_router
+    from .backend.routes.store import store_router as backend_store_router
+    from .backend.routes.terms_of_use import terms_of_user_router
+    from .backend.routes.metrics import metrics_router
+    from .backend.routes.admin import admin_router
+
     app.register_blueprint(backend_default_router, url_prefix="")  # careful!
     app.register_blueprint(backend_store_router, url_prefix="/api/v1/store")
     app.register_blueprint(backend_auth_router, url_prefix="/api/v1/auth")
     app.register_blueprint(backend_gifts_router, url_prefix="/api/v1/gifts")
     app.register_blueprint(terms_of_user_router, url_prefix="")
+    app.register_blueprint(metrics_router, url_prefix="")
+    app.register_blueprint(admin_router, url_prefix="/api/v1/admin")
+
+
+def create_app(*args, **kwargs) -> Flask:
+    """Function for creating the flask app instance.
+
+    This app currently uses the following middleware/flask extensions:
+
+        - JWTManager (flask-jwt-extended) for JSON web token authentication.
+        - Swagger (flasgger) for interactively viewing the REST API
+          under `/apidocs`.
+        - CORS (flask-cors) for cross origin resource sharing of API requests
+          with external frontends, e.g. Node.js
+
+    .. todo::
+
+        This function is too complex, performing many changes
+        (for instance uses user env and conf files together)
+        and therefore needs refactoring in order to be more easily
+        (and thoroughly) tested.
+
+    """
+    # check for $PORT environment var used by Heroku, falling back as needed
+    # FIXME: shouldn't be needed if $PORT ENV is passed correctly in Dockerfile
+    os.environ['FLASK_RUN_PORT'] = \
+        os.environ.get('PORT', os.environ.get('FLASK_RUN_PORT', '5000'))
+
+    # initialise Flask app, then load config
+    config = kwargs.pop('config', {})
+    app = Flask(__name__, *args, **kwargs)
+    load_config(app, config or {})
+
+    # Apply JWT authentication middleware
+    jwt = setup_jwt(app)  # pylint: disable=unused-variable
+
+    # Apply Cross-Origin-Resource-Sharing middleware
+    # to allowing sharing of API requests with Node.js frontend
+    from flask_cors import CORS  # pylint: disable=import-outside-toplevel
+    cors = CORS(app, resources={r"/api/*": {"origins": "*"}})  # pylint: disable=unused-variable
+
+    # Add request latency, in-flight and response size metrics (see /metrics)
+    from .backend.utils.metrics import init_request_metrics  # pylint: disable=import-outside-toplevel
+    init_request_metrics(app)
+
+    # Count and time SQL statements per request, flagging probable N+1 queries
+    from .backend.utils.sql_profiler import init_sql_profiler  # pylint: disable=import-outside-toplevel
+    init_sql_profiler(app)
+
+    # Log slow SQL statements with their query plans (see /api/v1/admin/slow-queries)
+    from .backend.utils.slow_queries import init_slow_query_log  # pylint: disable=import-outside-toplevel
+    init_slow_query_log(app)
+
+    # Record sanitized requests for `manage.py replay` (if REQUEST_CAPTURE_FILE is set)
+    from .backend.utils.capture import init_request_capture  # pylint: disable=import-outside-toplevel
+    init_request_capture(app)
+
+    # Cache pre-serialized store items by id and item listing responses
+    from .backend.utils.cache import init_item_cache  # pylint: disable=import-outside-toplevel
+    init_item_cache(app)
+
+    # Coalesce concurrent identical requests to expensive views
+    from .backend.utils.single_flight import init_single_flight  # pylint: disable=import-outside-toplevel
+    init_single_flight(app)
+
+    # Add Swagger apidocs
+    setup_swagger(app)
+
+    # Create database resources.
+    setup_database(app)
+
+    # Clear caches when other workers write to their tables
+    from .backend.utils.invalidation import init_invalidation_bus  # pylint: disable=import-outside-toplevel
+    init_invalidation_bus(app)
+
+    # Serve store items from a memory-mapped snapshot shared by all workers
+    from .backend.catalogue import init_catalogue_snapshot  # pylint: disable=import-outside-toplevel
+    init_catalogue_snapshot(app)
+
+    # Reserve stock of items from sharded leases rather than one row per item
+    from .backend.stock import init_stock_ledger  # pylint: disable=import-outside-toplevel
+    init_stock_ledger(app)
+
+    # Index item names and brands for full-text search
+    from .backend.search import init_search  # pylint: disable=import-outside-toplevel
+    init_search(app)
+
+    # Suggest items as search queries are typed, from an in-memory prefix index
+    from .backend.suggest import init_item_suggestions  # pylint: disable=import-outside-toplevel
+    init_item_suggestions(app)
+
+    # Count items per brand, currency and price bucket, cached per filter set
+    from .backend.facets import init_facets  # pylint: disable=import-outside-toplevel
+    init_facets(app)
+
+    # Register blueprint routes.
+    register_blueprints(app)
 
     return app
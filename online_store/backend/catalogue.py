@@ -0,0 +1,323 @@
+"""Provides a read-only, memory-mapped snapshot of the store catalogue.
+
+The `items` table is exported into a compact binary file, which every worker
+maps into memory, so that the pages are shared by all processes and items
+can be looked up and listed without the ORM. The file layout is:
+
+    - a header: magic, format version, number of items, the version of the
+      `items` table exported (see `.utils.invalidation`) and the offset of
+      the string heap.
+    - an index of fixed-width records sorted by id, each containing the id,
+      price, stock and the offset and length of each string in the heap,
+      including the item pre-encoded as JSON.
+    - a heap of UTF-8 encoded strings.
+
+Snapshots are rebuilt into a temporary file which atomically replaces the
+previous one, so readers never observe a partially written file. A snapshot
+is only used whilst its version matches the current version of the `items`
+table, otherwise lookups fall back to the ORM until it has been rebuilt.
+
+Examples
+--------
+.. code-block:: python
+
+    write_snapshot(dbapi_connection, 'catalogue.bin')
+    snapshot = CatalogueSnapshot('catalogue.bin')
+    snapshot.item_json(1)
+    # b'{"brand": "Le Creuset", ...}'
+
+"""
+import json
+import math
+import mmap
+import os
+import struct
+import tempfile
+import threading
+
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from flask import Flask, current_app
+from loguru import logger
+
+from .utils.invalidation import VERSIONS_TABLE, get_invalidation_bus
+
+MAGIC = b'OSCATLG\0'
+FORMAT_VERSION = 1
+
+# magic, format version, number of records, items table version, heap offset
+HEADER = struct.Struct('<8sIIqQ')
+# id, price, in_stock_quantity, (offset, length) of name, brand, currency and JSON
+RECORD = struct.Struct('<qdq8I')
+RECORD_ID = struct.Struct('<q')
+
+NULL_LENGTH = 0xFFFFFFFF
+# NOTE: in the order fields are serialised by AlchemyEncoder, i.e. sorted
+FIELDS = ('brand', 'currency', 'id', 'in_stock_quantity', 'name', 'price')
+FIELD_TYPES = {'id': int, 'in_stock_quantity': int, 'price': float,
+               'name': str, 'brand': str, 'currency': str}
+
+_SELECT_ITEMS = 'SELECT id, name, brand, currency, price, in_stock_quantity FROM items ORDER BY id'
+
+
+class SnapshotError(Exception):
+    """Raised when a catalogue snapshot file is invalid."""
+
+
+def _items_version(cursor) -> int:
+    try:
+        cursor.execute(f"SELECT version FROM {VERSIONS_TABLE} WHERE name = 'items'")
+        row = cursor.fetchone()
+    except Exception:  # pylint: disable=broad-except
+        return -1  # no table versions, so the snapshot is always stale
+    return row[0] if row else -1
+
+
+def write_snapshot(dbapi_connection, path: str) -> Tuple[int, int]:
+    """Export the items table to a snapshot at `path`, replacing it atomically.
+
+    Returns
+    -------
+    Tuple[int, int]
+        The number of items exported and the version of the items table.
+    """
+    cursor = dbapi_connection.cursor()
+    try:
+        # NOTE: read the version first, so that a concurrent write makes the
+        # snapshot appear stale rather than the other way around
+        version = _items_version(cursor)
+        cursor.execute(_SELECT_ITEMS)
+        rows = cursor.fetchall()
+    finally:
+        cursor.close()
+
+    heap = bytearray()
+    records = bytearray()
+    for item_id, name, brand, currency, price, stock in rows:
+        item = {'brand': brand, 'currency': currency, 'id': item_id,
+                'in_stock_quantity': stock, 'name': name, 'price': price}
+        strings: List[int] = []
+        for value in (name, brand, currency, json.dumps(item)):
+            if value is None:
+                strings += [0, NULL_LENGTH]
+            else:
+                encoded = str(value).encode('utf8')
+                strings += [len(heap), len(encoded)]
+                heap += encoded
+        records += RECORD.pack(item_id, math.nan if price is None else price,
+                               stock, *strings)
+
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(prefix='.catalogue-', dir=directory)
+    try:
+        with os.fdopen(fd, 'wb') as snapshot_fp:
+            snapshot_fp.write(HEADER.pack(MAGIC, FORMAT_VERSION, len(rows), version,
+                                          HEADER.size + len(records)))
+            snapshot_fp.write(records)
+            snapshot_fp.write(heap)
+            snapshot_fp.flush()
+            os.fsync(snapshot_fp.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+    return len(rows), version
+
+
+class CatalogueSnapshot:
+    """A memory-mapped catalogue snapshot, see `write_snapshot()`.
+
+    Raises
+    ------
+    SnapshotError
+        If `path` is not a valid snapshot.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, 'rb') as snapshot_fp:
+            stat = os.fstat(snapshot_fp.fileno())
+            if stat.st_size < HEADER.size:
+                raise SnapshotError(f'{path} is too small to be a catalogue snapshot')
+            self._mmap = mmap.mmap(snapshot_fp.fileno(), 0, access=mmap.ACCESS_READ)
+        self.file_id = (stat.st_ino, stat.st_mtime_ns)
+        magic, format_version, self._count, self.version, self._heap = \
+            HEADER.unpack_from(self._mmap)
+        if magic != MAGIC or format_version != FORMAT_VERSION:
+            raise SnapshotError(f'{path} is not a version {FORMAT_VERSION} catalogue snapshot')
+        if HEADER.size + self._count * RECORD.size > self._heap or self._heap > len(self._mmap):
+            raise SnapshotError(f'{path} is truncated')
+
+    def __len__(self) -> int:
+        return self._count
+
+    def _string(self, offset: int, length: int) -> Optional[str]:
+        if length == NULL_LENGTH:
+            return None
+        start = self._heap + offset
+        return self._mmap[start:start + length].decode('utf8')
+
+    def _record(self, index: int) -> Dict[str, Any]:
+        item_id, price, stock, *strings = \
+            RECORD.unpack_from(self._mmap, HEADER.size + index * RECORD.size)
+        name, brand, currency = (self._string(strings[i], strings[i + 1]) for i in (0, 2, 4))
+        return {'brand': brand, 'currency': currency, 'id': item_id,
+                'in_stock_quantity': stock, 'name': name,
+                'price': None if math.isnan(price) else price}
+
+    def _id_at(self, index: int) -> int:
+        return RECORD_ID.unpack_from(self._mmap, HEADER.size + index * RECORD.size)[0]
+
+    def _index_of(self, item_id: int) -> Optional[int]:
+        if not self._count:
+            return None
+        # ids are usually contiguous, so first try the index of a contiguous id
+        index = item_id - self._id_at(0)
+        if 0 <= index < self._count and self._id_at(index) == item_id:
+            return index
+        low, high = 0, self._count
+        while low < high:
+            middle = (low + high) // 2
+            if self._id_at(middle) < item_id:
+                low = middle + 1
+            else:
+                high = middle
+        if low < self._count and self._id_at(low) == item_id:
+            return low
+        return None
+
+    def get(self, item_id: int) -> Optional[Dict[str, Any]]:
+        """Return the item with `item_id`, or None if it doesn't exist."""
+        index = self._index_of(item_id)
+        return None if index is None else self._record(index)
+
+    def item_json(self, item_id: int) -> Optional[bytes]:
+        """Return the JSON encoded item with `item_id`, as encoded by the ORM."""
+        index = self._index_of(item_id)
+        if index is None:
+            return None
+        offset, length = RECORD.unpack_from(self._mmap, HEADER.size + index * RECORD.size)[-2:]
+        start = self._heap + offset
+        return self._mmap[start:start + length]
+
+    def items(self, filters: Optional[Dict[str, Any]] = None) -> Iterator[Dict[str, Any]]:
+        """Yield the items, in id order, whose fields equal `filters`."""
+        filters = filters or {}
+        if list(filters) == ['id']:
+            item = self.get(filters['id'])
+            if item is not None:
+                yield item
+            return
+        for index in range(self._count):
+            item = self._record(index)
+            if all(item[field] == value for field, value in filters.items()):
+                yield item
+
+
+def parse_filters(params: Dict[str, str]) -> Optional[Dict[str, Any]]:
+    """Convert query arguments to typed snapshot filters.
+
+    Returns None if the filters are not supported by snapshots, e.g. are
+    not fields of items, in which case the ORM should be used instead.
+    """
+    filters = {}
+    for field, value in params.items():
+        field_type = FIELD_TYPES.get(field)
+        if field_type is None:
+            return None
+        try:
+            filters[field] = field_type(value)
+        except ValueError:
+            return None
+    return filters
+
+
+class CatalogueSnapshots:
+    """Serves the current catalogue snapshot, rebuilding it when stale.
+
+    Parameters
+    ----------
+    path: str
+        The snapshot file, shared by every worker.
+    engine: Engine
+        The database engine to export items from.
+    """
+
+    def __init__(self, path: str, engine):
+        self.path = path
+        self.engine = engine
+        self.snapshot: Optional[CatalogueSnapshot] = None
+        self.rebuild_thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    def rebuild(self):
+        """Export the items table and map the new snapshot."""
+        connection = self.engine.raw_connection()
+        try:
+            count, version = write_snapshot(connection, self.path)
+        finally:
+            connection.close()
+        logger.info(f'Wrote {count} items to catalogue snapshot {self.path} (version {version})')
+        self.reload()
+
+    def reload(self):
+        """Map the snapshot file, if it was replaced since it was last mapped."""
+        try:
+            stat = os.stat(self.path)
+            if self.snapshot is None or \
+                    self.snapshot.file_id != (stat.st_ino, stat.st_mtime_ns):
+                # NOTE: the previous mapping is unmapped once no longer referenced
+                self.snapshot = CatalogueSnapshot(self.path)
+        except (OSError, SnapshotError) as err:
+            logger.warning(f'Unable to map catalogue snapshot: {err}')
+            self.snapshot = None
+
+    def _rebuild_in_background(self):
+        with self._lock:
+            if self.rebuild_thread is not None and self.rebuild_thread.is_alive():
+                return
+            self.rebuild_thread = threading.Thread(target=self.rebuild, daemon=True,
+                                                   name='catalogue-snapshot')
+            self.rebuild_thread.start()
+
+    def current(self) -> Optional[CatalogueSnapshot]:
+        """Return the snapshot if up to date, otherwise schedule a rebuild."""
+        bus = get_invalidation_bus()
+        version = bus.version('items') if bus is not None else None
+        if version is None:
+            return None
+        snapshot = self.snapshot
+        if snapshot is not None and snapshot.version == version:
+            return snapshot
+        self.reload()  # another worker may have rebuilt it already
+        snapshot = self.snapshot
+        if snapshot is not None and snapshot.version == version:
+            return snapshot
+        self._rebuild_in_background()
+        return None
+
+
+def current_snapshot() -> Optional[CatalogueSnapshot]:
+    """Return the up to date catalogue snapshot of the current app, if any."""
+    snapshots: Optional[CatalogueSnapshots] = current_app.extensions.get('catalogue_snapshot')
+    return snapshots.current() if snapshots is not None else None
+
+
+def init_catalogue_snapshot(app: Flask):
+    """Serve items from the snapshot file `CATALOGUE_SNAPSHOT`, if set.
+
+    Requires the cache invalidation bus, so must be called after
+    `.utils.invalidation.init_invalidation_bus()`.
+    """
+    from .models.database import db  # pylint: disable=import-outside-toplevel
+    path = app.config.get('CATALOGUE_SNAPSHOT')
+    if not path:
+        return
+    if 'invalidation_bus' not in app.extensions:
+        logger.warning('Catalogue snapshot requires CACHE_INVALIDATION_BUS, ignoring')
+        return
+    snapshots = CatalogueSnapshots(str(path), db.get_engine(app))
+    snapshots.reload()
+    if snapshots.snapshot is None:
+        snapshots.rebuild()
+    app.extensions['catalogue_snapshot'] = snapshots
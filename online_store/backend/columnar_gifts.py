@@ -0,0 +1,251 @@
+"""Provides a gift list storing its gifts in typed arrays, for very large lists.
+
+Rather than an object per gift, the ids, prices and quantities of gifts are
+held in `array` columns, so that totals and reports are computed over whole
+columns (using NumPy if installed), and items are only resolved by their id
+when the list is listed or reported.
+
+Examples
+--------
+.. code-block:: python
+
+    gift_list = GiftListFactory('corporate', 'columnar')
+    gift_list.add_item({'id': 1, 'price': 47.0}, 2)
+    gift_list.totals()['value_outstanding']  # 94.0
+
+"""
+import json
+
+from array import array
+from itertools import compress
+from operator import mul
+from typing import Any, Callable, Dict, Iterable, List, Sequence, Tuple, Union
+
+from flask import has_app_context
+
+try:
+    import numpy
+except ImportError:  # NumPy is optional, columns are then summed in pure Python
+    numpy = None  # pylint: disable=invalid-name
+
+from .catalogue import current_snapshot
+from .gift_list import (
+    _SUMMARY_COLUMNS, AbstractGiftList, GiftListFactory, _check_quantity, _item_id, print_report
+)
+from .models.item import ItemModel
+from .utils.cache import get_item_cache
+from .utils.model_serialisers.json_encoder import AlchemyEncoder
+from .utils.metrics import GIFT_OVERSELL_REJECTIONS, GIFT_PURCHASED_QUANTITY, GIFT_PURCHASES
+
+RESOLVE_BATCH = 500
+
+
+def resolve_items(item_ids: Sequence[int]) -> Dict[int, Dict[str, Any]]:
+    """Return the store items with `item_ids`, by id, omitting missing items.
+
+    Items are read from the catalogue snapshot or the item cache, querying
+    those not cached in batches of `RESOLVE_BATCH`. No items are resolved
+    outside of an app context.
+    """
+    if not has_app_context():
+        return {}
+    snapshot = current_snapshot()
+    if snapshot is not None:
+        bodies = {item_id: snapshot.item_json(item_id) for item_id in item_ids}
+        return {item_id: json.loads(body) for item_id, body in bodies.items() if body}
+    cache = get_item_cache()
+    items, missing = {}, []
+    for item_id in item_ids:
+        body = cache.get(item_id)
+        if body is None:
+            missing.append(item_id)
+        else:
+            items[item_id] = json.loads(body)
+    for start in range(0, len(missing), RESOLVE_BATCH):
+        for item in ItemModel.query.filter(ItemModel.id.in_(missing[start:start + RESOLVE_BATCH])):
+            items[item.id] = json.loads(json.dumps(item, cls=AlchemyEncoder))
+    return items
+
+
+class ColumnarGiftList(AbstractGiftList):
+    """A gift list storing its gifts in typed arrays, for very large lists.
+
+    The id, price, available and purchased quantities of gifts are held in
+    `array` columns, with a dict mapping item ids to their slot, so that no
+    object is created per gift, not even the item added. Reports and totals
+    are computed from whole columns, using NumPy if installed, with items
+    resolved by their id only when listed or reported. Removing a gift moves
+    the last gift into its slot, so gifts do not stay in the order they
+    were added.
+
+    Items must have an integer `id`.
+
+    Parameters
+    ----------
+    username_or_id: Union[int, str]
+        The user whose gift list it is.
+    resolve: Callable[[Sequence[int]], Dict[int, Dict[str, Any]]]
+        Return the items of a sequence of ids, by id, default is
+        `resolve_items()`. Unresolved items are listed by id and price.
+    """
+
+    BACKEND = 'columnar'
+
+    def __init__(self, username_or_id,
+                 resolve: Callable[[Sequence[int]], Dict[int, Dict[str, Any]]] = resolve_items):
+        self.user = self.get_user(username_or_id)
+        self.resolve = resolve
+        self._slots: Dict[int, int] = {}
+        self._ids = array('q')
+        self._prices = array('d')
+        self._available = array('q')
+        self._purchased = array('q')
+
+    def __repr__(self) -> str:
+        """Create user friendly representation of gift list."""
+        return f'{self.user} -> {self.get_list()}'
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def get_user(self, username_or_id: Union[int, str]) -> Union[int, str]:
+        """Return user."""
+        return username_or_id  # dummy method
+
+    def create_list(self) -> List[Dict[str, Any]]:
+        """Create a new gift list."""
+        self._slots.clear()
+        for column in (self._ids, self._prices, self._available, self._purchased):
+            del column[:]
+        return self.get_list()
+
+    @staticmethod
+    def _item_price(item: Dict[str, Any]) -> float:
+        try:
+            return float(item.get('price') or 0.)
+        except (TypeError, ValueError):
+            return 0.  # e.g. a price including its currency
+
+    def _slot_of(self, item: Dict[str, Any]) -> int:
+        slot = self._slots.get(_item_id(item))
+        if slot is None:
+            raise ValueError(f'{item!r} is not in gift list')
+        return slot
+
+    def add_item(self, item: Dict[str, Any], quantity: int = 1):
+        """Add `quantity` of `item` to gift list.
+
+        Raises
+        ------
+        ValueError
+            When quantity is not a positive integer or item has no integer id.
+        """
+        _check_quantity(quantity)
+        item_id = _item_id(item)
+        slot = self._slots.get(item_id)
+        if slot is None:
+            slot = self._slots[item_id] = len(self._ids)
+            self._ids.append(item_id)
+            self._prices.append(self._item_price(item))
+            self._available.append(0)
+            self._purchased.append(0)
+        self._available[slot] += quantity
+
+    def remove_item(self, item: Dict[str, Any]):
+        """Remove item from gift list.
+
+        Raises
+        ------
+        ValueError
+            If `item` is not in gift list.
+        """
+        slot = self._slot_of(item)
+        del self._slots[self._ids[slot]]
+        last = len(self._ids) - 1
+        columns = (self._ids, self._prices, self._available, self._purchased)
+        if slot != last:
+            for column in columns:
+                column[slot] = column[last]
+            self._slots[self._ids[slot]] = slot
+        for column in columns:
+            column.pop()
+
+    def get_quantities(self, item: Dict[str, Any]) -> Tuple[int, int]:
+        """Return the number of `item` available and purchased."""
+        slot = self._slots.get(_item_id(item))
+        return (0, 0) if slot is None else (self._available[slot], self._purchased[slot])
+
+    def purchase_item(self, gift: Dict[str, Any], quantity: int = 1):
+        """Purchase `quantity` of `gift` from gift list.
+
+        Raises
+        ------
+        ValueError:
+            If `gift` is not in gift list or quantity is greater than available
+            number of desired gifts.
+        """
+        _check_quantity(quantity)
+        slot = self._slot_of(gift)
+        if quantity > self._available[slot]:
+            GIFT_OVERSELL_REJECTIONS.inc(self.BACKEND)
+            raise ValueError('Cannot purchase more items than available')
+
+        self._purchased[slot] += quantity
+        self._available[slot] -= quantity
+        GIFT_PURCHASES.inc(self.BACKEND)
+        GIFT_PURCHASED_QUANTITY.inc(self.BACKEND, amount=quantity)
+
+    def _nonzero(self, column: array) -> Iterable[int]:
+        """Return the slots whose value in `column` is not zero."""
+        if numpy is not None and column:
+            return numpy.flatnonzero(numpy.frombuffer(column, dtype=numpy.int64)).tolist()
+        return compress(range(len(column)), column)
+
+    def totals(self) -> Dict[str, Union[int, float]]:
+        """Return the aggregate totals of the gift list, as in its summary."""
+        gifts = len(self)
+        if numpy is not None and gifts:
+            available = numpy.frombuffer(self._available, dtype=numpy.int64)
+            purchased = numpy.frombuffer(self._purchased, dtype=numpy.int64)
+            prices = numpy.frombuffer(self._prices, dtype=numpy.float64)
+            bought = purchased > 0
+            totals = {'total_desired': int(available.sum() + purchased.sum()),
+                      'total_purchased': int(purchased.sum()),
+                      'value_purchased': float(purchased @ prices),
+                      'value_outstanding': float(available @ prices),
+                      'unpurchased': gifts - int(numpy.count_nonzero(bought)),
+                      'fully_purchased': int(numpy.count_nonzero(bought & (available <= 0)))}
+        else:
+            # NOTE: available is never negative, so fully purchased gifts have none left
+            available_bought = array('q', compress(self._available, self._purchased))
+            totals = {'total_desired': sum(self._available) + sum(self._purchased),
+                      'total_purchased': sum(self._purchased),
+                      'value_purchased': sum(map(mul, self._purchased, self._prices)),
+                      'value_outstanding': sum(map(mul, self._available, self._prices)),
+                      'unpurchased': gifts - len(available_bought),
+                      'fully_purchased': available_bought.count(0)}
+        totals['partially_purchased'] = \
+            gifts - totals['unpurchased'] - totals['fully_purchased']
+        return {column: totals[column] for column in _SUMMARY_COLUMNS}
+
+    def _items_of(self, slots: Iterable[int]) -> List[Dict[str, Any]]:
+        """Return the items of gifts in `slots`, resolving them by id."""
+        slots = list(slots)
+        items = self.resolve([self._ids[slot] for slot in slots])
+        return [items.get(self._ids[slot]) or {'id': self._ids[slot], 'price': self._prices[slot]}
+                for slot in slots]
+
+    def create_report(self):
+        """Print report of purchased and available gift items in list."""
+        reports = []
+        for column in (self._purchased, self._available):
+            slots = list(self._nonzero(column))
+            reports.append(list(zip(self._items_of(slots), (column[slot] for slot in slots))))
+        print_report(self.user, *reports)
+
+    def get_list(self) -> List[Dict[str, Any]]:
+        """Return the gift list."""
+        return self._items_of(range(len(self)))
+
+
+GiftListFactory.CLASSES['columnar'] = ColumnarGiftList
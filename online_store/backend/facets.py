@@ -0,0 +1,143 @@
+"""Provides counts of store items per brand, currency and price bucket.
+
+Facets are counted for the items matching a set of filters (the item field
+filters of `/store/items`, see `.catalogue.parse_filters`) by one statement,
+a `UNION ALL` of a `GROUP BY` per facet over the matching items, so the
+catalogue is never sent to the client to be counted. Prices are bucketed by
+ascending boundaries, e.g. `(50, 100)` counts prices below 50, from 50 to
+below 100 and from 100, irrespective of their currency.
+
+Facet responses are cached per filter set and price buckets, keyed by the
+`items` table version so that any committed write to items invalidates them.
+
+Examples
+--------
+.. code-block:: python
+
+    count_facets(db.session.connection(), {'brand': 'KITCHENAID'}, (50, 100))
+    # {'total': 2, 'facets': {'brand': [{'value': 'KITCHENAID', 'count': 2}], ...,
+    #  'price': [{'min': None, 'max': 50.0, 'count': 0}, ...]}}
+
+"""
+import math
+
+from typing import Any, Callable, Dict, List, Mapping, Sequence, Tuple, Union
+
+from flask import Flask, Response, current_app, request
+from sqlalchemy import text
+
+from .catalogue import FIELD_TYPES
+from .utils.cache import LRUCache, cached_response, normalized_args
+from .utils.table_versions import table_version
+
+FACETS = ('brand', 'currency', 'price')
+MAX_PRICE_BUCKETS = 20
+DEFAULT_PRICE_BUCKETS = '50,100,250,500'
+
+
+def parse_price_buckets(value: Union[str, Sequence[float]]) -> Tuple[float, ...]:
+    """Return the price bucket boundaries of `value`, e.g. '50,100,250'.
+
+    Raises
+    ------
+    ValueError
+        If the boundaries are not finite, strictly ascending numbers, or
+        there are more than `MAX_PRICE_BUCKETS`.
+    """
+    if isinstance(value, str):
+        value = [boundary for boundary in value.split(',') if boundary.strip()]
+    boundaries = tuple(float(boundary) for boundary in value)
+    if len(boundaries) > MAX_PRICE_BUCKETS:
+        raise ValueError(f'At most {MAX_PRICE_BUCKETS} price buckets are supported')
+    if not all(math.isfinite(boundary) for boundary in boundaries) or \
+            any(low >= high for low, high in zip(boundaries, boundaries[1:])):
+        raise ValueError('Price buckets must be finite and strictly ascending')
+    return boundaries
+
+
+def facets_statement(fields: Sequence[str], buckets: int):
+    """Return the statement counting every facet of items filtered by `fields`.
+
+    Each of `fields` is bound as a parameter of the same name, and each
+    price bucket boundary as `bucket0`, `bucket1`, etc.
+    """
+    unknown = set(fields) - set(FIELD_TYPES)
+    if unknown:  # NOTE: field names are part of the SQL, so are never taken from users
+        raise ValueError(f'Unknown item fields: {", ".join(sorted(unknown))}')
+    where = ' AND '.join(f'{field} = :{field}' for field in sorted(fields)) or '1 = 1'
+    cases = ' '.join(f'WHEN price < :bucket{index} THEN {index}' for index in range(buckets))
+    return text(
+        f'WITH matching AS (SELECT brand, currency, price FROM items WHERE {where}) '
+        "SELECT 'brand' AS facet, brand AS value, COUNT(*) FROM matching GROUP BY brand "
+        "UNION ALL SELECT 'currency', currency, COUNT(*) FROM matching GROUP BY currency "
+        f"UNION ALL SELECT 'price', CASE WHEN price IS NULL THEN NULL {cases} "
+        f'ELSE {buckets} END AS bucket, COUNT(*) FROM matching GROUP BY bucket')
+
+
+def count_facets(connection, filters: Mapping[str, Any],
+                 buckets: Sequence[float]) -> Dict[str, Any]:
+    """Count the items matching `filters` per brand, currency and price bucket.
+
+    Returns
+    -------
+    Dict[str, Any]
+        The `total` number of matching items and their `facets`: a list of
+        the `value` and `count` of each brand and currency, most common
+        first, and the `min` (inclusive), `max` (exclusive) and `count` of
+        every price bucket, including empty buckets. Items without a price
+        are not counted in any bucket.
+    """
+    params = dict(filters)
+    params.update((f'bucket{index}', boundary) for index, boundary in enumerate(buckets))
+    rows = connection.execute(facets_statement(list(filters), len(buckets)), **params)
+    counts: Dict[str, Dict[Any, int]] = {facet: {} for facet in FACETS}
+    for facet, value, count in rows:
+        counts[facet][value] = count
+
+    facets: Dict[str, List[Dict[str, Any]]] = {
+        facet: [{'value': value, 'count': count} for value, count in
+                sorted(counts[facet].items(), key=lambda entry: (-entry[1], str(entry[0])))]
+        for facet in ('brand', 'currency')}
+    boundaries = [None, *buckets, None]
+    facets['price'] = [{'min': boundaries[index], 'max': boundaries[index + 1],
+                        'count': counts['price'].get(index, 0)}
+                       for index in range(len(buckets) + 1)]
+    return {'total': sum(counts['currency'].values()), 'facets': facets}
+
+
+def facets_response(build: Callable[[], Response]) -> Response:
+    """Return the cached `/store/items/facets` response for the request arguments.
+
+    Entries are keyed by the `items` table version, as for `/store/items`
+    (see `.utils.cache.items_response()`).
+    """
+    key = (table_version('items'), normalized_args(request.args))
+    return cached_response(current_app.extensions['facets_cache'], key, build)
+
+
+def get_price_buckets() -> Tuple[float, ...]:
+    """Return the default price bucket boundaries of the current app."""
+    return current_app.config['FACET_PRICE_BUCKETS']
+
+
+def init_facets(app: Flask):
+    """Add the facets response cache to `app`.
+
+    Must be called after `.utils.invalidation.init_invalidation_bus()`, so
+    that writes to items by other workers clear the cache. The following
+    config keys are used:
+
+        - `FACET_PRICE_BUCKETS`: the default price bucket boundaries, e.g.
+          '50,100,250,500' (the default), overridden by the `price_buckets`
+          query argument.
+        - `FACETS_CACHE_SIZE`: the maximum number of responses, default is
+          256, where zero disables the cache.
+    """
+    app.config['FACET_PRICE_BUCKETS'] = \
+        parse_price_buckets(app.config.get('FACET_PRICE_BUCKETS', DEFAULT_PRICE_BUCKETS))
+    app.config['FACETS_CACHE_SIZE'] = int(app.config.get('FACETS_CACHE_SIZE', 256))
+    cache = LRUCache(app.config['FACETS_CACHE_SIZE'], name='facets')
+    bus = app.extensions.get('invalidation_bus')
+    if bus is not None:
+        bus.register(cache, 'items')
+    app.extensions['facets_cache'] = cache
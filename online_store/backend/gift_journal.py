@@ -0,0 +1,313 @@
+"""Provides the append-only journal and snapshots of durable in-memory gift lists.
+
+Every change to a gift list is appended to its journal as a line of compact
+JSON, e.g. `["p",{"id":1},2]` for the purchase of two of item 1, and the
+journal is fsync'd before the change is acknowledged. Concurrent changes are
+fsync'd together (group commit): whilst one thread waits for the disk, the
+records of others are buffered, then made durable by the next fsync.
+
+To bound the journal and the time taken to recover, the whole list is
+periodically written to a snapshot, which atomically replaces the previous
+one, and a new journal is started. The snapshot records the generation of
+the journal following it, so a crash whilst compacting never replays the
+same records twice:
+
+    - `<name>.snapshot`: the gifts and the current journal generation.
+    - `<name>.<generation>.journal`: the records since the snapshot.
+
+`JournaledGiftList` is a gift list made durable by such a journal.
+
+Examples
+--------
+.. code-block:: python
+
+    journal = GiftJournal('gift_journals/Liam')
+    gifts, records = journal.load()
+    journal.sync(journal.append(['a', {'id': 1}, 2]))
+
+"""
+import json
+import os
+import tempfile
+import threading
+
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import quote
+
+from loguru import logger
+
+from .gift_list import BasicGiftList, ConcurrentGiftList, GiftListFactory, _Gift, item_key
+from .utils.metrics import REGISTRY, Counter
+
+GIFT_JOURNAL_RECORDS = REGISTRY.register(Counter(
+    'gift_journal_records_total', 'Number of gift list changes appended to journals.'))
+GIFT_JOURNAL_FSYNCS = REGISTRY.register(Counter(
+    'gift_journal_fsyncs_total', 'Number of fsyncs of gift list journals.'))
+
+# a snapshotted gift: item, available, purchased
+SnapshotGift = List[Any]
+
+
+def _dumps(value: Any) -> str:
+    return json.dumps(value, separators=(',', ':'))
+
+
+def _fsync_directory(directory: str):
+    """Make the renaming or creation of files in `directory` durable."""
+    fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class GiftJournal:
+    """The journal and snapshot of a gift list, stored with path prefix `path`.
+
+    Parameters
+    ----------
+    path: str
+        The path of the files without their suffix, see above.
+    fsync: bool
+        Whether to fsync records, otherwise they are only flushed to the OS.
+    """
+
+    def __init__(self, path: str, fsync: bool = True):
+        self.path = path
+        self.fsync = fsync
+        self.generation = 0
+        self.records = 0  # appended since the snapshot
+        self._file = None
+        self._written = 0
+        self._synced = 0
+        self._lock = threading.Lock()  # guards appends
+        self._sync_lock = threading.Lock()
+
+    @property
+    def snapshot_path(self) -> str:
+        return f'{self.path}.snapshot'
+
+    def journal_path(self, generation: int) -> str:
+        """Return the path of the journal of `generation`."""
+        return f'{self.path}.{generation}.journal'
+
+    def load(self) -> Tuple[List[SnapshotGift], List[list]]:
+        """Read the snapshot and journal, opening the journal for appending.
+
+        A partially written final record, e.g. due to a crash, is discarded.
+
+        Returns
+        -------
+        Tuple[List[SnapshotGift], List[list]]
+            The gifts of the snapshot and the journal records following it.
+        """
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        gifts: List[SnapshotGift] = []
+        try:
+            with open(self.snapshot_path, encoding='utf8') as snapshot_fp:
+                snapshot = json.load(snapshot_fp)
+            self.generation, gifts = snapshot['generation'], snapshot['gifts']
+        except FileNotFoundError:
+            pass
+        if os.path.exists(self.journal_path(self.generation - 1)):
+            os.unlink(self.journal_path(self.generation - 1))  # crashed whilst compacting
+
+        records = []
+        path = self.journal_path(self.generation)
+        with open(path, 'ab+') as journal_fp:
+            journal_fp.seek(0)
+            end = 0
+            for line in journal_fp:
+                try:
+                    if not line.endswith(b'\n'):
+                        raise ValueError('record is incomplete')
+                    records.append(json.loads(line))
+                except ValueError:
+                    logger.warning(f'Discarding torn record at offset {end} of {path}')
+                    journal_fp.truncate(end)
+                    break
+                end += len(line)
+        self._file = open(path, 'a', encoding='utf8')  # pylint: disable=consider-using-with
+        self.records = len(records)
+        return gifts, records
+
+    def append(self, record: list) -> int:
+        """Append `record` to the journal, returning the position to `sync()` to."""
+        line = _dumps(record) + '\n'
+        with self._lock:
+            self._file.write(line)
+            self._written += 1
+            self.records += 1
+            position = self._written
+        GIFT_JOURNAL_RECORDS.inc()
+        return position
+
+    def sync(self, position: int):
+        """Make the records up to `position` durable, with those of other threads."""
+        with self._sync_lock:
+            if self._synced >= position:
+                return  # made durable by another thread's fsync
+            with self._lock:
+                self._file.flush()
+                written = self._written
+            if self.fsync:
+                # NOTE: outside of the append lock, so that other threads
+                # can append records to be made durable by the next fsync
+                os.fsync(self._file.fileno())
+                GIFT_JOURNAL_FSYNCS.inc()
+            self._synced = written
+
+    def snapshot(self, gifts: List[SnapshotGift]):
+        """Replace the snapshot with `gifts` and start a new, empty journal.
+
+        The caller must ensure that no records are appended concurrently.
+        """
+        with self._sync_lock, self._lock:
+            generation = self.generation + 1
+            new_file = open(self.journal_path(generation), 'a',  # pylint: disable=consider-using-with
+                            encoding='utf8')
+            directory = os.path.dirname(os.path.abspath(self.path))
+            fd, tmp_path = tempfile.mkstemp(prefix='.snapshot-', dir=directory)
+            try:
+                with os.fdopen(fd, 'w', encoding='utf8') as snapshot_fp:
+                    snapshot_fp.write(_dumps({'generation': generation, 'gifts': gifts}))
+                    snapshot_fp.flush()
+                    if self.fsync:
+                        os.fsync(snapshot_fp.fileno())
+                os.replace(tmp_path, self.snapshot_path)
+                if self.fsync:
+                    _fsync_directory(directory)
+            except BaseException:
+                new_file.close()
+                if os.path.exists(tmp_path):
+                    os.unlink(tmp_path)
+                raise
+            self._file.close()
+            os.unlink(self.journal_path(self.generation))
+            self._file, self.generation, self.records = new_file, generation, 0
+            self._synced = self._written  # every record is in the snapshot
+        logger.debug(f'Compacted {len(gifts)} gifts into {self.snapshot_path}')
+
+    def close(self):
+        """Flush and close the journal."""
+        with self._sync_lock, self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+def _item_stub(item: Dict[str, Any]) -> Dict[str, Any]:
+    """Return the smallest item with the same `item_key()` as `item`."""
+    return {'id': item['id']} if item.get('id') is not None else item
+
+
+class JournaledGiftList(ConcurrentGiftList):
+    """A `ConcurrentGiftList` made durable by a journal of its changes.
+
+    Each change is applied in memory, appended to the journal and fsync'd
+    before returning, with the changes of concurrent threads fsync'd
+    together. Every `snapshot_every` changes, the list is compacted into a
+    snapshot (see `GiftJournal`), during which changes wait. On creation,
+    the list is recovered from its snapshot and journal.
+
+    Only one instance per user should exist at once, e.g. using
+    `GiftListFactory`, and items must be JSON compatible.
+
+    Parameters
+    ----------
+    username_or_id: Union[int, str]
+        The user, which also names the journal files.
+    directory: Optional[str]
+        The directory of the journal files, by default `$GIFT_JOURNAL_DIR`
+        or `gift_journals`.
+    snapshot_every: int
+        The number of changes between snapshots.
+    fsync: bool
+        Whether to fsync changes, rather than only writing them to the OS.
+    """
+
+    BACKEND = 'journal'
+
+    def __init__(self, username_or_id, directory: Optional[str] = None,  # pylint: disable=too-many-arguments
+                 snapshot_every: int = 10000, fsync: bool = True, stripes: int = 64):
+        self._journal: Optional[GiftJournal] = None
+        super().__init__(username_or_id, stripes=stripes)
+        directory = directory or os.environ.get('GIFT_JOURNAL_DIR', 'gift_journals')
+        self.snapshot_every = snapshot_every
+        self._compacting = threading.Lock()
+        self._journal = GiftJournal(os.path.join(directory, quote(str(self.user), safe='')),
+                                    fsync=fsync)
+        self._recover()
+
+    def _recover(self):
+        gifts, records = self._journal.load()
+        for item, available, purchased in gifts:
+            gift = self._gifts[item_key(item)] = _Gift(item)
+            gift.available, gift.purchased = available, purchased
+        for operation, *args in records:
+            if operation == 'a':
+                BasicGiftList.add_item(self, *args)
+            elif operation == 'r':
+                BasicGiftList.remove_item(self, *args)
+            elif operation == 'p':
+                item, quantity = args
+                gift = self._gifts[item_key(item)]
+                gift.available -= quantity
+                gift.purchased += quantity
+            elif operation == 'c':
+                BasicGiftList.create_list(self)
+        if gifts or records:
+            logger.info(f'Recovered {len(self)} gifts of {self.user} from '
+                        f'{len(gifts)} snapshotted gifts and {len(records)} changes')
+
+    def _commit(self, position: int):
+        """Wait for the change at `position` to be durable, compacting if due."""
+        self._journal.sync(position)
+        if self._journal.records >= self.snapshot_every and \
+                self._compacting.acquire(blocking=False):
+            try:
+                if self._journal.records >= self.snapshot_every:
+                    self.compact()
+            finally:
+                self._compacting.release()
+
+    def compact(self):
+        """Write the list to a snapshot, replacing the journal."""
+        with self._all_locks():
+            self._journal.snapshot([[gift.item, gift.available, gift.purchased]
+                                    for gift in self._gifts.values()])
+
+    def close(self):
+        """Close the journal, after which the list must not be changed."""
+        self._journal.close()
+
+    def create_list(self) -> List[Dict[str, Any]]:
+        if self._journal is None:  # still being created
+            return super().create_list()
+        with self._all_locks():
+            gift_list = BasicGiftList.create_list(self)
+            position = self._journal.append(['c'])
+        self._commit(position)
+        return gift_list
+
+    def add_item(self, item: Dict[str, Any], quantity: int = 1):
+        with self._lock_for(item):
+            new = item_key(item) not in self._gifts
+            BasicGiftList.add_item(self, item, quantity)
+            position = self._journal.append(['a', item if new else _item_stub(item), quantity])
+        self._commit(position)
+
+    def remove_item(self, item: Dict[str, Any]):
+        with self._lock_for(item):
+            BasicGiftList.remove_item(self, item)
+            position = self._journal.append(['r', _item_stub(item)])
+        self._commit(position)
+
+    def purchase_item(self, gift: Dict[str, Any], quantity: int = 1):
+        with self._lock_for(gift):
+            BasicGiftList.purchase_item(self, gift, quantity)
+            position = self._journal.append(['p', _item_stub(gift), quantity])
+        self._commit(position)
+
+
+GiftListFactory.CLASSES['journal'] = JournaledGiftList
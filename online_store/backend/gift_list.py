@@ -9,21 +9,29 @@ BasicGiftList
 
 """
 import json
+import threading
 
 from abc import ABCMeta, abstractmethod
 from collections import defaultdict
-from typing import Any, Union, Dict, List, Iterable, Optional
+from contextlib import ExitStack
+from typing import Any, Union, Dict, Hashable, List, Iterable, Iterator, Optional, Tuple
 from loguru import logger
+from sqlalchemy import and_, case, func, inspect
 from sqlalchemy.orm.query import Query
 
 import sqlalchemy.exc
 
-
 from .models.item import ItemModel
 from .models.database import db
 from .models.user import UserModel
-from .models.gift import GiftListModel, GiftModel
+from .models.gift import GiftListModel, GiftListSummaryModel, GiftModel
+from .models.order import StockUnavailableError
+from .stock import StockLedger, get_stock_ledger
+from .utils.cache import get_item_json, invalidate_items
 from .utils.model_serialisers.json_encoder import AlchemyEncoder
+from .utils.metrics import (
+    GIFT_OVERSELL_REJECTIONS, GIFT_PURCHASED_QUANTITY, GIFT_PURCHASES, GIFT_STOCK_FAILURES
+)
 
 
 class AbstractGiftList(metaclass=ABCMeta):
@@ -70,26 +78,91 @@ class AbstractGiftList(metaclass=ABCMeta):
         raise NotImplementedError
 
 
+def item_key(item: Dict[str, Any]) -> Hashable:
+    """Return the key identifying `item` within a gift list.
+
+    Items are identified by their `id` where given, otherwise by their
+    contents, so that equal items always share the same key.
+    """
+    item_id = item.get('id')
+    return frozenset(item.items()) if item_id is None else item_id
+
+
+def _check_quantity(quantity: int):
+    if not isinstance(quantity, int):
+        raise ValueError(f'quantity must be an int, not {type(quantity)}')
+    if quantity <= 0:
+        raise ValueError('quantity must be a positive integer')
+
+
+def _item_id(item: Dict[str, Any]) -> int:
+    item_id = item.get('id')
+    if not isinstance(item_id, int):
+        raise ValueError(f'item {item!r} must have an integer id')
+    return item_id
+
+
+def print_report(user: Union[int, str], purchased: List[Tuple[Any, int]],
+                 available: List[Tuple[Any, int]]):
+    """Print the report of a gift list from its (item, quantity) pairs."""
+    print(f'Gift List Report for {user}:')
+    print("=" * 30)
+    print('Purchased items:')
+    if purchased:
+        print('   - ' + '\n  - '.join(['{} (quantity: {})'.format(*item)
+                                       for item in purchased]))
+    print('-' * 30)
+    print('Available items:')
+    if available:
+        print('  - ' + '\n  - '.join(['{} (quantity: {})'.format(*item)
+                                      for item in available]))
+
+
+class _Gift:  # pylint: disable=too-few-public-methods
+    __slots__ = ('item', 'available', 'purchased')
+
+    def __init__(self, item: Dict[str, Any]):
+        self.item = item
+        self.available = 0
+        self.purchased = 0
+
+
 class BasicGiftList(AbstractGiftList):
-    """A simple gift list implemenatation using Python's list class."""
+    """A simple gift list implemenatation using Python's dict class.
+
+    Gifts are indexed by `item_key()`, in the order they were added, so
+    adding, removing and purchasing a gift take constant time.
+    """
+
+    BACKEND = 'basic'
 
     def __init__(self, username_or_id):
         self.user = self.get_user(username_or_id)
-        self.gift_list = self.create_list()
-        self._availability_map = defaultdict(lambda: 0, {})
-        self._purchase_map = defaultdict(lambda: 0, {})
+        self._gifts: Dict[Hashable, _Gift] = {}
+        self.create_list()
 
     def __repr__(self) -> str:
         """Create user friendly representation of gift list."""
         return f'{self.user} -> {self.get_list()}'
 
+    def __len__(self) -> int:
+        return len(self._gifts)
+
+    @property
+    def gift_list(self) -> List[Dict[str, Any]]:
+        """The items of the gift list, in the order they were added."""
+        return [gift.item for gift in self._records()]
+
+    def _records(self) -> Iterable[_Gift]:
+        return self._gifts.values()
+
     def get_user(self, username_or_id: Union[int, str]) -> Union[int, str]:
         """Return user."""
         return username_or_id  # dummy method
 
     def create_list(self) -> List[Dict[str, Any]]:
         """Create a new gift list."""
-        self.gift_list = []
+        self._gifts = {}
         return self.gift_list
 
     def add_item(self, item: Dict[str, Any], quantity: int = 1):
@@ -110,51 +183,43 @@ class BasicGiftList(AbstractGiftList):
         -----
         It is up to the user to correctly represent the item when adding.
         """
-        if item not in self.gift_list:
-            self.gift_list.append(item)
-        if not isinstance(quantity, int):
-            raise ValueError(f'quantity must be an int, not {type(quantity)}')
-        elif quantity <= 0:
-            raise ValueError('quantity must be a positive integer')
-        self._availability_map[frozenset(item.items())] += quantity
+        _check_quantity(quantity)
+        key = item_key(item)
+        gift = self._gifts.get(key)
+        if gift is None:
+            gift = self._gifts[key] = _Gift(item)
+        gift.available += quantity
 
     def remove_item(self, item: Dict[str, Any]):
         """Remove item from gift list.
 
+        Raises
+        ------
+        ValueError
+            If `item` is not in gift list.
+
         Warnings
         --------
-        Does not consider availability or purchased totals when removing.
+        The available and purchased totals of the item are discarded.
         """
-        self.gift_list.remove(item)
+        if self._gifts.pop(item_key(item), None) is None:
+            raise ValueError(f'{item!r} is not in gift list')
+
+    def get_quantities(self, item: Dict[str, Any]) -> Tuple[int, int]:
+        """Return the number of `item` available and purchased."""
+        gift = self._gifts.get(item_key(item))
+        return (0, 0) if gift is None else (gift.available, gift.purchased)
 
     def create_report(self):
         """Print report of purchased and available gift items in list."""
         available = []
         purchased = []
-        for item in self.get_list():
-            if isinstance(item, dict):
-                hashable_item = frozenset(item.items())
-                num_purchased = self._purchase_map[hashable_item]
-                if num_purchased:
-                    purchased.append((item, num_purchased))
-                num_available = self._availability_map[hashable_item]
-                if num_available:
-                    available.append((item, num_available))
-            else:
-                # FIXME: force object to correct representation
-                raise ValueError(f'item {item!r} must be a dict, '
-                                 f'not {type(item)}')
-        print(f'Gift List Report for {self.user}:')
-        print("=" * 30)
-        print('Purchased items:')
-        if purchased:
-            print('   - ' + '\n  - '.join(['{} (quantity: {})'.format(*item)
-                                           for item in purchased]))
-        print('-' * 30)
-        print('Available items:')
-        if available:
-            print('  - ' + '\n  - '.join(['{} (quantity: {})'.format(*item)
-                                          for item in available]))
+        for gift in self._records():
+            if gift.purchased:
+                purchased.append((gift.item, gift.purchased))
+            if gift.available:
+                available.append((gift.item, gift.available))
+        print_report(self.user, purchased, available)
 
     def get_list(self) -> List[Dict[str, Any]]:
         """Return the gift list."""
@@ -173,13 +238,73 @@ class BasicGiftList(AbstractGiftList):
             If `gift` is not in gift list or quantity is greater than available
             number of desired gifts.
         """
-        hashable_gift = frozenset(gift.items())
-        available = self._availability_map[hashable_gift]
-        if quantity > available:
+        _check_quantity(quantity)
+        record = self._gifts.get(item_key(gift))
+        if record is None:
+            raise ValueError(f'{gift!r} is not in gift list')
+        if quantity > record.available:
+            GIFT_OVERSELL_REJECTIONS.inc(self.BACKEND)
             raise ValueError('Cannot purchase more items than available')
 
-        self._purchase_map[hashable_gift] += quantity
-        self._availability_map[hashable_gift] -= quantity
+        record.purchased += quantity
+        record.available -= quantity
+        GIFT_PURCHASES.inc(self.BACKEND)
+        GIFT_PURCHASED_QUANTITY.inc(self.BACKEND, amount=quantity)
+
+
+class ConcurrentGiftList(BasicGiftList):
+    """A thread-safe `BasicGiftList`, guarding gifts with striped locks.
+
+    Each gift is guarded by one of `stripes` locks, chosen by the hash of
+    its `item_key()`, so that purchases of different gifts rarely contend
+    whilst those of the same gift are serialized and never oversell it.
+    Reports are created without locking, so may omit operations in progress.
+    """
+
+    BACKEND = 'concurrent'
+
+    def __init__(self, username_or_id, stripes: int = 64):
+        self._locks = [threading.Lock() for _ in range(max(stripes, 1))]
+        super().__init__(username_or_id)
+
+    def _lock_for(self, item: Dict[str, Any]) -> threading.Lock:
+        return self._locks[hash(item_key(item)) % len(self._locks)]
+
+    def _records(self) -> Iterable[_Gift]:
+        # NOTE: copied in one step, as iterating fails if gifts are added concurrently
+        return tuple(self._gifts.values())
+
+    def _all_locks(self) -> ExitStack:
+        """Return a context holding every lock, i.e. excluding all other operations."""
+        stack = ExitStack()
+        for lock in self._locks:
+            stack.enter_context(lock)
+        return stack
+
+    def create_list(self) -> List[Dict[str, Any]]:
+        """Create a new gift list, once operations in progress complete."""
+        with self._all_locks():
+            return super().create_list()
+
+    def add_item(self, item: Dict[str, Any], quantity: int = 1):
+        with self._lock_for(item):
+            super().add_item(item, quantity)
+
+    def remove_item(self, item: Dict[str, Any]):
+        with self._lock_for(item):
+            super().remove_item(item)
+
+    def get_quantities(self, item: Dict[str, Any]) -> Tuple[int, int]:
+        with self._lock_for(item):
+            return super().get_quantities(item)
+
+    def purchase_item(self, gift: Dict[str, Any], quantity: int = 1):
+        with self._lock_for(gift):
+            super().purchase_item(gift, quantity)
+
+
+_SUMMARY_COLUMNS = ('total_desired', 'total_purchased', 'value_purchased', 'value_outstanding',
+                    'unpurchased', 'partially_purchased', 'fully_purchased')
 
 
 class SqlDatabaseGiftList(AbstractGiftList):
@@ -193,7 +318,7 @@ class SqlDatabaseGiftList(AbstractGiftList):
 
     def _get_user_id(self) -> int:
         """Helper method to return a user id."""
-        return getattr(self.get_user, 'id', -1)
+        return getattr(self.user, 'id', -1)
 
     def get_user(self, username_or_id: Union[int, str]) -> UserModel:
         if isinstance(username_or_id, str):
@@ -227,12 +352,15 @@ class SqlDatabaseGiftList(AbstractGiftList):
 
         try:
             item_id = get('item_id') or int(item)
+            quantity = int(get('quantity', 1))
+            summary = self.get_summary(create=True)
             gift = GiftModel(item_id=item_id,
                              list_id=self.gift_list.id,
-                             available=get('quantity', 1))
+                             available=quantity)
             db.session.add(gift)
+            self._update_summary(summary, None, (quantity, 0), self._item_price(item_id))
             db.session.commit()
-        except sqlalchemy.exc.SQLAlchemyError as err:
+        except (ValueError, sqlalchemy.exc.SQLAlchemyError) as err:
             logger.exception(err)
             db.session.rollback()
             successful = False
@@ -244,6 +372,9 @@ class SqlDatabaseGiftList(AbstractGiftList):
                         .filter_by(id=getattr(item, 'id', None) or int(item)) \
                         .first()
         if gift:
+            summary = self.get_summary(gift.list_id, create=True)
+            self._update_summary(summary, (gift.available, gift.purchased), None,
+                                 self._item_price(gift.item_id))
             db.session.delete(gift)
             db.session.commit()
             success = False
@@ -254,23 +385,81 @@ class SqlDatabaseGiftList(AbstractGiftList):
     def purchase_item(self, gift: Union[int, GiftModel], quantity: int = 1):
         """Purchase the given `quantity` of `gift` item from gift list."""
         if isinstance(gift, int):
-            gift = GiftModel(id=gift)
-        item = ItemModel(id=gift.item_id)
+            gift = GiftModel.query.get(gift)
+        summary = self.get_summary(gift.list_id, create=True)
+        item = ItemModel.query.get(gift.item_id)
 
         if quantity > gift.available:
+            GIFT_OVERSELL_REJECTIONS.inc('sql')
             raise ValueError('quantity greater than available gift number')
 
-        item.in_stock_quantity = item.in_stock_quantity or 10
+        ledger = get_stock_ledger()
+        if ledger is not None:
+            self._purchase_with_ledger(ledger, summary, gift, item, quantity)
+            return
+
+        before, after = self._take_gift(gift, quantity)
+        # NOTE: decremented in SQL, so concurrent purchases can't oversell the
+        # item, where items of unknown stock have 10
+        stock = func.coalesce(ItemModel.in_stock_quantity, 10)
+        if not ItemModel.query.filter(ItemModel.id == item.id, stock >= quantity) \
+                .update({ItemModel.in_stock_quantity: stock - quantity},
+                        synchronize_session=False):
+            db.session.rollback()
+            GIFT_STOCK_FAILURES.inc('sql')
+            raise ValueError('not enough stock of gift item')
+        self._update_summary(summary, before, after, item.price)
+        db.session.commit()
+        invalidate_items(item.id)
+        GIFT_PURCHASES.inc('sql')
+        GIFT_PURCHASED_QUANTITY.inc('sql', amount=quantity)
 
-        item.in_stock_quantity -= quantity
-        gift.available -= quantity
-        gift.purchased += quantity
+    @staticmethod
+    def _take_gift(gift: GiftModel, quantity: int) -> Tuple[Tuple[int, int], Tuple[int, int]]:
+        """Move `quantity` of `gift` from available to purchased, unless fewer are available.
 
-        if item.in_stock_quantity < 0:
+        The gift is updated in SQL, conditional on its availability, so that
+        concurrent purchases are neither lost nor oversold.
+
+        Returns
+        -------
+        Tuple[Tuple[int, int], Tuple[int, int]]
+            The gift's (available, purchased) quantities before and after.
+        """
+        if not GiftModel.query.filter(GiftModel.id == gift.id, GiftModel.available >= quantity) \
+                .update({GiftModel.available: GiftModel.available - quantity,
+                         GiftModel.purchased: GiftModel.purchased + quantity},
+                        synchronize_session=False):
             db.session.rollback()
-            raise ValueError('not enough stock of gift item')
-        else:
+            GIFT_OVERSELL_REJECTIONS.inc('sql')
+            raise ValueError('quantity greater than available gift number')
+        # NOTE: read once updated, so the row is locked (and written) by this transaction
+        available, purchased = db.session.query(GiftModel.available, GiftModel.purchased) \
+                                         .filter(GiftModel.id == gift.id).one()
+        return (available + quantity, purchased - quantity), (available, purchased)
+
+    @classmethod
+    def _purchase_with_ledger(cls, ledger: StockLedger,  # pylint: disable=too-many-arguments
+                              summary: GiftListSummaryModel, gift: GiftModel, item: ItemModel,
+                              quantity: int):
+        """Purchase `gift`, reserving stock of its `item` from the stock ledger."""
+        try:
+            reservation = ledger.reserve(item.id, quantity)
+        except StockUnavailableError as err:
+            db.session.rollback()
+            GIFT_STOCK_FAILURES.inc('sql')
+            raise ValueError('not enough stock of gift item') from err
+        try:
+            before, after = cls._take_gift(gift, quantity)
+            cls._update_summary(summary, before, after, item.price)
             db.session.commit()
+        except (ValueError, sqlalchemy.exc.SQLAlchemyError):
+            db.session.rollback()
+            ledger.release(reservation)
+            raise
+        ledger.commit(reservation)
+        GIFT_PURCHASES.inc('sql')
+        GIFT_PURCHASED_QUANTITY.inc('sql', amount=quantity)
 
     def create_report(self) -> dict:
         """Create a report of purchased and available gift items in JSON
@@ -279,8 +468,7 @@ class SqlDatabaseGiftList(AbstractGiftList):
         available = []
         purchased = []
         for gift_orm in self.get_list():
-            item_orm = ItemModel.query.filter_by(id=gift_orm.item_id).first()
-            item_data = self.item_as_json(item_orm)
+            item_data = json.loads(get_item_json(gift_orm.item_id) or b'null')
             if gift_orm.available > 0:
                 data = data = item_data.copy()
                 data['quantity'] = gift_orm.available
@@ -291,10 +479,113 @@ class SqlDatabaseGiftList(AbstractGiftList):
                 purchased.append(data)
         return {
             'user': getattr(self.user, 'id'),
+            'summary': self.get_summary().as_dict(),
             'purchased': purchased,
             'available': available
         }
 
+    REPORT_COLUMNS = ['list_id', 'user_id', 'gift_id', 'item_id', 'name', 'brand', 'price',
+                      'currency', 'status', 'quantity']
+
+    def report_rows(self, all_lists: bool = False,
+                    chunk_size: int = 1000) -> Iterator[Dict[str, Any]]:
+        """Yield the rows of a report of purchased and available gifts.
+
+        Each gift yields a 'purchased' and/or an 'available' row, see
+        `REPORT_COLUMNS`. The gifts are fetched `chunk_size` rows at a time,
+        so memory use doesn't depend on the number of gifts.
+
+        Parameters
+        ----------
+        all_lists: bool
+            Whether to report every gift list rather than only this list.
+        """
+        query = db.session.query(
+            GiftModel.list_id, GiftListModel.user_id, GiftModel.id, GiftModel.item_id,
+            ItemModel.name, ItemModel.brand, ItemModel.price, ItemModel.currency,
+            GiftModel.available, GiftModel.purchased,
+        ).join(GiftListModel, GiftListModel.id == GiftModel.list_id) \
+         .outerjoin(ItemModel, ItemModel.id == GiftModel.item_id) \
+         .order_by(GiftModel.list_id, GiftModel.id)
+        if not all_lists:
+            query = query.filter(GiftModel.list_id == self.gift_list.id)
+        for (list_id, user_id, gift_id, item_id, name, brand, price, currency,
+             available, purchased) in query.yield_per(chunk_size):
+            row = {'list_id': list_id, 'user_id': user_id, 'gift_id': gift_id,
+                   'item_id': item_id, 'name': name, 'brand': brand, 'price': price,
+                   'currency': currency}
+            if purchased > 0:
+                yield dict(row, status='purchased', quantity=purchased)
+            if available > 0:
+                yield dict(row, status='available', quantity=available)
+
+    def get_summary(self, list_id: Optional[int] = None,
+                    create: bool = False) -> GiftListSummaryModel:
+        """Return the summary of gift list `list_id`, by default this list.
+
+        Summaries of lists without one, e.g. created before summaries were
+        maintained, are computed from their gifts and, if `create` is set,
+        added to the session to be committed along with the caller's changes.
+        """
+        list_id = self.gift_list.id if list_id is None else list_id
+        summary = GiftListSummaryModel.query.get(list_id)
+        if summary is None:
+            summary = self.build_summary(list_id)
+            if create:
+                db.session.add(summary)
+        return summary
+
+    @staticmethod
+    def build_summary(list_id: int) -> GiftListSummaryModel:
+        """Return a summary of gift list `list_id` computed from its gifts."""
+        price = func.coalesce(ItemModel.price, 0.)
+        row = db.session.query(
+            func.sum(GiftModel.available + GiftModel.purchased),
+            func.sum(GiftModel.purchased),
+            func.sum(GiftModel.purchased * price),
+            func.sum(GiftModel.available * price),
+            func.sum(case([(GiftModel.purchased == 0, 1)], else_=0)),
+            func.sum(case([(and_(GiftModel.purchased > 0, GiftModel.available > 0), 1)],
+                          else_=0)),
+            func.sum(case([(and_(GiftModel.purchased > 0, GiftModel.available <= 0), 1)],
+                          else_=0)),
+        ).outerjoin(ItemModel, ItemModel.id == GiftModel.item_id) \
+         .filter(GiftModel.list_id == list_id).one()
+        return GiftListSummaryModel(list_id=list_id, **{
+            column: value or 0 for column, value in zip(_SUMMARY_COLUMNS, row)})
+
+    @staticmethod
+    def _item_price(item_id: int) -> Optional[float]:
+        return db.session.query(ItemModel.price).filter_by(id=item_id).scalar()
+
+    @staticmethod
+    def _update_summary(summary: GiftListSummaryModel,
+                        before: Optional[Tuple[int, int]], after: Optional[Tuple[int, int]],
+                        price: Optional[float]):
+        """Apply the change of a gift's (available, purchased) quantities to `summary`.
+
+        The totals of persisted summaries are incremented in SQL, so that
+        concurrent changes aren't lost.
+        """
+        price = price or 0.
+        available = (after or (0, 0))[0] - (before or (0, 0))[0]
+        purchased = (after or (0, 0))[1] - (before or (0, 0))[1]
+        deltas = {'total_desired': available + purchased,
+                  'total_purchased': purchased,
+                  'value_purchased': purchased * price,
+                  'value_outstanding': available * price}
+        if before is not None:
+            status = GiftListSummaryModel.status(*before)
+            deltas[status] = deltas.get(status, 0) - 1
+        if after is not None:
+            status = GiftListSummaryModel.status(*after)
+            deltas[status] = deltas.get(status, 0) + 1
+        persistent = inspect(summary).persistent
+        for column, delta in deltas.items():
+            if delta:
+                setattr(summary, column, getattr(GiftListSummaryModel, column) + delta
+                        if persistent else getattr(summary, column) + delta)
+
     def get_list(self) -> Query:
         """Return the gift list as an ORM query object."""
         return GiftModel.query.filter_by(list_id=self.gift_list.id)
@@ -326,6 +617,8 @@ class GiftListFactory:  # pylint: disable=too-few-public-methods
 
     CLASSES: Dict[str, AbstractGiftList] = \
         defaultdict(lambda: BasicGiftList, {
+            'basic': BasicGiftList,
+            'concurrent': ConcurrentGiftList,
             'sql': SqlDatabaseGiftList
         })
 
@@ -353,3 +646,9 @@ class GiftListFactory:  # pylint: disable=too-few-public-methods
         if user_name_or_id not in cls.GIFT_LISTS:
             cls.GIFT_LISTS[user_name_or_id] = gift_list_cls(user_name_or_id)
         return cls.GIFT_LISTS[user_name_or_id]
+
+
+# NOTE: the engines of these modules derive from the classes above and add
+# themselves to GiftListFactory.CLASSES, so can only be imported last
+# pylint: disable=wrong-import-position,unused-import,cyclic-import
+from . import columnar_gifts, gift_journal, shared_gifts  # noqa: E402,F401
@@ -1,5 +1,7 @@
 """Defines models for gift list."""
-from sqlalchemy import Column, Integer, ForeignKey
+from typing import Any, Dict
+
+from sqlalchemy import Column, Float, Integer, ForeignKey
 from .database import db
 
 
@@ -43,3 +45,59 @@ class GiftListModel(db.Model):  # pylint: disable=too-few-public-methods
 
     id = Column(Integer, primary_key=True)  # pylint: disable=invalid-name
     user_id = Column(ForeignKey('users.id'), nullable=True)  # allow anon
+
+
+class GiftListSummaryModel(db.Model):  # pylint: disable=too-few-public-methods
+    """Model for the running totals of a gift list.
+
+    The summary of a list is updated in the same transaction as each change
+    to its gifts, so that reports and progress can be answered without
+    reading every gift.
+
+    Attributes
+    ----------
+    list_id: int
+        The unique ID of the gift list from the gift_lists table.
+    total_desired: int
+        The total quantity of gifts desired, whether purchased or not.
+    total_purchased: int
+        The total quantity of gifts purchased.
+    value_purchased: float
+        The total price of the gifts purchased.
+    value_outstanding: float
+        The total price of the gifts yet to be purchased.
+    unpurchased: int
+        The number of gifts of which none have been purchased.
+    partially_purchased: int
+        The number of gifts of which some, but not all, have been purchased.
+    fully_purchased: int
+        The number of gifts of which all have been purchased.
+    """
+    __tablename__ = 'gift_list_summaries'
+
+    list_id = Column(ForeignKey('gift_lists.id'), primary_key=True)
+    total_desired = Column(Integer, default=0, nullable=False)
+    total_purchased = Column(Integer, default=0, nullable=False)
+    value_purchased = Column(Float, default=0., nullable=False)
+    value_outstanding = Column(Float, default=0., nullable=False)
+    unpurchased = Column(Integer, default=0, nullable=False)
+    partially_purchased = Column(Integer, default=0, nullable=False)
+    fully_purchased = Column(Integer, default=0, nullable=False)
+
+    STATUSES = ('unpurchased', 'partially_purchased', 'fully_purchased')
+
+    @staticmethod
+    def status(available: int, purchased: int) -> str:
+        """Return the purchase status of a gift."""
+        if not purchased:
+            return 'unpurchased'
+        return 'fully_purchased' if available <= 0 else 'partially_purchased'
+
+    def as_dict(self) -> Dict[str, Any]:
+        """Return the summary, including progress, in JSON compatible representation."""
+        summary = {column.name: getattr(self, column.name) or 0
+                   for column in self.__table__.columns}
+        summary['gifts'] = sum(summary[status] for status in self.STATUSES)
+        summary['progress'] = \
+            summary['total_purchased'] / summary['total_desired'] if summary['total_desired'] else 0.
+        return summary
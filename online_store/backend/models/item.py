@@ -12,6 +12,7 @@ import sqlalchemy.exc
 
 
 from .database import db
+from ..utils.cache import invalidate_items
 
 
 class ItemModel(db.Model):  # pylint: disable=too-few-public-methods
@@ -47,8 +48,9 @@ class ItemModel(db.Model):  # pylint: disable=too-few-public-methods
         with open(filepath) as json_fp:
             data = json.load(json_fp)
 
+            logger.info('Loading {} store items into database', len(data))
             for i, item in enumerate(data):
-                logger.info(f"Loading store item {i} into database")
+                logger.debug('Loading store item {} into database', i)
                 price = item.get('price', None)
                 if isinstance(price, str):
                     item['price'] = float(re.sub('[A-Za-z ]+', '', price))
@@ -59,6 +61,7 @@ class ItemModel(db.Model):  # pylint: disable=too-few-public-methods
                 except sqlalchemy.exc.IntegrityError as err:
                     logger.error(err)
                     db.session.rollback()
+        invalidate_items()
 
 
 class ItemImageModel(db.Model):  # pylint: disable=too-few-public-methods
@@ -1,6 +1,5 @@
 """Module describing users as an ORM model."""
 from enum import Enum, auto
-from passlib.hash import pbkdf2_sha256 as sha256
 
 from sqlalchemy import Column, Integer, String
 from .database import db
@@ -71,9 +70,11 @@ class UserModel(db.Model):
     @staticmethod
     def generate_hash(password: str) -> str:
         """Generate password hash using SHA256 algorithm."""
+        from passlib.hash import pbkdf2_sha256 as sha256  # pylint: disable=import-outside-toplevel
         return sha256.hash(password)
 
     @staticmethod
     def verify_hash(password: str, hashed_password: str) -> str:
         """Verifies `password` against stored password `hash`."""
+        from passlib.hash import pbkdf2_sha256 as sha256  # pylint: disable=import-outside-toplevel
         return sha256.verify(password, hashed_password)
@@ -0,0 +1,79 @@
+"""Defines the API routes for administrative diagnostics."""
+from functools import wraps
+from http import HTTPStatus
+from typing import Callable, Optional, Tuple
+
+from flask import Blueprint, jsonify, Response
+from flask_jwt_extended import get_jwt_identity, jwt_required
+
+from ..models.user import UserModel, UserRole
+from ..utils.slow_queries import SLOW_QUERIES
+
+admin_router = Blueprint('admin', __name__)  # pylint: disable=invalid-name
+
+
+def forbidden_unless_admin(user: Optional[UserModel]) -> Optional[Tuple[Response, int]]:
+    """Return a 403 (Forbidden) response unless `user` is an admin, else None."""
+    if user is None or user.role != int(UserRole.ADMIN):
+        code = HTTPStatus.FORBIDDEN
+        return jsonify({'msg': 'Admin access required', 'status': 'error',
+                        'code': code}), code
+    return None
+
+
+def admin_required(func: Callable) -> Callable:
+    """Decorator restricting a (JWT protected) route to admin users."""
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        forbidden = forbidden_unless_admin(
+            UserModel.query.filter_by(username=get_jwt_identity()).first())
+        if forbidden is not None:
+            return forbidden
+        return func(*args, **kwargs)
+    return wrapper
+
+
+@admin_router.route('/slow-queries', methods=['GET'])
+@jwt_required
+@admin_required
+def slow_queries() -> Response:
+    """
+    List recent slow SQL statements.
+    ---
+    description: The most recent SQL statements exceeding the slow query
+                 threshold (most recent first), including parameter types,
+                 calling endpoint and query plan.
+    security:
+      - bearerAuth: []
+    responses:
+      200:
+        description: List of slow queries.
+      403:
+        description: User is not an admin.
+    tags:
+      - admin
+    """
+    return jsonify(SLOW_QUERIES.entries()), HTTPStatus.OK
+
+
+@admin_router.route('/slow-queries', methods=['DELETE'])
+@jwt_required
+@admin_required
+def clear_slow_queries() -> Response:
+    """
+    Clear the slow query log.
+    ---
+    description: Remove all slow queries held in memory by this worker.
+    security:
+      - bearerAuth: []
+    responses:
+      200:
+        description: Slow queries cleared.
+      403:
+        description: User is not an admin.
+    tags:
+      - admin
+    """
+    SLOW_QUERIES.clear()
+    code = HTTPStatus.OK
+    return jsonify({'msg': 'Slow queries cleared', 'status': 'ok', 'code': code}), code
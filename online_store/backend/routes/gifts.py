@@ -1,10 +1,13 @@
 """Defines the API routes for user gift lists."""
 from http import HTTPStatus
-from flask import Blueprint, jsonify, request, Response
+from flask import Blueprint, jsonify, request, Response, stream_with_context
 from flask_jwt_extended import get_jwt_identity, jwt_required
 
 from ..utils.query import query_to_json_response, safe_query
+from ..utils.single_flight import single_flight
 from ..models.user import UserModel
+from ..utils.streaming import STREAM_MIMETYPES, encode_rows
+from .admin import forbidden_unless_admin
 
 from ..gift_list import AbstractGiftList, GiftListFactory
 
@@ -23,21 +26,98 @@ def get_giftlist() -> AbstractGiftList:
 
 @gifts_router.route('/list/report')
 @jwt_required
+@single_flight
 def gift_report() -> Response:
     """
     Produce report of purchased and non-purchased gifts within user list.
     ---
     description: Produce report of user's gift list.
+    parameters:
+      - name: format
+        in: query
+        type: string
+        enum: [json, csv, ndjson]
+        required: false
+        description: The report format, csv and ndjson are streamed with one
+                     row per purchased or available gift (default is json).
+      - name: scope
+        in: query
+        type: string
+        enum: [list, all]
+        required: false
+        description: Report every gift list (admin only, csv or ndjson only).
     responses:
       200:
         description: JSON report successfully generated.
+      400:
+        description: Unsupported format or scope.
+      403:
+        description: Only admins can report every gift list.
       204:
         description: No gifts in user's list.
     tags:
       - gifts
     """
+    fmt = request.args.get('format', 'json')
+    scope = request.args.get('scope', 'list')
+    if fmt != 'json' and fmt not in STREAM_MIMETYPES or scope not in ('list', 'all'):
+        code = HTTPStatus.BAD_REQUEST
+        return jsonify({'msg': f'Unsupported report format {fmt!r} or scope {scope!r}',
+                        'status': 'error', 'code': code}), code
+    if scope == 'all':
+        forbidden = forbidden_unless_admin(get_user())
+        if forbidden is not None:
+            return forbidden
+
     gift_list: AbstractGiftList = get_giftlist()
-    return jsonify(gift_list.create_report()), HTTPStatus.OK
+    if fmt == 'json':
+        if scope == 'all':
+            code = HTTPStatus.BAD_REQUEST
+            return jsonify({'msg': 'Reports of all lists must use format csv or ndjson',
+                            'status': 'error', 'code': code}), code
+        return jsonify(gift_list.create_report()), HTTPStatus.OK
+
+    rows = gift_list.report_rows(all_lists=scope == 'all')
+    return Response(stream_with_context(encode_rows(rows, fmt, gift_list.REPORT_COLUMNS)),
+                    mimetype=STREAM_MIMETYPES[fmt], status=HTTPStatus.OK)
+
+
+@gifts_router.route('/list/summary')
+@jwt_required
+def gift_summary() -> Response:
+    """
+    Summarise the progress of purchases of the user's gift list.
+    ---
+    description: Return the running totals of the user's gift list.
+    security:
+      - bearerAuth: []
+    responses:
+      200:
+        description: Gift list summary.
+        content:
+          application/json:
+            type: object
+            properties:
+              total_desired:
+                type: integer
+                description: Total quantity of gifts desired.
+              total_purchased:
+                type: integer
+                description: Total quantity of gifts purchased.
+              value_purchased:
+                type: number
+                description: Total price of gifts purchased.
+              value_outstanding:
+                type: number
+                description: Total price of gifts yet to be purchased.
+              progress:
+                type: number
+                description: Fraction of the desired quantity purchased.
+    tags:
+      - gifts
+    """
+    gift_list = get_giftlist()
+    return jsonify(gift_list.get_summary().as_dict()), HTTPStatus.OK
 
 
 @gifts_router.route('/list/add', methods=['POST'])
@@ -0,0 +1,24 @@
+"""Provides a Prometheus compatible metrics endpoint."""
+from flask import Blueprint, Response
+
+from ..utils.metrics import metrics_response
+
+metrics_router = Blueprint('metrics', __name__)  # pylint: disable=invalid-name
+
+
+@metrics_router.route('/metrics')
+def metrics() -> Response:
+    """
+    Application metrics.
+    ---
+    description: Request latency, in-flight requests, response sizes and
+                 gift/order counters for this worker in Prometheus text format.
+    produces:
+      - text/plain
+    responses:
+      200:
+        description: Metrics in Prometheus text exposition format.
+    tags:
+      - metrics
+    """
+    return metrics_response()
@@ -1,23 +1,36 @@
 """Module for providing store API routes."""
-from typing import List, Optional, Union
+from typing import List, Optional, Tuple, Union
 from http import HTTPStatus
 
 from sqlalchemy.orm import load_only
 import sqlalchemy.exc
 
-from flask import Blueprint, request, Response
+from flask import Blueprint, jsonify, make_response, request, Response
 from loguru import logger
 
+from ..catalogue import FIELDS as SNAPSHOT_FIELDS, current_snapshot, parse_filters
+from ..facets import count_facets, facets_response, get_price_buckets, parse_price_buckets
 from ..models.database import db
+from ..search import get_item_search
+from ..stock import Reservation, StockLedger, get_stock_ledger
+from ..suggest import get_item_suggestions
 from ..models.item import ItemModel
 from ..models.user import UserModel
 from ..models.order import (
     OrderItemModel, OrderModel, OrderStatus, StockUnavailableError
 )
+from ..utils.cache import get_item_json, invalidate_items, items_response
 from ..utils.query import safe_query, query_to_json_response
+from ..utils.single_flight import single_flight
+from ..utils.metrics import ORDERS, ORDER_STOCK_FAILURES
 
 store_router = Blueprint('store', __name__, url_prefix='/store')  # pylint: disable=invalid-name
 
+SEARCH_PER_PAGE = 20
+SEARCH_MAX_PER_PAGE = 100
+SUGGEST_LIMIT = 10
+SUGGEST_MAX_LIMIT = 50
+
 
 @store_router.route('/')
 def store():
@@ -27,6 +40,7 @@ def store():
 
 
 @store_router.route('/items', strict_slashes=False)
+@single_flight
 @safe_query
 def items():
     """
@@ -42,13 +56,158 @@ def items():
         - store
     """
     params = dict(request.args)
-    fields: Optional[List[str]] = \
-        str(params.pop('fields', "")).split(',')
-    purchased: bool = bool(params.pop('purchased', False))  # pylint: disable=unused-variable
-    query = ItemModel.query \
-                     .filter_by(**params) \
-                     .options(load_only(*fields))  # FIXME:
-    return query_to_json_response(query.all())
+
+    def query_items() -> Response:
+        fields: Optional[List[str]] = \
+            [field for field in str(params.pop('fields', "")).split(',') if field]
+        purchased: bool = bool(params.pop('purchased', False))  # pylint: disable=unused-variable
+        snapshot = current_snapshot()
+        filters = parse_filters(params) if snapshot is not None else None
+        if filters is not None and set(fields) <= set(SNAPSHOT_FIELDS):
+            return query_to_json_response(list(snapshot.items(filters)))
+        query = ItemModel.query.filter_by(**params)
+        if fields:
+            # NOTE: never pass an empty field, as load_only('') defers every other
+            # column, which are then lazily loaded one query per row (N+1)
+            query = query.options(load_only(*fields))  # FIXME:
+        return query_to_json_response(query.all())
+
+    return items_response(query_items)
+
+
+@store_router.route('/items/search', strict_slashes=False)
+@safe_query
+def search_items():
+    """
+    Search items method.
+    ---
+    description: Search items by name and brand, best matches first.
+    parameters:
+      - in: query
+        name: q
+        type: string
+        required: true
+        description: Words to search for, each matching the start of a word.
+      - in: query
+        name: page
+        type: integer
+        default: 1
+      - in: query
+        name: per_page
+        type: integer
+        default: 20
+        description: The number of items per page, at most 100.
+    responses:
+      200:
+        description: A page of matching items, with their names and brands highlighted.
+      400:
+        description: Missing query or invalid page.
+    tags:
+        - store
+    """
+    query = request.args.get('q', '').strip()
+    try:
+        page = int(request.args.get('page', 1))
+        per_page = int(request.args.get('per_page', SEARCH_PER_PAGE))
+    except ValueError:
+        page = per_page = 0
+    if not query or page < 1 or not 1 <= per_page <= SEARCH_MAX_PER_PAGE:
+        code = HTTPStatus.BAD_REQUEST
+        return jsonify({'msg': f'A query q, page >= 1 and per_page of 1 to '
+                               f'{SEARCH_MAX_PER_PAGE} are required',
+                        'status': 'error', 'code': code}), code
+    # NOTE: one more item than requested is fetched, to tell if there's a next page
+    found = get_item_search().search(db.session.connection(), query, limit=per_page + 1,
+                                     offset=(page - 1) * per_page)
+    return jsonify({'query': query, 'page': page, 'per_page': per_page,
+                    'next_page': page + 1 if len(found) > per_page else None,
+                    'items': found[:per_page]}), HTTPStatus.OK
+
+
+@store_router.route('/items/suggest', strict_slashes=False)
+def suggest_items():
+    """
+    Suggest items method.
+    ---
+    description: Suggest the most popular items with a word of their name or brand
+        starting with the query, e.g. as it is typed.
+    parameters:
+      - in: query
+        name: q
+        type: string
+        required: true
+      - in: query
+        name: limit
+        type: integer
+        default: 10
+        description: The maximum number of items, at most 50.
+    responses:
+      200:
+        description: The most popular matching items.
+      400:
+        description: Invalid limit.
+      501:
+        description: Suggestions are disabled.
+    tags:
+        - store
+    """
+    suggestions = get_item_suggestions()
+    if suggestions is None:
+        code = HTTPStatus.NOT_IMPLEMENTED
+        return jsonify({'msg': 'Suggestions are disabled', 'status': 'error',
+                        'code': code}), code
+    try:
+        limit = int(request.args.get('limit', SUGGEST_LIMIT))
+    except ValueError:
+        limit = 0
+    if not 1 <= limit <= SUGGEST_MAX_LIMIT:
+        code = HTTPStatus.BAD_REQUEST
+        return jsonify({'msg': f'limit must be 1 to {SUGGEST_MAX_LIMIT}', 'status': 'error',
+                        'code': code}), code
+    query = request.args.get('q', '')
+    return jsonify({'query': query, 'items': suggestions.suggest(query, limit)}), HTTPStatus.OK
+
+
+@store_router.route('/items/facets', strict_slashes=False)
+@single_flight
+@safe_query
+def item_facets():
+    """
+    Item facets method.
+    ---
+    description: Count the items matching the filters per brand, currency and
+        price bucket, e.g. to show next to a listing of `/store/items`.
+    parameters:
+      - in: query
+        name: price_buckets
+        type: string
+        description: Ascending price bucket boundaries, e.g. 50,100,250,500.
+    responses:
+      200:
+        description: The number of matching items per brand, currency and price bucket.
+      400:
+        description: Invalid filters or price buckets.
+    tags:
+        - store
+    """
+    params = dict(request.args)
+
+    def query_facets() -> Response:
+        code = HTTPStatus.BAD_REQUEST
+        try:
+            buckets = parse_price_buckets(params.pop('price_buckets')) \
+                if 'price_buckets' in params else get_price_buckets()
+        except ValueError as err:
+            return make_response(jsonify({'msg': str(err), 'status': 'error', 'code': code}),
+                                 code)
+        filters = parse_filters(params)
+        if filters is None:
+            return make_response(jsonify({'msg': 'Filters must be item fields of the correct type',
+                                          'status': 'error', 'code': code}), code)
+        counts = count_facets(db.session.connection(), filters, buckets)
+        return make_response(jsonify({'filters': filters, **counts}), HTTPStatus.OK)
+
+    return facets_response(query_facets)
 
 
 @store_router.route('/items', methods=['POST'])
@@ -99,8 +258,64 @@ def item(item_id: int):
     tags:
         - store
     """
-    query = ItemModel.query.filter_by(id=item_id)
-    return query_to_json_response(query.first())
+    snapshot = current_snapshot()
+    body = snapshot.item_json(item_id) if snapshot is not None else get_item_json(item_id)
+    if body is None:
+        return Response(None, mimetype='application/json', status=HTTPStatus.NO_CONTENT)
+    return Response(body, mimetype='application/json', status=HTTPStatus.OK)
+
+
+def _find_item(item_data: dict) -> Optional[ItemModel]:
+    item = ItemModel.query \
+                    .filter_by(id=item_data.get('item_id', None)) \
+                    .first()
+    if not item:
+        item = ItemModel.query \
+                        .filter_by(name=item_data['item_name']) \
+                        .first()
+    return item
+
+
+def _reserve_stock(ledger: StockLedger, items: List[dict],
+                   reservations: List[Reservation]) -> List[Tuple[int, int]]:
+    """Reserve the stock of `items` from `ledger`, adding to `reservations`.
+
+    Returns the id and quantity of each item ordered.
+    """
+    order_items = []
+    for item_data in items:
+        item = _find_item(item_data)
+        quantity = item_data.get('quantity', 1)
+        reservations.append(ledger.reserve(item.id, quantity))
+        order_items.append((item.id, quantity))
+    return order_items
+
+
+def _decrement_stock(items: List[dict]) -> List[Tuple[int, int]]:
+    """Decrement the stock of `items` in the session, when there is no ledger.
+
+    Returns the id and quantity of each item ordered.
+    """
+    order_items = []
+    for item_data in items:
+        item = _find_item(item_data)
+        quantity = item_data.get('quantity', 1)
+        if item.in_stock_quantity - quantity < 0:
+            raise StockUnavailableError(f"Only {item.in_stock_quantity} "
+                                        f"{item.name}, but {quantity} have"
+                                        " been requested")
+        item.in_stock_quantity -= quantity
+        order_items.append((item.id, quantity))
+    return order_items
+
+
+def _settle_stock(ledger: Optional[StockLedger], order_items: List[Tuple[int, int]],
+                  reservations: List[Reservation]):
+    """Commit the `reservations` of a committed order, else invalidate its items."""
+    if ledger is None:
+        invalidate_items(*(item_id for item_id, _ in order_items))
+    for reservation in reservations:
+        ledger.commit(reservation)
 
 
 def _create_order(order_data: dict) -> OrderStatus:
@@ -118,35 +333,36 @@ def _create_order(order_data: dict) -> OrderStatus:
     except (AttributeError, KeyError, sqlalchemy.exc.DBAPIError) as err:
         logger.exception(err)
         db.session.rollback()
+        ORDERS.inc(str(status))
         return status
 
     items = order_data.get('items', [])
+    ledger = get_stock_ledger()
+    reservations: List[Reservation] = []
     try:
-        for item_data in items:
-            item = ItemModel.query \
-                            .filter_by(id=item_data.get('item_id', None)) \
-                            .first()
-            if not item:
-                item = ItemModel.query \
-                                .filter_by(name=item_data['item_name']) \
-                                .first()
-            quantity = item_data.get('quantity', 1)
-
-            if item.in_stock_quantity - quantity < 0:
-                raise StockUnavailableError(f"Only {item.in_stock_quantity} "
-                                            f"{item.name}, but {quantity} have"
-                                            " been requested")
-
-            order_item = OrderItemModel(order_id=order.id,
-                                        item=item.id,
-                                        quantity=quantity)
-            db.session.add(order_item)
-            item.in_stock_quantity -= quantity
+        # NOTE: stock must be reserved before the session writes, as the
+        # ledger leases stock from the items table on its own connection
+        with db.session.no_autoflush:
+            if ledger is not None:
+                order_items = _reserve_stock(ledger, items, reservations)
+            else:
+                order_items = _decrement_stock(items)
+
+        db.session.flush()  # assigns order.id
+        for item_id, quantity in order_items:
+            db.session.add(OrderItemModel(order_id=order.id, item=item_id, quantity=quantity))
         db.session.commit()
+        _settle_stock(ledger, order_items, reservations)
         status = OrderStatus.CREATED
-    except (AttributeError, TypeError, KeyError, StockUnavailableError) as err:
+    except (AttributeError, TypeError, KeyError, ValueError, StockUnavailableError,
+            sqlalchemy.exc.DBAPIError) as err:
         logger.exception(err)
         db.session.rollback()
+        for reservation in reservations:
+            ledger.release(reservation)
+        if isinstance(err, StockUnavailableError):
+            ORDER_STOCK_FAILURES.inc()
+    ORDERS.inc(str(status))
     return status
 
 
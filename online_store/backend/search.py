@@ -0,0 +1,192 @@
+"""Provides full-text search of store items by name and brand.
+
+For SQLite databases, item names and brands are indexed by an FTS5 virtual
+table, `items_fts`, which stores no copy of the text (it is an external
+content table over `items`) and is kept in sync by triggers on the `items`
+table. Only changes to names and brands reindex an item, so stock updates
+don't touch the index. Queries are split into terms, each matched as a
+prefix of a word (so `le cre` finds "Le Creuset"), ignoring case and
+diacritics, ranked by bm25 with names weighted above brands.
+
+Other databases, or SQLite builds without FTS5, fall back to matching every
+term anywhere in the name or brand with `LIKE '%term%'`, in id order, which
+scans the whole table.
+
+Examples
+--------
+.. code-block:: python
+
+    search = ItemSearch(fts=True)
+    search.search(db.session.connection(), 'le cre', limit=2)
+    # [{'id': 3, 'name': 'Le Creuset Casserole Dish', ...,
+    #   'highlight': {'name': '<mark>Le</mark> <mark>Creuset</mark> Casserole Dish', ...}}]
+
+"""
+import html
+import re
+
+from typing import Any, Dict, List, Optional
+
+from flask import Flask, current_app
+from loguru import logger
+from sqlalchemy import text
+
+import sqlalchemy.exc
+
+from .utils.config import config_flag
+
+SEARCH_TABLE = 'items_fts'
+MAX_TERMS = 8
+# bm25 weights of the name and brand columns
+NAME_WEIGHT, BRAND_WEIGHT = 2.0, 1.0
+
+# NOTE: highlighted with control characters, replaced once the text is escaped
+_OPEN, _CLOSE = '\x02', '\x03'
+# words as split by the unicode61 tokenizer, which treats '_' as a separator
+_TERM = re.compile(r'[^\W_]+')
+
+_ITEM_COLUMNS = 'items.id, items.name, items.brand, items.price, items.currency, ' \
+                'items.in_stock_quantity'
+_FTS_SEARCH = text(
+    f'SELECT {_ITEM_COLUMNS}, '
+    f"highlight({SEARCH_TABLE}, 0, '{_OPEN}', '{_CLOSE}'), "
+    f"highlight({SEARCH_TABLE}, 1, '{_OPEN}', '{_CLOSE}'), "
+    f'bm25({SEARCH_TABLE}, {NAME_WEIGHT}, {BRAND_WEIGHT}) AS score '
+    f'FROM {SEARCH_TABLE} JOIN items ON items.id = {SEARCH_TABLE}.rowid '
+    f'WHERE {SEARCH_TABLE} MATCH :match ORDER BY score, items.id '
+    'LIMIT :limit OFFSET :offset')
+
+
+def fts_statements() -> List[str]:
+    """Return the SQLite statements creating the index and its triggers."""
+    columns = 'new.id, new.name, new.brand'
+    delete = (f"INSERT INTO {SEARCH_TABLE} ({SEARCH_TABLE}, rowid, name, brand) "
+              "VALUES ('delete', old.id, old.name, old.brand);")
+    insert = f'INSERT INTO {SEARCH_TABLE} (rowid, name, brand) VALUES ({columns});'
+    return [
+        f'CREATE VIRTUAL TABLE IF NOT EXISTS {SEARCH_TABLE} USING fts5('
+        "name, brand, content='items', content_rowid='id', "
+        "tokenize='unicode61 remove_diacritics 2', prefix='2 3')",
+        f'CREATE TRIGGER IF NOT EXISTS {SEARCH_TABLE}_insert AFTER INSERT ON items '
+        f'BEGIN {insert} END',
+        f'CREATE TRIGGER IF NOT EXISTS {SEARCH_TABLE}_delete AFTER DELETE ON items '
+        f'BEGIN {delete} END',
+        f'CREATE TRIGGER IF NOT EXISTS {SEARCH_TABLE}_update '
+        f'AFTER UPDATE OF id, name, brand ON items BEGIN {delete} {insert} END',
+    ]
+
+
+def search_terms(query: str) -> List[str]:
+    """Return the (at most `MAX_TERMS`) words of `query` to search for."""
+    return _TERM.findall(query)[:MAX_TERMS]
+
+
+def match_expression(terms: List[str]) -> str:
+    """Return the FTS5 query matching a word starting with each of `terms`."""
+    # NOTE: quoted, so that terms such as 'AND' or 'NEAR' aren't operators
+    return ' '.join(f'"{term}"*' for term in terms)
+
+
+def _mark(value: Optional[str], terms: List[str]) -> Optional[str]:
+    """Mark occurrences of `terms` in `value`, as `LIKE` matches them."""
+    if not value:
+        return value
+    pattern = '|'.join(re.escape(term) for term in sorted(terms, key=len, reverse=True))
+    return re.sub(f'({pattern})', f'{_OPEN}\\1{_CLOSE}', value, flags=re.IGNORECASE)
+
+
+def _highlight(marked: Optional[str]) -> Optional[str]:
+    """Escape `marked` as HTML, with its marked terms in `<mark>` elements."""
+    if marked is None:
+        return None
+    return html.escape(marked).replace(_OPEN, '<mark>').replace(_CLOSE, '</mark>')
+
+
+def _escape_like(term: str) -> str:
+    return term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+class ItemSearch:
+    """Searches store items by name and brand.
+
+    Parameters
+    ----------
+    fts: bool
+        Whether to use the FTS5 index, see `init_search()`, else `LIKE`.
+    """
+
+    def __init__(self, fts: bool = True):
+        self.fts = fts
+
+    def search(self, connection, query: str, limit: int = 20,
+               offset: int = 0) -> List[Dict[str, Any]]:
+        """Return the items best matching `query`, skipping the first `offset`.
+
+        Each item has a `highlight` of its name and brand, as HTML with the
+        matched terms in `<mark>` elements, and, when using the index, its
+        bm25 `score` (lower is better).
+        """
+        terms = search_terms(query)
+        if not terms:
+            return []
+        if self.fts:
+            rows = connection.execute(_FTS_SEARCH, match=match_expression(terms),
+                                      limit=limit, offset=offset).fetchall()
+        else:
+            rows = self._search_like(connection, terms, limit, offset)
+        return [{'id': row[0], 'name': row[1], 'brand': row[2], 'price': row[3],
+                 'currency': row[4], 'in_stock_quantity': row[5],
+                 'highlight': {'name': _highlight(row[6]), 'brand': _highlight(row[7])},
+                 'score': row[8]} for row in rows]
+
+    @staticmethod
+    def _search_like(connection, terms: List[str], limit: int, offset: int) -> list:
+        conditions = ' AND '.join(
+            f"(items.name LIKE :term{index} ESCAPE '\\' OR items.brand LIKE :term{index} "
+            "ESCAPE '\\')" for index in range(len(terms)))
+        params = {f'term{index}': f'%{_escape_like(term)}%' for index, term in enumerate(terms)}
+        rows = connection.execute(text(
+            f'SELECT {_ITEM_COLUMNS} FROM items WHERE {conditions} '
+            'ORDER BY items.id LIMIT :limit OFFSET :offset'),
+                                  limit=limit, offset=offset, **params).fetchall()
+        return [tuple(row) + (_mark(row[1], terms), _mark(row[2], terms), None)
+                for row in rows]
+
+
+def install_search_index(engine) -> bool:
+    """Create the FTS5 index of items and its triggers, if missing.
+
+    The index is rebuilt from the items table when created, e.g. for an
+    existing database. Returns False if FTS5 is not supported.
+    """
+    with engine.begin() as conn:
+        exists = conn.execute(text("SELECT 1 FROM sqlite_master WHERE type = 'table' "
+                                   "AND name = :name"), name=SEARCH_TABLE).scalar()
+        try:
+            for statement in fts_statements():
+                conn.execute(statement)
+        except sqlalchemy.exc.OperationalError as err:  # e.g. no such module: fts5
+            logger.warning(f'Full-text search is not supported, using LIKE: {err}')
+            return False
+        if not exists:
+            conn.execute(f"INSERT INTO {SEARCH_TABLE} ({SEARCH_TABLE}) VALUES ('rebuild')")
+    return True
+
+
+def get_item_search() -> ItemSearch:
+    """Return the item search of the current app."""
+    return current_app.extensions['item_search']
+
+
+def init_search(app: Flask):
+    """Add item search to `app`, creating the FTS5 index for SQLite databases.
+
+    Must be called once the database tables exist. Set the `SEARCH_FTS`
+    config key to False to search with `LIKE` instead, default is True.
+    """
+    from .models.database import db  # pylint: disable=import-outside-toplevel
+    fts = config_flag(app.config, 'SEARCH_FTS', True)
+    if fts:
+        engine = db.get_engine(app)
+        fts = engine.dialect.name == 'sqlite' and install_search_index(engine)
+    app.extensions['item_search'] = ItemSearch(fts=fts)
@@ -0,0 +1,381 @@
+"""Provides a table of gifts in shared memory, for gift lists shared by processes.
+
+Under a preforking server each worker process has its own memory, so gift
+lists held in memory diverge between workers. Instead, the gifts of a list
+are stored in a named `multiprocessing.shared_memory` block which every
+local worker maps, laid out as:
+
+    - a header: magic, format version, capacity, item size, number of gifts
+      and the sequence number of the next gift added.
+    - a fixed number of slots, forming an open addressing hash table keyed
+      by item id, each containing the item id, its sequence number, the
+      available and purchased quantities and the item as JSON.
+
+Changes are made whilst holding an exclusive `fcntl` lock on a lock file (as
+well as a thread lock, as `fcntl` locks are per process), so the table is
+consistent for every worker. Requires Python 3.8+ on a POSIX system.
+
+`SharedMemoryGiftList` is a gift list stored in such a table.
+
+Examples
+--------
+.. code-block:: python
+
+    table = SharedGiftTable('gifts_liam')  # created or attached to
+    table.add(1, b'{"id": 1}', 2)
+    table.quantities(1)  # (2, 0)
+
+"""
+import hashlib
+import json
+import os
+import struct
+import tempfile
+import threading
+
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Tuple, Union
+
+try:
+    import fcntl
+    from multiprocessing import resource_tracker, shared_memory
+except ImportError:  # e.g. Windows or Python < 3.8
+    fcntl = shared_memory = resource_tracker = None  # pylint: disable=invalid-name
+
+from .gift_list import AbstractGiftList, GiftListFactory, _check_quantity, _item_id, print_report
+from .utils.metrics import GIFT_OVERSELL_REJECTIONS, GIFT_PURCHASED_QUANTITY, GIFT_PURCHASES
+
+MAGIC = b'OSGIFTS\0'
+FORMAT_VERSION = 1
+
+# magic, format version, capacity, item size, number of gifts, next sequence number
+HEADER = struct.Struct('<8sIIIIq')
+# item id, sequence number, available, purchased, length of item JSON
+SLOT_FIELDS = struct.Struct('<qqqqI')
+QUANTITIES_OFFSET = 16
+QUANTITIES = struct.Struct('<qq')
+LENGTH = struct.Struct('<I')
+
+EMPTY = 0
+TOMBSTONE = 0xFFFFFFFF  # a removed gift, which doesn't end probing
+
+# a gift: sequence number, item JSON, available, purchased
+SharedGift = Tuple[int, bytes, int, int]
+
+
+def _open_shared_memory(name: str, create: bool = False, size: int = 0):
+    """Open shared memory, without it being unlinked when this process exits.
+
+    Returns the shared memory and whether registration with the resource
+    tracker was suppressed, in which case it must be registered to unlink.
+    """
+    try:
+        return shared_memory.SharedMemory(name, create=create, size=size, track=False), False
+    except TypeError:  # Python < 3.13 always registers with the resource tracker
+        pass
+    register = resource_tracker.register
+    resource_tracker.register = lambda *args: None
+    try:
+        return shared_memory.SharedMemory(name, create=create, size=size), True
+    finally:
+        resource_tracker.register = register
+
+
+def shared_name(key: str) -> str:
+    """Return a name for shared memory, short enough for every platform."""
+    return 'gifts_' + hashlib.sha1(key.encode('utf8')).hexdigest()[:16]
+
+
+class SharedGiftTable:
+    """A table of gifts in the shared memory block `name`, created if missing.
+
+    Parameters
+    ----------
+    name: str
+        The name of the shared memory block, see `shared_name()`.
+    capacity: int
+        The maximum number of gifts, when creating the table.
+    item_size: int
+        The maximum length of the JSON of items, when creating the table.
+
+    Raises
+    ------
+    RuntimeError
+        If shared memory or `fcntl` are not supported.
+    """
+
+    def __init__(self, name: str, capacity: int = 4096, item_size: int = 220):
+        if shared_memory is None:
+            raise RuntimeError('shared gift lists require Python 3.8+ on a POSIX system')
+        self.name = name
+        self._thread_lock = threading.Lock()
+        self._lock_path = os.path.join(tempfile.gettempdir(), f'{name}.lock')
+        self._lock_fd = os.open(self._lock_path, os.O_RDWR | os.O_CREAT, 0o600)
+        with self._locked():
+            # NOTE: the table outlives the processes using it, until `unlink()` is called
+            try:
+                self._shm, self._untracked = _open_shared_memory(
+                    name, create=True, size=HEADER.size + capacity * (SLOT_FIELDS.size + item_size))
+                HEADER.pack_into(self._shm.buf, 0, MAGIC, FORMAT_VERSION, capacity, item_size, 0, 1)
+            except FileExistsError:
+                self._shm, self._untracked = _open_shared_memory(name)
+            magic, version, self.capacity, self.item_size, _, _ = \
+                HEADER.unpack_from(self._shm.buf)
+        if magic != MAGIC or version != FORMAT_VERSION:
+            self.close()
+            raise ValueError(f'{name} is not a version {FORMAT_VERSION} shared gift table')
+        self._slot_size = SLOT_FIELDS.size + self.item_size
+
+    @contextmanager
+    def _locked(self) -> Iterator[None]:
+        with self._thread_lock:
+            fcntl.lockf(self._lock_fd, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.lockf(self._lock_fd, fcntl.LOCK_UN)
+
+    def _offset(self, index: int) -> int:
+        return HEADER.size + index * self._slot_size
+
+    def _find(self, item_id: int) -> Tuple[Optional[int], Optional[int]]:
+        """Return the slot of `item_id`, else None and the slot to add it in, if any."""
+        buf = self._shm.buf
+        free = None
+        start = item_id % self.capacity
+        for probe in range(self.capacity):
+            index = (start + probe) % self.capacity
+            offset = self._offset(index)
+            length = LENGTH.unpack_from(buf, offset + SLOT_FIELDS.size - LENGTH.size)[0]
+            if length == EMPTY:
+                return None, index if free is None else free
+            if length == TOMBSTONE:
+                free = index if free is None else free
+            elif struct.unpack_from('<q', buf, offset)[0] == item_id:
+                return index, None
+        return None, free
+
+    def _count(self, delta: int):
+        buf = self._shm.buf
+        header = list(HEADER.unpack_from(buf))
+        header[4] += delta
+        HEADER.pack_into(buf, 0, *header)
+
+    def __len__(self) -> int:
+        return HEADER.unpack_from(self._shm.buf)[4]
+
+    def add(self, item_id: int, item_json: bytes, quantity: int):
+        """Add `quantity` to the gift of `item_id`, adding the gift if new.
+
+        Raises
+        ------
+        ValueError
+            If the table is full or `item_json` is longer than its item size.
+        """
+        if len(item_json) > self.item_size:
+            raise ValueError(f'item {item_id} is longer than {self.item_size} bytes as JSON')
+        with self._locked():
+            buf = self._shm.buf
+            index, free = self._find(item_id)
+            if index is None:
+                if free is None:
+                    raise ValueError(f'gift list is full ({self.capacity} gifts)')
+                header = list(HEADER.unpack_from(buf))
+                header[4], header[5] = header[4] + 1, header[5] + 1
+                offset = self._offset(free)
+                SLOT_FIELDS.pack_into(buf, offset, item_id, header[5] - 1, quantity, 0,
+                                      len(item_json))
+                buf[offset + SLOT_FIELDS.size:offset + SLOT_FIELDS.size + len(item_json)] = \
+                    item_json
+                HEADER.pack_into(buf, 0, *header)
+                return
+            offset = self._offset(index) + QUANTITIES_OFFSET
+            available, purchased = QUANTITIES.unpack_from(buf, offset)
+            QUANTITIES.pack_into(buf, offset, available + quantity, purchased)
+
+    def remove(self, item_id: int) -> bool:
+        """Remove the gift of `item_id`, returning whether it existed."""
+        with self._locked():
+            index, _ = self._find(item_id)
+            if index is None:
+                return False
+            offset = self._offset(index)
+            LENGTH.pack_into(self._shm.buf, offset + SLOT_FIELDS.size - LENGTH.size, TOMBSTONE)
+            self._count(-1)
+            return True
+
+    def purchase(self, item_id: int, quantity: int) -> bool:
+        """Purchase `quantity` of `item_id`, returning False if fewer are available.
+
+        Raises
+        ------
+        KeyError
+            If there is no gift of `item_id`.
+        """
+        with self._locked():
+            index, _ = self._find(item_id)
+            if index is None:
+                raise KeyError(item_id)
+            offset = self._offset(index) + QUANTITIES_OFFSET
+            available, purchased = QUANTITIES.unpack_from(self._shm.buf, offset)
+            if quantity > available:
+                return False
+            QUANTITIES.pack_into(self._shm.buf, offset, available - quantity,
+                                 purchased + quantity)
+            return True
+
+    def quantities(self, item_id: int) -> Tuple[int, int]:
+        """Return the available and purchased quantities of `item_id`."""
+        with self._locked():
+            index, _ = self._find(item_id)
+            if index is None:
+                return 0, 0
+            return QUANTITIES.unpack_from(self._shm.buf, self._offset(index) + QUANTITIES_OFFSET)
+
+    def gifts(self) -> List[SharedGift]:
+        """Return every gift, in the order added."""
+        gifts = []
+        with self._locked():
+            buf = self._shm.buf
+            for index in range(self.capacity):
+                offset = self._offset(index)
+                _, seq, available, purchased, length = SLOT_FIELDS.unpack_from(buf, offset)
+                if length not in (EMPTY, TOMBSTONE):
+                    start = offset + SLOT_FIELDS.size
+                    gifts.append((seq, bytes(buf[start:start + length]), available, purchased))
+        gifts.sort()
+        return gifts
+
+    def clear(self):
+        """Remove every gift."""
+        with self._locked():
+            buf = self._shm.buf
+            buf[HEADER.size:] = bytes(len(buf) - HEADER.size)
+            self._count(-HEADER.unpack_from(buf)[4])
+
+    def close(self):
+        """Unmap the table, which remains available to other processes."""
+        self._shm.close()
+        os.close(self._lock_fd)
+
+    def unlink(self):
+        """Destroy the table, once every process has closed it."""
+        if self._untracked:  # as unlinking unregisters it from the resource tracker
+            resource_tracker.register(self._shm._name, 'shared_memory')  # pylint: disable=protected-access
+        self._shm.unlink()
+        if os.path.exists(self._lock_path):
+            os.unlink(self._lock_path)
+
+
+class SharedMemoryGiftList(AbstractGiftList):
+    """A gift list in shared memory, consistent across local worker processes.
+
+    The gifts are stored in a `SharedGiftTable`, named after
+    the user (or `name`), which is created by the first process to open the
+    list and attached to by the others. Gifts are kept in the order added.
+
+    Items must have an integer `id` and be JSON compatible. The list has a
+    fixed `capacity` and `item_size`, set by the process creating it, and
+    remains in shared memory until `unlink()` is called.
+
+    Raises
+    ------
+    RuntimeError
+        If shared memory is not supported, e.g. on Windows.
+    """
+
+    BACKEND = 'shared'
+
+    def __init__(self, username_or_id, name: Optional[str] = None,
+                 capacity: int = 4096, item_size: int = 220):
+        self.user = self.get_user(username_or_id)
+        self._table = SharedGiftTable(name or shared_name(str(self.user)),
+                                      capacity=capacity, item_size=item_size)
+
+    def __repr__(self) -> str:
+        """Create user friendly representation of gift list."""
+        return f'{self.user} -> {self.get_list()}'
+
+    def __len__(self) -> int:
+        return len(self._table)
+
+    def get_user(self, username_or_id: Union[int, str]) -> Union[int, str]:
+        """Return user."""
+        return username_or_id  # dummy method
+
+    def create_list(self) -> List[Dict[str, Any]]:
+        """Create a new gift list, for every process."""
+        self._table.clear()
+        return []
+
+    def add_item(self, item: Dict[str, Any], quantity: int = 1):
+        """Add `quantity` of `item` to gift list.
+
+        Raises
+        ------
+        ValueError
+            When quantity is not a positive integer, item has no integer id,
+            is too long as JSON or the list is full.
+        """
+        _check_quantity(quantity)
+        item_id = _item_id(item)
+        self._table.add(item_id, json.dumps(item).encode('utf8'), quantity)
+
+    def remove_item(self, item: Dict[str, Any]):
+        """Remove item from gift list.
+
+        Raises
+        ------
+        ValueError
+            If `item` is not in gift list.
+        """
+        if not self._table.remove(_item_id(item)):
+            raise ValueError(f'{item!r} is not in gift list')
+
+    def get_quantities(self, item: Dict[str, Any]) -> Tuple[int, int]:
+        """Return the number of `item` available and purchased."""
+        return self._table.quantities(_item_id(item))
+
+    def purchase_item(self, gift: Dict[str, Any], quantity: int = 1):
+        """Purchase `quantity` of `gift` from gift list.
+
+        Raises
+        ------
+        ValueError:
+            If `gift` is not in gift list or quantity is greater than available
+            number of desired gifts.
+        """
+        _check_quantity(quantity)
+        try:
+            purchased = self._table.purchase(
+                _item_id(gift), quantity)
+        except KeyError:
+            raise ValueError(f'{gift!r} is not in gift list') from None
+        if not purchased:
+            GIFT_OVERSELL_REJECTIONS.inc(self.BACKEND)
+            raise ValueError('Cannot purchase more items than available')
+        GIFT_PURCHASES.inc(self.BACKEND)
+        GIFT_PURCHASED_QUANTITY.inc(self.BACKEND, amount=quantity)
+
+    def create_report(self):
+        """Print report of purchased and available gift items in list."""
+        gifts = [(json.loads(item), available, purchased)
+                 for _, item, available, purchased in self._table.gifts()]
+        print_report(self.user,
+                     [(item, purchased) for item, _, purchased in gifts if purchased],
+                     [(item, available) for item, available, _ in gifts if available])
+
+    def get_list(self) -> List[Dict[str, Any]]:
+        """Return the gift list."""
+        return [json.loads(item) for _, item, _, _ in self._table.gifts()]
+
+    def close(self):
+        """Unmap the list, which remains available to other processes."""
+        self._table.close()
+
+    def unlink(self):
+        """Destroy the list for every process, once they have closed it."""
+        self._table.unlink()
+
+
+GiftListFactory.CLASSES['shared'] = SharedMemoryGiftList
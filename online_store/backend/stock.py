@@ -0,0 +1,274 @@
+"""Provides a sharded stock ledger for items with many concurrent buyers.
+
+Updating `items.in_stock_quantity` for every order or purchase serializes all
+buyers of a popular item on a single row. Instead, the ledger leases stock
+from the row in batches and splits it into shards, each guarded by its own
+lock, so that concurrent reservations of the same item rarely contend:
+
+    - `reserve()` takes units from the caller's shard, taking any shortfall
+      from the other shards and, failing that, leasing more units from the
+      database with a single conditional update, so stock is never oversold,
+      even by several workers.
+    - `commit()` confirms a reservation, as its units have already been
+      removed from the database when leased.
+    - `release()` returns the units of a reservation to its shards.
+    - `consolidate()` returns unreserved units to `items.in_stock_quantity`,
+      so that the table reflects the stock not held by any worker. It is run
+      every `STOCK_LEDGER_CONSOLIDATE_INTERVAL` seconds and at exit.
+
+Examples
+--------
+.. code-block:: python
+
+    ledger = StockLedger(db.get_engine())
+    reservation = ledger.reserve(item_id=1, quantity=2)
+    try:
+        ...  # create order
+    except Exception:
+        ledger.release(reservation)
+        raise
+    else:
+        ledger.commit(reservation)
+
+"""
+import atexit
+import threading
+
+from typing import Callable, Dict, List, Optional, Tuple
+
+from flask import Flask, current_app
+from loguru import logger
+from sqlalchemy import text
+
+from .models.order import StockUnavailableError
+from .utils.config import config_flag
+from .utils.metrics import REGISTRY, Counter
+
+STOCK_LEASES = REGISTRY.register(Counter(
+    'stock_ledger_leases_total', 'Number of stock leases taken from the items table.'))
+STOCK_RESERVATIONS = REGISTRY.register(Counter(
+    'stock_ledger_reservations_total', 'Number of stock reservations by outcome.', ['result']))
+
+_SELECT_STOCK = text('SELECT in_stock_quantity FROM items WHERE id = :item_id')
+_TAKE_STOCK = text('UPDATE items SET in_stock_quantity = in_stock_quantity - :quantity '
+                   'WHERE id = :item_id AND in_stock_quantity >= :quantity')
+_RETURN_STOCK = text('UPDATE items SET in_stock_quantity = in_stock_quantity + :quantity '
+                     'WHERE id = :item_id')
+
+_LEASE_ATTEMPTS = 5
+
+
+class Reservation:  # pylint: disable=too-few-public-methods
+    """Units of an item reserved from the shards of a `StockLedger`."""
+
+    __slots__ = ('item_id', 'quantity', 'taken', 'state')
+
+    def __init__(self, item_id: int, quantity: int, taken: List[Tuple[int, int]]):
+        self.item_id = item_id
+        self.quantity = quantity
+        self.taken = taken  # (shard, quantity) pairs
+        self.state = 'reserved'
+
+    def __repr__(self) -> str:
+        return f'Reservation(item_id={self.item_id}, quantity={self.quantity}, {self.state})'
+
+
+class _ItemShards:  # pylint: disable=too-few-public-methods
+    __slots__ = ('quantities', 'locks', 'lease_lock')
+
+    def __init__(self, shards: int):
+        self.quantities = [0] * shards
+        self.locks = [threading.Lock() for _ in range(shards)]
+        self.lease_lock = threading.Lock()
+
+
+class StockLedger:
+    """Splits the stock of items into shards of units leased from the database.
+
+    Parameters
+    ----------
+    engine: Engine
+        The engine of the database containing the items table.
+    shards: int
+        The number of shards per item.
+    lease_size: int
+        The number of units to lease in addition to any shortfall.
+    on_change: Optional[Callable[[List[int]], None]]
+        Called with the ids of items whose stock in the table changed.
+    """
+
+    def __init__(self, engine, shards: int = 8, lease_size: int = 100,
+                 on_change: Optional[Callable[[List[int]], None]] = None):
+        self.engine = engine
+        self.shards = max(shards, 1)
+        self.lease_size = lease_size
+        self.on_change = on_change
+        self._items: Dict[int, _ItemShards] = {}
+        self._lock = threading.Lock()
+
+    def _shards_of(self, item_id: int) -> _ItemShards:
+        item = self._items.get(item_id)
+        if item is None:
+            with self._lock:
+                item = self._items.setdefault(item_id, _ItemShards(self.shards))
+        return item
+
+    def _take(self, item: _ItemShards, quantity: int) -> List[Tuple[int, int]]:
+        """Take up to `quantity` units, starting with the caller's shard."""
+        taken = []
+        first = threading.get_ident() % self.shards
+        for offset in range(self.shards):
+            shard = (first + offset) % self.shards
+            with item.locks[shard]:
+                units = min(item.quantities[shard], quantity)
+                item.quantities[shard] -= units
+            if units:
+                taken.append((shard, units))
+                quantity -= units
+                if not quantity:
+                    break
+        return taken
+
+    def _put(self, item: _ItemShards, taken: List[Tuple[int, int]]):
+        for shard, units in taken:
+            with item.locks[shard]:
+                item.quantities[shard] += units
+
+    def _lease(self, item_id: int, needed: int) -> int:
+        """Move at least `needed` units from the items table, returning the number moved."""
+        with self.engine.begin() as conn:
+            for _ in range(_LEASE_ATTEMPTS):
+                stock = conn.execute(_SELECT_STOCK, item_id=item_id).scalar() or 0
+                if stock < needed:
+                    return 0
+                quantity = min(stock, needed + self.lease_size)
+                # NOTE: the condition guards against concurrent writers, e.g. other workers
+                if conn.execute(_TAKE_STOCK, item_id=item_id, quantity=quantity).rowcount:
+                    STOCK_LEASES.inc()
+                    break
+            else:
+                return 0
+        if self.on_change is not None:
+            self.on_change([item_id])
+        return quantity
+
+    def reserve(self, item_id: int, quantity: int = 1) -> Reservation:
+        """Reserve `quantity` units of `item_id`.
+
+        Raises
+        ------
+        StockUnavailableError
+            If fewer than `quantity` units are in stock.
+        """
+        if quantity < 1:
+            raise ValueError('quantity must be positive')
+        item = self._shards_of(item_id)
+        taken = self._take(item, quantity)
+        shortfall = quantity - sum(units for _, units in taken)
+        if shortfall:
+            with item.lease_lock:
+                # another thread may have leased whilst waiting for the lock
+                more = self._take(item, shortfall)
+                taken += more
+                shortfall -= sum(units for _, units in more)
+                leased = self._lease(item_id, shortfall) if shortfall else 0
+            if shortfall and not leased:
+                self._put(item, taken)
+                STOCK_RESERVATIONS.inc('unavailable')
+                raise StockUnavailableError(f'Fewer than {quantity} of item {item_id} in stock')
+            if leased:
+                shard = threading.get_ident() % self.shards
+                self._put(item, [(shard, leased - shortfall)])
+                taken.append((shard, shortfall))
+        STOCK_RESERVATIONS.inc('reserved')
+        return Reservation(item_id, quantity, taken)
+
+    def commit(self, reservation: Reservation):
+        """Confirm `reservation`, i.e. its units have been sold."""
+        if reservation.state != 'reserved':
+            raise ValueError(f'cannot commit {reservation!r}')
+        reservation.state = 'committed'
+        STOCK_RESERVATIONS.inc('committed')
+
+    def release(self, reservation: Reservation):
+        """Return the units of `reservation`, e.g. when an order fails."""
+        if reservation.state != 'reserved':
+            raise ValueError(f'cannot release {reservation!r}')
+        reservation.state = 'released'
+        self._put(self._shards_of(reservation.item_id), reservation.taken)
+        STOCK_RESERVATIONS.inc('released')
+
+    def available(self, item_id: int) -> int:
+        """Return the number of units of `item_id` leased but not reserved."""
+        item = self._items.get(item_id)
+        return sum(item.quantities) if item is not None else 0
+
+    def consolidate(self) -> int:
+        """Return all unreserved units to the items table, returning the number returned."""
+        returned: Dict[int, int] = {}
+        with self._lock:
+            items = list(self._items.items())
+        for item_id, item in items:
+            with item.lease_lock:
+                units = 0
+                for shard in range(self.shards):
+                    with item.locks[shard]:
+                        units += item.quantities[shard]
+                        item.quantities[shard] = 0
+                if units:
+                    with self.engine.begin() as conn:
+                        conn.execute(_RETURN_STOCK, item_id=item_id, quantity=units)
+                    returned[item_id] = units
+        if returned and self.on_change is not None:
+            self.on_change(list(returned))
+        return sum(returned.values())
+
+
+def get_stock_ledger() -> Optional[StockLedger]:
+    """Return the stock ledger of the current app, if enabled."""
+    return current_app.extensions.get('stock_ledger')
+
+
+def _consolidate_periodically(ledger: StockLedger, interval: float, stop: threading.Event):
+    while not stop.wait(interval):
+        try:
+            ledger.consolidate()
+        except Exception as err:  # pylint: disable=broad-except
+            logger.error(f'Unable to consolidate stock ledger: {err}')
+
+
+def init_stock_ledger(app: Flask):
+    """Add a stock ledger to `app` if `STOCK_LEDGER_ENABLED` is set.
+
+    The following config keys are used:
+
+        - `STOCK_LEDGER_SHARDS`: the number of shards per item, default is 8.
+        - `STOCK_LEDGER_LEASE_SIZE`: the number of units leased at once in
+          addition to any shortfall, default is 100.
+        - `STOCK_LEDGER_CONSOLIDATE_INTERVAL`: the number of seconds between
+          returning unreserved units to the items table, default is 1. Zero
+          only consolidates at exit.
+    """
+    # pylint: disable=import-outside-toplevel
+    from .models.database import db
+    from .utils.table_versions import bump_table_versions
+
+    if not config_flag(app.config, 'STOCK_LEDGER_ENABLED'):
+        return
+    shards = int(app.config.get('STOCK_LEDGER_SHARDS', 8))
+    lease_size = int(app.config.get('STOCK_LEDGER_LEASE_SIZE', 100))
+    interval = float(app.config.get('STOCK_LEDGER_CONSOLIDATE_INTERVAL', 1))
+
+    def on_change(item_ids: List[int]):
+        bump_table_versions('items')
+        app.extensions['item_cache'].invalidate(*item_ids)
+
+    ledger = StockLedger(db.get_engine(app), shards=shards, lease_size=lease_size,
+                         on_change=on_change)
+    app.extensions['stock_ledger'] = ledger
+    atexit.register(ledger.consolidate)
+    if interval > 0:
+        stop = threading.Event()
+        atexit.register(stop.set)
+        threading.Thread(target=_consolidate_periodically, args=(ledger, interval, stop),
+                         daemon=True, name='stock-ledger').start()
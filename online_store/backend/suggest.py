@@ -0,0 +1,405 @@
+"""Provides type-ahead suggestions of store items from an in-memory prefix index.
+
+Names and brands are normalized (diacritics removed, case folded and
+punctuation collapsed to spaces) and every suffix starting at a word is
+indexed, so `le cre` suggests "Le Creuset" and `cas` suggests "Cast Iron
+Oval Casserole". The index is an array of keys and their items, sorted by
+key then item, searched with `bisect`: the keys starting with a prefix are
+contiguous, and a segment tree over the popularity of their items yields
+the most popular first, without visiting the rest of the range. Suggestions
+never query the database.
+
+Popularity is the number of gifts of an item plus the number ordered. For
+SQLite databases, triggers maintain it in `item_activity`, along with a
+sequence number of each item's last change (including changes to its name
+or brand). The table is watched by the cache invalidation bus, so when any
+worker changes items, gifts or orders, the changes are read and applied to
+the index incrementally: popularity is updated in place, whilst changed or
+new items are tombstoned in the array and added to a small sorted delta,
+which is merged into a new array once it exceeds `DELTA_LIMIT` items.
+Changes are applied in batches under a lock that suggestions also hold, so
+a suggestion never sees the array, delta and items part way through a batch.
+
+Examples
+--------
+.. code-block:: python
+
+    suggestions = ItemSuggestions(engine)
+    suggestions.build()
+    suggestions.suggest('le cre', limit=2)
+    # [{'id': 2, 'name': 'Cast Iron Oval Casserole - 25cm; Volcanic', 'brand': 'Le Creuset',
+    #   'popularity': 12}, ...]
+
+"""
+import heapq
+import re
+import threading
+import unicodedata
+
+from array import array
+from bisect import bisect_left, bisect_right, insort
+from functools import lru_cache
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+from flask import Flask, current_app
+from loguru import logger
+from sqlalchemy import text
+
+import sqlalchemy.exc
+
+from .utils.config import config_flag
+
+ACTIVITY_TABLE = 'item_activity'
+MAX_KEY_LENGTH = 32
+DELTA_LIMIT = 1024
+_LAST_KEY = '\U0010ffff'
+
+# an item's name, brand and popularity
+ItemEntry = Tuple[Optional[str], Optional[str], int]
+
+_POPULARITY = text(
+    'SELECT items.id, items.name, items.brand, '
+    'COALESCE(gifts.count, 0) + COALESCE(ordered.count, 0) AS popularity FROM items '
+    'LEFT JOIN (SELECT item_id, COUNT(*) AS count FROM gifts GROUP BY item_id) AS gifts '
+    'ON gifts.item_id = items.id '
+    'LEFT JOIN (SELECT item, SUM(quantity) AS count FROM order_items GROUP BY item) AS ordered '
+    'ON ordered.item = items.id')
+_ACTIVITY = text(
+    f'SELECT items.id, items.name, items.brand, COALESCE({ACTIVITY_TABLE}.popularity, 0) '
+    f'FROM items LEFT JOIN {ACTIVITY_TABLE} ON {ACTIVITY_TABLE}.item_id = items.id')
+_CHANGES = text(
+    f'SELECT {ACTIVITY_TABLE}.seq, {ACTIVITY_TABLE}.item_id, items.id, items.name, '
+    f'items.brand, {ACTIVITY_TABLE}.popularity FROM {ACTIVITY_TABLE} '
+    f'LEFT JOIN items ON items.id = {ACTIVITY_TABLE}.item_id '
+    f'WHERE {ACTIVITY_TABLE}.seq > :seq ORDER BY {ACTIVITY_TABLE}.seq')
+_LAST_SEQ = text(f'SELECT COALESCE(MAX(seq), 0) FROM {ACTIVITY_TABLE}')
+
+_SEPARATORS = re.compile(r'[\W_]+')
+_NON_ASCII = re.compile(r'[^\x00-\x7f]')
+
+
+def normalize(value: Optional[str]) -> str:
+    """Return `value` without diacritics, case folded and with single spaces."""
+    if not value:
+        return ''
+    if _NON_ASCII.search(value):
+        decomposed = unicodedata.normalize('NFKD', value)
+        value = ''.join(char for char in decomposed if not unicodedata.combining(char))
+    return _SEPARATORS.sub(' ', value.casefold()).strip()
+
+
+def _suffixes(value: Optional[str]) -> Tuple[str, ...]:
+    normalized = normalize(value)
+    suffixes = []
+    start = 0
+    for word in normalized.split(' ') if normalized else ():
+        suffixes.append(normalized[start:start + MAX_KEY_LENGTH])
+        start += len(word) + 1
+    return tuple(suffixes)
+
+
+_brand_suffixes = lru_cache(maxsize=4096)(_suffixes)  # brands are shared by many items
+
+
+def index_keys(name: Optional[str], brand: Optional[str]) -> Set[str]:
+    """Return the keys indexing an item, i.e. its suffixes starting at each word."""
+    return set(_suffixes(name) + _brand_suffixes(brand))
+
+
+def activity_statements() -> List[str]:
+    """Return the SQLite statements maintaining the `item_activity` table."""
+    # NOTE: the sequence number is unique, as SQLite writes are serialized
+    touch = (f'INSERT INTO {ACTIVITY_TABLE} (item_id, popularity, seq) '
+             f'VALUES ({{item}}, {{delta}}, (SELECT COALESCE(MAX(seq), 0) + 1 FROM {ACTIVITY_TABLE})) '
+             'ON CONFLICT (item_id) DO UPDATE SET popularity = popularity + excluded.popularity, '
+             'seq = excluded.seq;')
+    triggers = (
+        ('items_insert', 'AFTER INSERT ON items', 'new.id', '0'),
+        ('items_update', 'AFTER UPDATE OF name, brand ON items', 'new.id', '0'),
+        ('items_delete', 'AFTER DELETE ON items', 'old.id', '0'),
+        ('gifts_insert', 'AFTER INSERT ON gifts', 'new.item_id', '1'),
+        ('gifts_delete', 'AFTER DELETE ON gifts', 'old.item_id', '-1'),
+        ('order_items_insert', 'AFTER INSERT ON order_items', 'new.item',
+         'COALESCE(new.quantity, 1)'),
+    )
+    statements = [
+        f'CREATE TABLE IF NOT EXISTS {ACTIVITY_TABLE} (item_id INTEGER PRIMARY KEY, '
+        'popularity INTEGER NOT NULL DEFAULT 0, seq INTEGER NOT NULL)',
+        f'CREATE INDEX IF NOT EXISTS ix_{ACTIVITY_TABLE}_seq ON {ACTIVITY_TABLE} (seq)',
+    ]
+    for name, event, item, delta in triggers:
+        statements.append(f'CREATE TRIGGER IF NOT EXISTS {ACTIVITY_TABLE}_{name} {event} '
+                          f'BEGIN {touch.format(item=item, delta=delta)} END')
+    return statements
+
+
+class PrefixIndex:
+    """A sorted array of keys and their items, ranked by popularity.
+
+    Parameters
+    ----------
+    items: Dict[int, ItemEntry]
+        The items to index, by id.
+    """
+
+    def __init__(self, items: Dict[int, ItemEntry]):
+        keys: List[str] = []
+        ids = array('q')
+        shared: Dict[str, str] = {}  # one copy of keys shared by items, e.g. brands
+        for item_id, (name, brand, _) in items.items():
+            for key in index_keys(name, brand):
+                keys.append(shared.setdefault(key, key))
+                ids.append(item_id)
+        del shared
+        # NOTE: sorts positions by id then (stably) by key, rather than sorting
+        # (key, id) tuples, to halve the peak memory
+        order = sorted(range(len(keys)), key=ids.__getitem__)
+        order.sort(key=keys.__getitem__)
+        self.keys = [keys[position] for position in order]
+        self.ids = array('q', (ids[position] for position in order))
+        del keys, ids, order
+        # the popularity of the item of each key, or -1 once removed
+        self.popularity = array('q', (items[item_id][2] for item_id in self.ids))
+        self._size = 1 << max(len(self.keys) - 1, 0).bit_length()
+        # the position of the most popular key below each node of the tree, built
+        # a level at a time, where -1 pads the leaves (so is only ever second)
+        self._tree = array('q', [-1]) * (2 * self._size)
+        level = array('q', range(len(self.keys))) + array('q', [-1]) * (self._size - len(self.keys))
+        width = self._size
+        self._tree[width:] = level
+        popularity = self.popularity
+        while width > 1:
+            level = array('q', [first if second < 0 or popularity[first] >= popularity[second]
+                                else second for first, second in zip(level[::2], level[1::2])])
+            width //= 2
+            self._tree[width:2 * width] = level
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def _best(self, first: int, second: int) -> int:
+        if first < 0 or second < 0:
+            return max(first, second)
+        if (-self.popularity[second], second) < (-self.popularity[first], first):
+            return second
+        return first
+
+    def _most_popular(self, low: int, high: int) -> int:
+        """Return the position of the most popular key in [low, high), else -1."""
+        best = -1
+        low, high = low + self._size, high + self._size
+        while low < high:
+            if low & 1:
+                best = self._best(best, self._tree[low])
+                low += 1
+            if high & 1:
+                high -= 1
+                best = self._best(best, self._tree[high])
+            low, high = low >> 1, high >> 1
+        return best
+
+    def positions(self, item_id: int, name: Optional[str], brand: Optional[str]) -> List[int]:
+        """Return the positions of the keys of the item `item_id`.
+
+        Equal keys are sorted by item, so each is found by bisection, even if
+        shared by many items (e.g. a brand).
+        """
+        positions = []
+        for key in index_keys(name, brand):
+            low = bisect_left(self.keys, key)
+            high = bisect_right(self.keys, key, low)
+            position = bisect_left(self.ids, item_id, low, high)
+            if position < high and self.ids[position] == item_id:
+                positions.append(position)
+        return positions
+
+    def update(self, positions: Iterable[int], popularity: int):
+        """Set the popularity of the keys at `positions`, where -1 removes them."""
+        for position in positions:
+            self.popularity[position] = popularity
+            node = (position + self._size) >> 1
+            while node:
+                self._tree[node] = self._best(self._tree[2 * node], self._tree[2 * node + 1])
+                node >>= 1
+
+    def ranked(self, prefix: str) -> Iterator[Tuple[int, int]]:
+        """Yield the item and popularity of the keys starting with `prefix`, most popular first."""
+        low = bisect_left(self.keys, prefix)
+        high = bisect_left(self.keys, prefix + _LAST_KEY, low)
+        ranges = []
+
+        def push(low: int, high: int):
+            position = self._most_popular(low, high) if low < high else -1
+            if position >= 0 and self.popularity[position] >= 0:
+                heapq.heappush(ranges, (-self.popularity[position], position, low, high))
+
+        push(low, high)
+        while ranges:
+            popularity, position, low, high = heapq.heappop(ranges)
+            yield self.ids[position], -popularity
+            push(low, position)
+            push(position + 1, high)
+
+
+class ItemSuggestions:
+    """Suggests items by prefix from memory, kept up to date from `engine`.
+
+    Parameters
+    ----------
+    engine: Engine
+        The database engine to load items (and their changes) from.
+    track_changes: bool
+        Whether changes are read from the `item_activity` table, see
+        `install_activity_tracking()`, else popularity is computed once.
+    """
+
+    def __init__(self, engine, track_changes: bool = True):
+        self.engine = engine
+        self.track_changes = track_changes
+        self.seq = 0
+        self._items: Dict[int, ItemEntry] = {}
+        self._main = PrefixIndex({})
+        # items added or renamed since the array was built, as sorted keys
+        self._delta: Dict[int, ItemEntry] = {}
+        self._delta_keys: List[Tuple[str, int]] = []
+        self._lock = threading.Lock()  # serializes writers
+        # guards the index whilst changed, as popularity is updated in place
+        self._index_lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def build(self):
+        """Load every item and build the index from scratch."""
+        # NOTE: in one transaction, so that no change is missed or applied twice
+        with self.engine.begin() as conn:
+            seq = conn.execute(_LAST_SEQ).scalar() if self.track_changes else 0
+            rows = conn.execute(_ACTIVITY if self.track_changes else _POPULARITY).fetchall()
+        items = {item_id: (name, brand, max(popularity, 0))
+                 for item_id, name, brand, popularity in rows}
+        main = PrefixIndex(items)
+        with self._lock, self._index_lock:
+            self._items, self._main, self.seq = items, main, seq
+            self._delta, self._delta_keys = {}, []
+        logger.debug(f'Indexed {len(main)} keys of {len(items)} items for suggestions')
+
+    def invalidate(self):
+        """Apply the changes since the last update, see `.utils.invalidation`."""
+        if not self.track_changes:
+            return
+        # NOTE: changes are read whilst locked, so newer changes are never overwritten
+        with self._lock:
+            with self.engine.connect() as conn:
+                changes = conn.execute(_CHANGES, seq=self.seq).fetchall()
+            if len(changes) <= DELTA_LIMIT:
+                self._apply_changes(changes)
+                return
+        self.build()  # e.g. after a bulk import
+
+    def _apply_changes(self, changes: Iterable[Tuple]):
+        """Apply rows of `_CHANGES` to the index, whilst holding `_lock`."""
+        with self._index_lock:
+            for seq, item_id, exists, name, brand, popularity in changes:
+                self._apply(item_id, None if exists is None
+                            else (name, brand, max(popularity, 0)))
+                self.seq = max(self.seq, seq)
+        if len(self._delta) > DELTA_LIMIT:
+            # NOTE: only writers change the items, so the array is merged unlocked
+            main = PrefixIndex(self._items)
+            with self._index_lock:
+                self._main, self._delta, self._delta_keys = main, {}, []
+
+    def _apply(self, item_id: int, entry: Optional[ItemEntry]):
+        old = self._items.get(item_id)
+        if old is not None and entry is not None and old[:2] == entry[:2]:
+            self._items[item_id] = entry  # only its popularity changed
+            if item_id in self._delta:
+                self._delta[item_id] = entry
+            else:
+                self._main.update(self._main.positions(item_id, *old[:2]), entry[2])
+            return
+        if old is not None:
+            if self._delta.pop(item_id, None) is not None:
+                for key in index_keys(*old[:2]):
+                    del self._delta_keys[bisect_left(self._delta_keys, (key, item_id))]
+            else:
+                self._main.update(self._main.positions(item_id, *old[:2]), -1)
+            del self._items[item_id]
+        if entry is not None:
+            self._items[item_id] = self._delta[item_id] = entry
+            for key in index_keys(*entry[:2]):
+                insort(self._delta_keys, (key, item_id))
+
+    def suggest(self, query: str, limit: int = 10) -> List[Dict[str, Any]]:
+        """Return the `limit` most popular items with a word starting with `query`."""
+        prefix = normalize(query)[:MAX_KEY_LENGTH]
+        if not prefix or limit < 1:
+            return []
+        found: Dict[int, int] = {}
+        # NOTE: locked, so the array, delta and items are of the same changes
+        with self._index_lock:
+            for item_id, popularity in self._main.ranked(prefix):
+                if item_id not in found:
+                    found[item_id] = popularity
+                    if len(found) == limit:
+                        break
+            delta_keys = self._delta_keys
+            low = bisect_left(delta_keys, (prefix,))
+            for _, item_id in delta_keys[low:bisect_left(delta_keys, (prefix + _LAST_KEY,), low)]:
+                entry = self._delta.get(item_id)
+                if entry is not None:
+                    found[item_id] = entry[2]
+            ranked = sorted(found.items(), key=lambda found_item: -found_item[1])[:limit]
+            entries = [(item_id, popularity, self._items.get(item_id, (None, None, 0)))
+                       for item_id, popularity in ranked]
+        return [{'id': item_id, 'name': name, 'brand': brand, 'popularity': popularity}
+                for item_id, popularity, (name, brand, _) in entries]
+
+
+def install_activity_tracking(engine) -> bool:
+    """Create the `item_activity` table and its triggers, if missing.
+
+    The popularity of existing items is computed when the table is created.
+    Returns False if not supported, e.g. by SQLite before 3.24.
+    """
+    with engine.begin() as conn:
+        exists = conn.execute(text("SELECT 1 FROM sqlite_master WHERE type = 'table' "
+                                   "AND name = :name"), name=ACTIVITY_TABLE).scalar()
+        try:
+            for statement in activity_statements():
+                conn.execute(statement)
+        except sqlalchemy.exc.OperationalError as err:  # e.g. no upsert support
+            logger.warning(f'Unable to track item popularity, suggestions are static: {err}')
+            return False
+        if not exists:
+            conn.execute(text(f'INSERT INTO {ACTIVITY_TABLE} (item_id, popularity, seq) '
+                              f'SELECT id, popularity, 0 FROM ({_POPULARITY.text})'))
+    return True
+
+
+def get_item_suggestions() -> Optional[ItemSuggestions]:
+    """Return the item suggestions of the current app, if enabled."""
+    return current_app.extensions.get('item_suggestions')
+
+
+def init_item_suggestions(app: Flask):
+    """Build the suggestions index of `app`, if `SUGGEST_INDEX` (default True).
+
+    Must be called after `.utils.invalidation.init_invalidation_bus()`, which
+    is required to update the index, otherwise it's only built at startup.
+    """
+    from .models.database import db  # pylint: disable=import-outside-toplevel
+    if not config_flag(app.config, 'SUGGEST_INDEX', True):
+        return
+    engine = db.get_engine(app)
+    bus = app.extensions.get('invalidation_bus')
+    track_changes = bus is not None and install_activity_tracking(engine)
+    suggestions = ItemSuggestions(engine, track_changes=track_changes)
+    if track_changes:
+        # NOTE: registered (installing the version triggers) before the index
+        # is built, so no change after the build goes unnoticed
+        bus.register(suggestions, ACTIVITY_TABLE)
+    else:
+        logger.warning('Suggestions are not updated without CACHE_INVALIDATION_BUS')
+    suggestions.build()
+    app.extensions['item_suggestions'] = suggestions
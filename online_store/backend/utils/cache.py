@@ -0,0 +1,264 @@
+"""Provides in-process caches, including a read-through cache of store items.
+
+Items are cached as their pre-serialized JSON bytes keyed by id, so a hit
+costs neither a query nor serialisation. Every code path mutating the
+`items` table must invalidate the affected ids (or the whole cache) once its
+changes are committed, see `invalidate_items()`.
+
+Item listings are cached as complete responses keyed by the `items` table
+version and the normalized request arguments, see `items_response()`.
+
+Examples
+--------
+.. code-block:: python
+
+    body = get_item_json(1)  # queries the database on a miss only
+    invalidate_items(1)  # after committing a change to item 1
+
+"""
+import json
+import threading
+
+from collections import OrderedDict
+from time import monotonic
+from typing import Any, Callable, Dict, Hashable, List, Optional, Tuple
+
+from flask import Flask, Response, current_app, request
+
+from .metrics import REGISTRY, Counter
+from .model_serialisers.json_encoder import AlchemyEncoder
+from .table_versions import install_session_listeners, table_version
+
+_MISSING = object()
+
+CACHE_REQUESTS = REGISTRY.register(Counter(
+    'cache_requests_total', 'Number of cache lookups by cache and result (hit or miss).',
+    ['cache', 'result']))
+CACHE_EVICTIONS = REGISTRY.register(Counter(
+    'cache_evictions_total', 'Number of entries evicted from a full cache.', ['cache']))
+
+
+class LRUCache:
+    """A thread-safe mapping evicting the least recently used entry when full.
+
+    Parameters
+    ----------
+    maxsize: int
+        The maximum number of entries.
+    name: str
+        The name of the cache used to label its metrics.
+    ttl: Optional[float]
+        If given, the number of seconds after which entries expire.
+    """
+
+    def __init__(self, maxsize: int = 10000, name: str = 'cache', ttl: Optional[float] = None):
+        self.maxsize = maxsize
+        self.name = name
+        self.ttl = ttl
+        # maps key -> (expiry time or None, value)
+        self._data: 'OrderedDict[Hashable, Tuple[Optional[float], Any]]' = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """Return the value for `key`, marking it as recently used."""
+        with self._lock:
+            expires, value = self._data.get(key, (None, _MISSING))
+            if expires is not None and expires <= monotonic():
+                del self._data[key]
+                value = _MISSING
+            if value is _MISSING:
+                self.misses += 1
+            else:
+                self._data.move_to_end(key)
+                self.hits += 1
+        CACHE_REQUESTS.inc(self.name, 'miss' if value is _MISSING else 'hit')
+        return default if value is _MISSING else value
+
+    def set(self, key: Hashable, value: Any):
+        """Store `value` for `key`, evicting the least recently used if full."""
+        if self.maxsize <= 0:
+            return
+        evicted = 0
+        expires = monotonic() + self.ttl if self.ttl is not None else None
+        with self._lock:
+            self._data[key] = (expires, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                evicted += 1
+            self.evictions += evicted
+        if evicted:
+            CACHE_EVICTIONS.inc(self.name, amount=evicted)
+
+    def invalidate(self, *keys: Hashable):
+        """Remove `keys`, or every entry if no keys are given."""
+        with self._lock:
+            if not keys:
+                self._data.clear()
+            for key in keys:
+                self._data.pop(key, None)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._data
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    @property
+    def stats(self) -> Dict[str, int]:
+        """Return the size and hit, miss and eviction counts of the cache."""
+        return {'size': len(self._data), 'maxsize': self.maxsize, 'hits': self.hits,
+                'misses': self.misses, 'evictions': self.evictions}
+
+
+class SingleFlight:
+    """Coalesces concurrent calls for the same key into a single call.
+
+    The first caller for a key runs the function, whilst any concurrent
+    callers for that key wait for, and share, its result (or exception).
+    """
+
+    class _Call:  # pylint: disable=too-few-public-methods
+        __slots__ = ('done', 'result', 'error')
+
+        def __init__(self):
+            self.done = threading.Event()
+            self.result: Any = None
+            self.error: Optional[BaseException] = None
+
+    def __init__(self):
+        self._calls: Dict[Hashable, 'SingleFlight._Call'] = {}
+        self._lock = threading.Lock()
+        self.coalesced = 0
+
+    def do(self, key: Hashable, func: Callable[[], Any],  # pylint: disable=invalid-name
+           timeout: Optional[float] = None) -> Any:
+        """Return `func()`, sharing the result with concurrent calls for `key`.
+
+        Raises
+        ------
+        TimeoutError
+            When waiting longer than `timeout` seconds for another caller.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = self._Call()
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            if not call.done.wait(timeout):
+                raise TimeoutError(f'timed out waiting for {key!r}')
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = func()
+        except BaseException as err:  # pylint: disable=broad-except
+            call.error = err
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result
+
+
+# a cached response: (body, status code, headers)
+CachedResponse = Tuple[bytes, int, List[Tuple[str, str]]]
+
+CACHEABLE_STATUS_CODES = (200, 204)
+
+
+def cached_response(cache: LRUCache, key: Hashable, build: Callable[[], Response],
+                    flight: Optional[SingleFlight] = None) -> Response:
+    """Return the response for `key` from `cache`, building it on a miss.
+
+    If `flight` is given, concurrent misses for the same `key` are coalesced,
+    so that only one caller builds the response. Only successful responses
+    are cached.
+    """
+    cached: Optional[CachedResponse] = cache.get(key)
+    if cached is None:
+        def build_and_cache() -> CachedResponse:
+            response = build()
+            entry = (response.get_data(), response.status_code,
+                     [(name, value) for name, value in response.headers
+                      if name != 'Content-Length'])
+            if response.status_code in CACHEABLE_STATUS_CODES:
+                cache.set(key, entry)
+            return entry
+        cached = build_and_cache() if flight is None else flight.do(key, build_and_cache)
+    body, status, headers = cached
+    return Response(body, status=status, headers=headers)
+
+
+def normalized_args(args) -> Tuple[Tuple[str, Tuple[str, ...]], ...]:
+    """Return request `args` as a hashable key, independent of their order."""
+    return tuple(sorted((key, tuple(sorted(values)))
+                        for key, values in args.to_dict(flat=False).items()))
+
+
+def get_item_cache() -> LRUCache:
+    """Return the item cache of the current app."""
+    return current_app.extensions['item_cache']
+
+
+def get_item_json(item_id: int) -> Optional[bytes]:
+    """Return the JSON encoded item with `item_id`, or None if it doesn't exist."""
+    from ..models.item import ItemModel  # pylint: disable=import-outside-toplevel
+    cache = get_item_cache()
+    body = cache.get(item_id)
+    if body is None:
+        item = ItemModel.query.get(item_id)
+        if item is None:
+            return None
+        body = json.dumps(item, cls=AlchemyEncoder).encode('utf8')
+        cache.set(item_id, body)
+    return body
+
+
+def invalidate_items(*item_ids: int):
+    """Remove `item_ids` (or all items if none are given) from the item cache."""
+    get_item_cache().invalidate(*item_ids)
+
+
+def items_response(build: Callable[[], Response]) -> Response:
+    """Return the cached `/store/items` response for the request arguments.
+
+    Entries are keyed by the `items` table version, so any committed write
+    to the table invalidates every cached listing. Concurrent misses are
+    coalesced by decorating the view with `.single_flight.single_flight`.
+    """
+    key = (table_version('items'), normalized_args(request.args))
+    return cached_response(current_app.extensions['items_response_cache'], key, build)
+
+
+def init_item_cache(app: Flask):
+    """Add the item and item listing response caches to `app`.
+
+    The following config keys are used, where a size of zero disables the
+    respective cache:
+
+        - `ITEM_CACHE_SIZE`: the maximum number of items, default is 10000.
+        - `ITEMS_RESPONSE_CACHE_SIZE`: the maximum number of `/store/items`
+          responses, default is 256.
+        - `ITEMS_RESPONSE_CACHE_TTL`: the number of seconds `/store/items`
+          responses are cached for, default is 60.
+    """
+    app.config['ITEM_CACHE_SIZE'] = int(app.config.get('ITEM_CACHE_SIZE', 10000))
+    app.config['ITEMS_RESPONSE_CACHE_SIZE'] = \
+        int(app.config.get('ITEMS_RESPONSE_CACHE_SIZE', 256))
+    app.config['ITEMS_RESPONSE_CACHE_TTL'] = \
+        float(app.config.get('ITEMS_RESPONSE_CACHE_TTL', 60))
+    app.extensions['item_cache'] = LRUCache(app.config['ITEM_CACHE_SIZE'], name='items')
+    app.extensions['items_response_cache'] = LRUCache(
+        app.config['ITEMS_RESPONSE_CACHE_SIZE'], name='items_response',
+        ttl=app.config['ITEMS_RESPONSE_CACHE_TTL'])
+    install_session_listeners()
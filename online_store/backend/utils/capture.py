@@ -0,0 +1,137 @@
+"""Provides opt-in capture of sanitized requests for later replay.
+
+When `REQUEST_CAPTURE_FILE` is configured, the method, path, endpoint, query
+arguments and JSON body of each request are written with its start time,
+duration and status code as one compact JSON line, by a background thread via
+a bounded queue (see `.log.BoundedQueueWriter`). Values of sensitive keys,
+e.g. passwords, tokens and contact details, are redacted and headers are never
+recorded, only whether the request was authenticated.
+
+Captured files can be replayed with ``python manage.py replay``.
+
+"""
+import atexit
+import json
+import re
+
+from time import perf_counter, time
+from typing import Any, Dict, Optional
+
+from flask import Flask, Response, current_app, g, request
+
+from .log import BoundedQueueWriter, RotatingFileWriter
+
+REDACTED = '***'
+# NOTE: matched against whole segments of snake or kebab case keys (camel case
+# keys are split first), so e.g. `author` and `ip_address` are not redacted
+SENSITIVE_KEY_RE = re.compile(r'(?:^|[_-])(?:pass(?:word|wd|phrase)?|token|secret|'
+                              r'auth(?:orization)?|e?mail|phone|card|(?<!ip[_-])address)'
+                              r'(?:[_-]|$)', re.IGNORECASE)
+_CAMEL_CASE_RE = re.compile(r'([a-z0-9])([A-Z])')
+DEFAULT_EXCLUDE = '/metrics,/apidocs,/apispec,/flasgger_static'
+
+
+def is_sensitive(key: Any) -> bool:
+    """Return whether the value of `key` must be redacted, e.g. `access_token`."""
+    return SENSITIVE_KEY_RE.search(_CAMEL_CASE_RE.sub(r'\1_\2', str(key))) is not None
+
+
+def sanitize(value: Any) -> Any:
+    """Return a copy of `value` with the values of sensitive keys redacted."""
+    if isinstance(value, dict):
+        return {key: REDACTED if is_sensitive(key) else sanitize(val)
+                for key, val in value.items()}
+    if isinstance(value, list):
+        return [sanitize(val) for val in value]
+    return value
+
+
+class RequestCapture:
+    """Writes captured requests as JSON lines to a rotating file.
+
+    Parameters
+    ----------
+    path: str
+        The capture file.
+    maxsize: int
+        The maximum number of pending records before records are dropped.
+    rotation: Union[int, str]
+        The file size at which the capture file is rotated, e.g. '100MB'.
+    """
+
+    def __init__(self, path: str, maxsize: int = 10000, rotation: str = '100MB'):
+        self.path = path
+        self._file = RotatingFileWriter(path, rotation, compression='zip')
+        self._writer = BoundedQueueWriter(self._file.write, maxsize=maxsize,
+                                          flush=self._file.flush, close=self._file.close,
+                                          name='request-capture')
+
+    def record(self, record: Dict[str, Any]):
+        """Enqueue `record` to be written, without blocking."""
+        self._writer.put(json.dumps(record, separators=(',', ':'), default=str) + '\n')
+
+    @property
+    def dropped(self) -> int:
+        """The number of records dropped due to the queue being full."""
+        return self._writer.dropped
+
+    def close(self, timeout: Optional[float] = 5.0):
+        """Write any pending records and close the capture file."""
+        self._writer.close(timeout)
+
+
+def _before_request():
+    g.capture_time = time()
+    g.capture_start = perf_counter()
+
+
+def _after_request(response: Response) -> Response:
+    start = g.get('capture_start')
+    capture: RequestCapture = current_app.extensions.get('request_capture')
+    if start is None or capture is None or \
+            request.path.startswith(current_app.config['REQUEST_CAPTURE_EXCLUDE']):
+        return response
+    record = {
+        'ts': round(g.capture_time, 6),
+        'ms': round((perf_counter() - start) * 1000., 3),
+        'method': request.method,
+        'path': request.path,
+        'endpoint': request.endpoint,
+        'status': response.status_code,
+        'auth': 'Authorization' in request.headers,
+    }
+    if request.args:
+        record['args'] = sanitize(request.args.to_dict(flat=False))
+    if request.is_json:
+        data = request.get_json(silent=True)
+        if data is not None:
+            record['json'] = sanitize(data)
+    capture.record(record)
+    return response
+
+
+def init_request_capture(app: Flask):
+    """Capture requests handled by `app` if `REQUEST_CAPTURE_FILE` is set.
+
+    The following config keys are used:
+
+        - `REQUEST_CAPTURE_FILE`: the file to write captured requests to.
+        - `REQUEST_CAPTURE_QUEUE_SIZE`: the maximum number of pending records
+          before records are dropped, default is 10000.
+        - `REQUEST_CAPTURE_EXCLUDE`: comma separated path prefixes not to
+          capture, by default metrics and API docs.
+    """
+    path = app.config.get('REQUEST_CAPTURE_FILE')
+    if not path:
+        return
+    exclude = app.config.get('REQUEST_CAPTURE_EXCLUDE', DEFAULT_EXCLUDE)
+    if isinstance(exclude, str):
+        exclude = [prefix.strip() for prefix in exclude.split(',') if prefix.strip()]
+    app.config['REQUEST_CAPTURE_EXCLUDE'] = tuple(exclude)
+
+    maxsize = int(app.config.get('REQUEST_CAPTURE_QUEUE_SIZE', 10000))
+    capture = RequestCapture(str(path), maxsize=maxsize)
+    app.extensions['request_capture'] = capture
+    atexit.register(capture.close)
+    app.before_request(_before_request)
+    app.after_request(_after_request)
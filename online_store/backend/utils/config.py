@@ -0,0 +1,18 @@
+"""Provides helpers for interpreting app config values."""
+from typing import Any, Mapping
+
+TRUTHY = ('1', 'true', 'yes', 'on')
+
+
+def config_flag(config: Mapping[str, Any], key: str, default: bool = False) -> bool:
+    """Return config `key` as a bool, accepting strings such as 'true' or '0'.
+
+    Values set via environment variables are strings, so e.g. '0' or 'false'
+    must be interpreted as False rather than relying on truthiness.
+    """
+    value = config.get(key)
+    if value is None:
+        return default
+    if isinstance(value, str):
+        return value.strip().lower() in TRUTHY
+    return bool(value)
@@ -0,0 +1,170 @@
+"""Provides a cache invalidation bus shared by every worker using a database.
+
+In-process caches go stale when another worker (or process) writes to the
+database. To detect this, SQLite triggers increment a per-table counter in
+the `table_versions` table on every insert, update and delete of each table
+a cache is registered for (only those, as every write to a table with the
+triggers also writes to its single counter row). At the start
+of each request the counters are read with a single query and, for each
+table whose counter changed since the previous check, the in-process table
+version is bumped (see `.table_versions`) and every cache registered for the
+table is cleared.
+
+Examples
+--------
+.. code-block:: python
+
+    bus = get_invalidation_bus()
+    bus.register(cache, 'items', 'gifts')  # cleared when either table changes
+
+"""
+import threading
+
+from time import monotonic
+from typing import Dict, Iterable, List, Optional, Set
+
+from flask import Flask, current_app
+from loguru import logger
+from sqlalchemy.engine import Engine
+
+from .config import config_flag
+from .metrics import REGISTRY, Counter
+from .table_versions import bump_table_versions
+
+VERSIONS_TABLE = 'table_versions'
+
+CACHE_BUS_INVALIDATIONS = REGISTRY.register(Counter(
+    'cache_bus_invalidations_total',
+    'Number of times a table was changed by another connection, by table.', ['table']))
+
+
+def version_trigger_statements(tables: Iterable[str]) -> List[str]:
+    """Return the SQLite statements maintaining the version counter of `tables`."""
+    statements = [f'CREATE TABLE IF NOT EXISTS {VERSIONS_TABLE} '
+                  '(name TEXT PRIMARY KEY, version INTEGER NOT NULL DEFAULT 0)']
+    for table in tables:
+        statements.append(f"INSERT OR IGNORE INTO {VERSIONS_TABLE} (name) VALUES ('{table}')")
+        for operation in ('INSERT', 'UPDATE', 'DELETE'):
+            statements.append(
+                f'CREATE TRIGGER IF NOT EXISTS {table}_{operation.lower()}_version '
+                f'AFTER {operation} ON {table} BEGIN '
+                f"UPDATE {VERSIONS_TABLE} SET version = version + 1 WHERE name = '{table}'; "
+                'END')
+    return statements
+
+
+class InvalidationBus:
+    """Clears registered caches when their tables are changed by anyone.
+
+    Parameters
+    ----------
+    interval: float
+        The minimum number of seconds between checks, where zero checks on
+        every call to `poll()`.
+    engine: Optional[Engine]
+        The SQLite database engine to install the version triggers of
+        registered tables with, if not already installed.
+    """
+
+    def __init__(self, interval: float = 0., engine: Optional[Engine] = None):
+        self.interval = interval
+        self.engine = engine
+        self._caches: Dict[str, list] = {}
+        self._versions: Optional[Dict[str, int]] = None
+        self._last_poll = float('-inf')
+        self._lock = threading.Lock()
+
+    def register(self, cache, *tables: str):
+        """Clear `cache` (anything with an `invalidate()` method) when `tables` change."""
+        with self._lock:
+            new_tables = [table for table in tables if table not in self._caches]
+            if self.engine is not None and new_tables:
+                install_version_triggers(self.engine, new_tables)
+            for table in tables:
+                self._caches.setdefault(table, []).append(cache)
+
+    def version(self, table: str) -> Optional[int]:
+        """Return the version of `table` as of the last poll, if known."""
+        versions = self._versions
+        return None if versions is None else versions.get(table)
+
+    def poll(self, dbapi_connection) -> Set[str]:
+        """Check the table versions, invalidating caches of changed tables.
+
+        The first poll only records the current versions. Returns the names
+        of the tables which changed since the previous poll.
+        """
+        now = monotonic()
+        with self._lock:
+            if now - self._last_poll < self.interval:
+                return set()
+            self._last_poll = now
+        cursor = dbapi_connection.cursor()
+        try:
+            cursor.execute(f'SELECT name, version FROM {VERSIONS_TABLE}')
+            versions = dict(cursor.fetchall())
+        finally:
+            cursor.close()
+
+        with self._lock:
+            previous, self._versions = self._versions, versions
+            if previous is None:
+                return set()
+            changed = {table for table, version in versions.items()
+                       if previous.get(table) != version}
+            caches = [cache for table in changed for cache in self._caches.get(table, ())]
+        if changed:
+            bump_table_versions(*changed)
+            for cache in caches:
+                cache.invalidate()
+            for table in changed:
+                CACHE_BUS_INVALIDATIONS.inc(table)
+        return changed
+
+
+def get_invalidation_bus() -> Optional[InvalidationBus]:
+    """Return the invalidation bus of the current app, if enabled."""
+    return current_app.extensions.get('invalidation_bus')
+
+
+def install_version_triggers(engine, tables: Iterable[str]):
+    """Create the `table_versions` table and the triggers maintaining it."""
+    with engine.begin() as conn:
+        for statement in version_trigger_statements(tables):
+            conn.execute(statement)
+
+
+def _poll_invalidation_bus():
+    from ..models.database import db  # pylint: disable=import-outside-toplevel
+    # NOTE: polled on the DBAPI connection of the session, so that the check is
+    # not attributed to the endpoint by the SQL profiler
+    current_app.extensions['invalidation_bus'].poll(db.session.connection().connection)
+
+
+def init_invalidation_bus(app: Flask):
+    """Add an invalidation bus to `app`, polled before each request.
+
+    Must be called once the database tables exist, as triggers are created
+    for the tables of the caches registered. The bus is only supported for
+    SQLite databases. The following config keys are used:
+
+        - `CACHE_INVALIDATION_BUS`: whether to enable the bus, default True.
+        - `CACHE_INVALIDATION_INTERVAL`: the minimum number of seconds
+          between checks, default is 0 (every request).
+    """
+    from ..models.database import db  # pylint: disable=import-outside-toplevel
+    if not config_flag(app.config, 'CACHE_INVALIDATION_BUS', True):
+        return
+    engine = db.get_engine(app)
+    if engine.dialect.name != 'sqlite':
+        logger.warning(f'Cache invalidation bus is not supported by {engine.dialect.name}')
+        return
+    install_version_triggers(engine, [])  # creates the versions table
+
+    app.config['CACHE_INVALIDATION_INTERVAL'] = \
+        float(app.config.get('CACHE_INVALIDATION_INTERVAL', 0))
+    bus = InvalidationBus(app.config['CACHE_INVALIDATION_INTERVAL'], engine)
+    bus.register(app.extensions['item_cache'], 'items')
+    bus.register(app.extensions['items_response_cache'], 'items')
+    app.extensions['invalidation_bus'] = bus
+    app.before_request(_poll_invalidation_bus)
@@ -0,0 +1,370 @@
+"""Provides a non-blocking, structured logging pipeline for `loguru`.
+
+Log records are handed to a bounded queue and written (and rotated/compressed)
+by a background thread, so a slow disk can never stall a request thread.
+When the queue is full records are dropped and counted rather than blocking.
+
+Examples
+--------
+.. code-block:: python
+
+    from loguru import logger
+    sink = QueuedSink('app.log', serialize=True, maxsize=10000)
+    handler_id = logger.add(sink, format='{message}',
+                            filter=LevelSampler({'DEBUG': 100}))
+
+"""
+import atexit
+import json
+import os
+import queue
+import threading
+import zipfile
+
+from collections import defaultdict
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Callable, Dict, Mapping, Optional, Union
+
+from loguru import logger
+
+_STOP = object()  # sentinel used to stop background writer threads
+
+_HANDLER_IDS: Dict[str, int] = {}  # maps sink path -> loguru handler id
+_SINKS: Dict[str, 'QueuedSink'] = {}
+_SAMPLERS: Dict[str, 'LevelSampler'] = {}
+
+
+def parse_size(size: Union[int, str]) -> int:
+    """Convert a human readable size (e.g. '10MB') to a number of bytes."""
+    if isinstance(size, int):
+        return size
+    size = str(size).strip().upper()
+    for suffix, factor in (('GB', 1024 ** 3), ('MB', 1024 ** 2), ('KB', 1024), ('B', 1)):
+        if size.endswith(suffix):
+            return int(float(size[:-len(suffix)]) * factor)
+    return int(size)
+
+
+def parse_sample_rates(rates: Union[str, Mapping[str, int], None]) -> Dict[str, int]:
+    """Parse sample rates of the form 'DEBUG=100,INFO=10' into a dict."""
+    if not rates:
+        return {}
+    if isinstance(rates, Mapping):
+        return {str(level).upper(): int(rate) for level, rate in rates.items()}
+    parsed = {}
+    for pair in str(rates).split(','):
+        level, _, rate = pair.partition('=')
+        if level.strip():
+            parsed[level.strip().upper()] = int(rate or 1)
+    return parsed
+
+
+def format_json(record: Mapping[str, Any]) -> str:
+    """Format a loguru record as a single line of JSON."""
+    data = {
+        'time': record['time'].isoformat(),
+        'level': record['level'].name,
+        'message': record['message'],
+        'logger': record['name'],
+        'function': record['function'],
+        'line': record['line'],
+        'process': record['process'].id,
+        'thread': record['thread'].name,
+    }
+    if record['extra']:
+        data['extra'] = record['extra']
+    if record['exception'] is not None:
+        exc_type, exc_value, _ = record['exception']
+        data['exception'] = {'type': getattr(exc_type, '__name__', str(exc_type)),
+                             'value': str(exc_value)}
+    return json.dumps(data, default=str)
+
+
+class RotatingFileWriter:
+    """A minimal size-based rotating file writer with optional zip compression.
+
+    Notes
+    -----
+    This is intended to be called from a single (background) thread only.
+    """
+
+    def __init__(self, path: Union[str, Path], rotation: Union[int, str] = '10MB',
+                 compression: Optional[str] = 'zip'):
+        self.path = Path(path)
+        self.max_bytes = parse_size(rotation) if rotation else 0
+        self.compression = compression
+        self._fp = None
+        self._size = 0
+
+    def _open(self):
+        self._fp = open(self.path, 'a', encoding='utf8')
+        self._size = self._fp.tell()
+
+    def _rotate(self):
+        self._fp.close()
+        stamp = datetime.now().strftime('%Y-%m-%d_%H-%M-%S_%f')
+        rotated = self.path.with_name(f'{self.path.stem}.{stamp}{self.path.suffix}')
+        os.replace(str(self.path), str(rotated))
+        if self.compression == 'zip':
+            with zipfile.ZipFile(f'{rotated}.zip', 'w', zipfile.ZIP_DEFLATED) as archive:
+                archive.write(str(rotated), rotated.name)
+            os.remove(str(rotated))
+        self._open()
+
+    def write(self, line: str):
+        """Write `line` to the file, rotating beforehand if needed."""
+        if self._fp is None:
+            self._open()
+        if self.max_bytes and self._size and self._size + len(line) > self.max_bytes:
+            self._rotate()
+        self._fp.write(line)
+        self._size += len(line)
+
+    def flush(self):
+        """Flush buffered writes to the operating system."""
+        if self._fp is not None:
+            self._fp.flush()
+
+    def close(self):
+        """Close the underlying file."""
+        if self._fp is not None:
+            self._fp.close()
+            self._fp = None
+
+
+class BoundedQueueWriter:
+    """Hands items to a background thread via a bounded queue.
+
+    Items are dropped (and counted) instead of blocking the caller when the
+    queue is full.
+
+    Attributes
+    ----------
+    dropped: int
+        The number of items dropped due to the queue being full.
+    written: int
+        The number of items successfully handled by the background thread.
+    errors: int
+        The number of items where `write` raised an exception.
+    """
+
+    def __init__(self, write: Callable[[Any], None], maxsize: int = 10000,
+                 flush: Optional[Callable[[], None]] = None,
+                 close: Optional[Callable[[], None]] = None,
+                 name: str = 'queued-writer'):
+        self._write = write
+        self._flush = flush
+        self._close = close
+        self._queue: queue.Queue = queue.Queue(maxsize=maxsize)
+        self._drop_lock = threading.Lock()
+        self.dropped = 0
+        self.written = 0
+        self.errors = 0
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    @property
+    def queued(self) -> int:
+        """Approximate number of items waiting to be written."""
+        return self._queue.qsize()
+
+    def put(self, item: Any) -> bool:
+        """Enqueue `item` without blocking, returning False if dropped."""
+        try:
+            self._queue.put_nowait(item)
+        except queue.Full:
+            with self._drop_lock:
+                self.dropped += 1
+            return False
+        return True
+
+    def _run(self):
+        get = self._queue.get
+        while True:
+            item = get()
+            if item is _STOP:
+                break
+            try:
+                self._write(item)
+                self.written += 1
+            except Exception:  # pylint: disable=broad-except
+                self.errors += 1
+            if self._flush is not None and self._queue.empty():
+                self._flush()  # flush only once the queue has been drained
+        if self._flush is not None:
+            self._flush()
+        if self._close is not None:
+            self._close()
+
+    def close(self, timeout: Optional[float] = 5.0):
+        """Stop the background thread once all queued items are written."""
+        if self._thread.is_alive():
+            self._queue.put(_STOP)
+            self._thread.join(timeout)
+
+
+class QueuedSink:
+    """A loguru sink whose formatting and file I/O happen on a background thread.
+
+    Parameters
+    ----------
+    path: Union[str, Path]
+        The log file to write to.
+    serialize: bool
+        Write structured JSON lines (see `format_json`) instead of plain text.
+    maxsize: int
+        The maximum number of pending log records before records are dropped.
+    rotation: Union[int, str]
+        The file size at which the log file is rotated, e.g. '10MB'.
+    compression: Optional[str]
+        Compression for rotated files, currently only 'zip' is supported.
+    """
+
+    def __init__(self, path: Union[str, Path], serialize: bool = False,
+                 maxsize: int = 10000, rotation: Union[int, str] = '10MB',
+                 compression: Optional[str] = 'zip'):
+        self.path = str(path)
+        self.serialize = serialize
+        self._file = RotatingFileWriter(path, rotation, compression)
+        self._writer = BoundedQueueWriter(self._write, maxsize=maxsize,
+                                          flush=self._file.flush,
+                                          close=self._file.close,
+                                          name=f'log-writer:{Path(path).name}')
+
+    def __call__(self, message):
+        """Called by loguru with the formatted message, which holds the record."""
+        self._writer.put(message)
+
+    def _write(self, message):
+        if self.serialize:
+            self._file.write(format_json(message.record) + '\n')
+        else:
+            self._file.write(str(message))
+
+    @property
+    def stats(self) -> Dict[str, int]:
+        """Return counters for the sink's queue."""
+        return {'queued': self._writer.queued,
+                'written': self._writer.written,
+                'dropped': self._writer.dropped,
+                'errors': self._writer.errors}
+
+    def close(self, timeout: Optional[float] = 5.0):
+        """Flush pending records and close the log file."""
+        self._writer.close(timeout)
+
+
+class LevelSampler:
+    """A loguru filter keeping only 1 in N records per level and call site.
+
+    The first record from each call site is always kept, so that infrequent
+    messages are never lost, whilst hot paths are thinned out.
+
+    Parameters
+    ----------
+    rates: Mapping[str, int]
+        Mapping of level name to sample rate N, e.g. ``{'DEBUG': 100}``.
+        Levels without a rate (or with a rate <= 1) are not sampled.
+    """
+
+    def __init__(self, rates: Mapping[str, int]):
+        self.rates = {level: rate for level, rate in parse_sample_rates(rates).items()
+                      if rate > 1}
+        self._counts: Dict[tuple, int] = defaultdict(int)
+        self.sampled_out = 0
+
+    def __call__(self, record) -> bool:
+        rate = self.rates.get(record['level'].name)
+        if rate is None:
+            return True
+        key = (record['file'].path, record['line'])
+        count = self._counts[key]
+        self._counts[key] = count + 1
+        if count % rate:
+            self.sampled_out += 1
+            return False
+        return True
+
+
+def add_file_sink(path: Union[str, Path], enqueue: bool = False,
+                  serialize: bool = False, maxsize: int = 10000,
+                  sample_rates: Union[str, Mapping[str, int], None] = None,
+                  record_filter: Optional[Callable[[Mapping[str, Any]], bool]] = None,
+                  **kwargs) -> int:
+    """Add (or replace) a loguru file sink for `path`, returning the handler id.
+
+    Parameters
+    ----------
+    path: Union[str, Path]
+        The log file to write to.
+    enqueue: bool
+        Use a `QueuedSink` so formatting and I/O happen on a background thread.
+    serialize: bool
+        Write structured JSON lines rather than plain text.
+    maxsize: int
+        The bounded queue size when `enqueue` is True.
+    sample_rates: Union[str, Mapping[str, int]]
+        Per-level sample rates, see `LevelSampler`.
+    record_filter: Optional[Callable[[Mapping[str, Any]], bool]]
+        Only write records for which this returns True.
+    kwargs:
+        Extra arguments passed to `loguru.logger.add()`, e.g. `rotation`,
+        `compression` and `backtrace`.
+
+    Notes
+    -----
+    Calling this again for the same `path` (e.g. from repeated `create_app()`
+    calls) replaces the previous sink, rather than writing every line twice.
+    """
+    path = str(path)
+    remove_file_sink(path)
+
+    sampler = LevelSampler(parse_sample_rates(sample_rates))
+    log_filter = sampler if sampler.rates else None
+    if record_filter is not None:
+        log_filter = record_filter if log_filter is None else \
+            (lambda record: record_filter(record) and sampler(record))
+    if enqueue:
+        sink = QueuedSink(path, serialize=serialize, maxsize=maxsize,
+                          rotation=kwargs.pop('rotation', None),
+                          compression=kwargs.pop('compression', None))
+        _SINKS[path] = sink
+        if serialize:
+            kwargs['format'] = '{message}'  # record is formatted as JSON by the sink
+        handler_id = logger.add(sink, filter=log_filter, **kwargs)
+    else:
+        handler_id = logger.add(path, serialize=serialize, filter=log_filter, **kwargs)
+    _HANDLER_IDS[path] = handler_id
+    _SAMPLERS[path] = sampler
+    return handler_id
+
+
+def remove_file_sink(path: Union[str, Path]):
+    """Remove the loguru file sink for `path`, flushing any queued records."""
+    path = str(path)
+    handler_id = _HANDLER_IDS.pop(path, None)
+    if handler_id is not None:
+        try:
+            logger.remove(handler_id)
+        except ValueError:
+            pass  # already removed elsewhere, e.g. by logger.remove()
+    sink = _SINKS.pop(path, None)
+    if sink is not None:
+        sink.close()
+    _SAMPLERS.pop(path, None)
+
+
+def get_log_stats() -> Dict[str, Dict[str, int]]:
+    """Return queue and sampling counters for each file sink, keyed by path."""
+    stats = {}
+    for path, sampler in _SAMPLERS.items():
+        sink = _SINKS.get(path)
+        stats[path] = dict(sink.stats if sink else {}, sampled_out=sampler.sampled_out)
+    return stats
+
+
+@atexit.register
+def _close_sinks():
+    for path in list(_HANDLER_IDS):
+        remove_file_sink(path)
@@ -0,0 +1,278 @@
+"""Provides lightweight in-process metrics rendered in Prometheus text format.
+
+The metric classes are deliberately minimal (no dependency on
+`prometheus_client`), recording into preallocated lists keyed by a tuple of
+label values so that observing a value costs a dict lookup, a bisect and a
+couple of additions under an uncontended lock.
+
+Examples
+--------
+>>> requests = Counter('requests_total', 'Number of requests.', ['method'])
+>>> requests.inc('GET')
+>>> print(render_metrics(MetricsRegistry([requests])))  # doctest: +NORMALIZE_WHITESPACE
+# HELP requests_total Number of requests.
+# TYPE requests_total counter
+requests_total{method="GET"} 1.0
+
+Notes
+-----
+Metrics are per process, so when running multiple workers each worker
+reports its own values (distinguishable via the `instance` target label).
+
+"""
+import threading
+
+from bisect import bisect_left
+from time import perf_counter
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+from flask import Flask, Response, g, request
+
+from .log import get_log_stats
+
+LabelValues = Tuple[object, ...]
+
+DEFAULT_LATENCY_BUCKETS = (.001, .0025, .005, .01, .025, .05, .1, .25, .5, 1., 2.5, 5., 10.)
+DEFAULT_SIZE_BUCKETS = (100, 1000, 10000, 100000, 1000000, 10000000)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def _escape(value: str) -> str:
+    return str(value).replace('\\', r'\\').replace('\n', r'\n').replace('"', r'\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = '') -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class Metric:
+    """Base class for metrics with an optional set of label names."""
+
+    TYPE = 'untyped'
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def samples(self) -> Iterator[Tuple[str, str, float]]:
+        """Yield tuples of (name suffix, formatted labels, value)."""
+        raise NotImplementedError
+
+    def render(self) -> str:
+        """Render the metric in Prometheus text exposition format."""
+        lines = [f'# HELP {self.name} {self.documentation}',
+                 f'# TYPE {self.name} {self.TYPE}']
+        lines.extend(f'{self.name}{suffix}{labels} {float(value)!r}'
+                     for suffix, labels, value in self.samples())
+        return '\n'.join(lines)
+
+
+class Counter(Metric):
+    """A monotonically increasing counter."""
+
+    TYPE = 'counter'
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, *labelvalues: str, amount: float = 1):
+        """Increment the counter for the given label values by `amount`."""
+        with self._lock:
+            self._values[labelvalues] = self._values.get(labelvalues, 0) + amount
+
+    def get(self, *labelvalues: str) -> float:
+        """Return the current value for the given label values."""
+        return self._values.get(labelvalues, 0)
+
+    def samples(self) -> Iterator[Tuple[str, str, float]]:
+        with self._lock:
+            values = sorted(self._values.items())
+        for labelvalues, value in values:
+            yield '', _format_labels(self.labelnames, labelvalues), value
+
+
+class Gauge(Counter):
+    """A value that can go up and down, optionally computed by a callback.
+
+    Parameters
+    ----------
+    callback: Optional[Callable[[], Dict[LabelValues, float]]]
+        If given, called at render time to obtain the values keyed by labels.
+    """
+
+    TYPE = 'gauge'
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = (),
+                 callback: Optional[Callable[[], Dict[LabelValues, float]]] = None):
+        super().__init__(name, documentation, labelnames)
+        self._callback = callback
+
+    def dec(self, *labelvalues: str, amount: float = 1):
+        """Decrement the gauge for the given label values by `amount`."""
+        self.inc(*labelvalues, amount=-amount)
+
+    def set(self, *labelvalues: str, value: float):
+        """Set the gauge for the given label values to `value`."""
+        with self._lock:
+            self._values[labelvalues] = value
+
+    def samples(self) -> Iterator[Tuple[str, str, float]]:
+        if self._callback is not None:
+            with self._lock:
+                self._values = dict(self._callback())
+        return super().samples()
+
+
+class Histogram(Metric):
+    """A histogram of observed values using cumulative `le` buckets."""
+
+    TYPE = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = (),
+                 buckets: Sequence[float] = DEFAULT_LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # per label values: [count per bucket..., count in +Inf bucket, sum]
+        self._values: Dict[LabelValues, List[float]] = {}
+
+    def observe(self, value: float, *labelvalues: str):
+        """Record `value` for the given label values."""
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._values.get(labelvalues)
+            if counts is None:
+                counts = self._values[labelvalues] = [0] * (len(self.buckets) + 2)
+            counts[index] += 1
+            counts[-1] += value
+
+    def get_count(self, *labelvalues: str) -> int:
+        """Return the total number of observations for the given label values."""
+        counts = self._values.get(labelvalues)
+        return int(sum(counts[:-1])) if counts else 0
+
+    def samples(self) -> Iterator[Tuple[str, str, float]]:
+        with self._lock:
+            values = [(labelvalues, list(counts))
+                      for labelvalues, counts in sorted(self._values.items())]
+        for labelvalues, counts in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                le_label = 'le="+Inf"' if bound == float('inf') else f'le="{bound!r}"'
+                yield '_bucket', _format_labels(self.labelnames, labelvalues, le_label), cumulative
+            labels = _format_labels(self.labelnames, labelvalues)
+            yield '_sum', labels, counts[-1]
+            yield '_count', labels, cumulative
+
+
+class MetricsRegistry:
+    """A collection of metrics to be rendered together."""
+
+    def __init__(self, metrics: Iterable[Metric] = ()):
+        self._metrics: Dict[str, Metric] = {metric.name: metric for metric in metrics}
+
+    def register(self, metric: Metric) -> Metric:
+        """Add `metric` to the registry (replacing any of the same name)."""
+        self._metrics[metric.name] = metric
+        return metric
+
+    def __iter__(self) -> Iterator[Metric]:
+        return iter(self._metrics.values())
+
+
+def render_metrics(registry: Optional[MetricsRegistry] = None) -> str:
+    """Render all metrics in `registry` in Prometheus text format."""
+    return '\n'.join(metric.render() for metric in (registry or REGISTRY)) + '\n'
+
+
+def _log_sink_stats() -> Dict[LabelValues, float]:
+    return {(sink, stat): value
+            for sink, stats in get_log_stats().items()
+            for stat, value in stats.items()}
+
+
+REGISTRY = MetricsRegistry()
+
+# HTTP request metrics
+REQUEST_LATENCY = REGISTRY.register(Histogram(
+    'http_request_duration_seconds', 'HTTP request latency in seconds.',
+    ['endpoint', 'method', 'status']))
+REQUEST_IN_FLIGHT = REGISTRY.register(Gauge(
+    'http_requests_in_flight', 'Number of HTTP requests currently being handled.',
+    ['endpoint']))
+RESPONSE_SIZE = REGISTRY.register(Histogram(
+    'http_response_size_bytes', 'HTTP response body size in bytes.',
+    ['endpoint'], buckets=DEFAULT_SIZE_BUCKETS))
+
+# domain metrics
+GIFT_PURCHASES = REGISTRY.register(Counter(
+    'gift_purchases_total', 'Number of successful gift purchases.', ['backend']))
+GIFT_PURCHASED_QUANTITY = REGISTRY.register(Counter(
+    'gift_purchased_quantity_total', 'Total quantity of gifts purchased.', ['backend']))
+GIFT_OVERSELL_REJECTIONS = REGISTRY.register(Counter(
+    'gift_oversell_rejections_total',
+    'Number of gift purchases rejected for exceeding the desired quantity.', ['backend']))
+GIFT_STOCK_FAILURES = REGISTRY.register(Counter(
+    'gift_stock_failures_total',
+    'Number of gift purchases rejected due to insufficient item stock.', ['backend']))
+ORDERS = REGISTRY.register(Counter(
+    'orders_total', 'Number of orders by resulting status.', ['status']))
+ORDER_STOCK_FAILURES = REGISTRY.register(Counter(
+    'order_stock_failures_total', 'Number of orders rejected due to insufficient stock.'))
+
+# logging pipeline metrics, see .log
+LOG_SINK_STATS = REGISTRY.register(Gauge(
+    'log_sink_records', 'Queued, written, dropped and sampled out log records per file sink.',
+    ['sink', 'stat'], callback=_log_sink_stats))
+
+
+def _before_request():
+    g.metrics_endpoint = endpoint = request.endpoint or 'unmatched'
+    g.metrics_start = perf_counter()
+    REQUEST_IN_FLIGHT.inc(endpoint)
+
+
+def _after_request(response: Response) -> Response:
+    endpoint = g.get('metrics_endpoint')
+    if endpoint is None:
+        return response  # before_request was not reached
+    REQUEST_LATENCY.observe(perf_counter() - g.metrics_start,
+                            endpoint, request.method, response.status_code)
+    size = response.content_length
+    if size is not None:  # i.e. not a streamed response
+        RESPONSE_SIZE.observe(size, endpoint)
+    g.metrics_observed = True
+    return response
+
+
+def _teardown_request(exc: Optional[BaseException] = None):
+    endpoint = g.pop('metrics_endpoint', None)
+    if endpoint is None:
+        return  # before_request was not reached
+    REQUEST_IN_FLIGHT.dec(endpoint)
+    if exc is not None and not g.pop('metrics_observed', False):
+        REQUEST_LATENCY.observe(perf_counter() - g.metrics_start,
+                                endpoint, request.method, 500)
+
+
+def init_request_metrics(app: Flask):
+    """Register request timing middleware with `app`.
+
+    Records latency histograms per endpoint, method and status code,
+    in-flight request gauges per endpoint and response size histograms.
+    """
+    app.before_request(_before_request)
+    app.after_request(_after_request)
+    app.teardown_request(_teardown_request)
+
+
+def metrics_response() -> Response:
+    """Return a response containing all metrics in Prometheus text format."""
+    return Response(render_metrics(), mimetype=None, content_type=CONTENT_TYPE)
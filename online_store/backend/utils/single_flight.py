@@ -0,0 +1,112 @@
+"""Provides coalescing of concurrent identical requests to expensive views.
+
+Views decorated with `single_flight` are only run once for concurrent
+requests with the same endpoint, view arguments, query arguments and JWT
+identity: the first request runs the view, whilst identical requests arriving
+before it finishes wait for its response and are sent a copy of it. Should
+the first request take longer than `SINGLE_FLIGHT_TIMEOUT` seconds, waiting
+requests fall back to running the view themselves, as they do if the first
+response is streamed.
+
+Examples
+--------
+.. code-block:: python
+
+    @gifts_router.route('/list/report')
+    @jwt_required
+    @single_flight
+    def gift_report() -> Response:
+        ...
+
+"""
+from functools import wraps
+from typing import Callable, Hashable, Union
+
+from flask import Flask, Response, current_app, request
+from flask_jwt_extended import get_jwt_identity
+from loguru import logger
+
+from .cache import CachedResponse, SingleFlight, normalized_args
+from .metrics import REGISTRY, Counter
+
+SINGLE_FLIGHT_COALESCED = REGISTRY.register(Counter(
+    'single_flight_coalesced_total',
+    'Number of requests sent the response of an identical in-flight request.',
+    ['endpoint']))
+SINGLE_FLIGHT_TIMEOUTS = REGISTRY.register(Counter(
+    'single_flight_timeouts_total',
+    'Number of requests which timed out waiting for an identical request.', ['endpoint']))
+
+
+def request_key() -> Hashable:
+    """Return the key identifying identical requests to the current endpoint."""
+    return (request.endpoint, tuple(sorted((request.view_args or {}).items())),
+            normalized_args(request.args), get_jwt_identity())
+
+
+def _respond(view: Callable, args, kwargs) -> Union[CachedResponse, Response]:
+    """Run `view`, returning its response as a `CachedResponse` unless streamed."""
+    response = current_app.make_response(view(*args, **kwargs))
+    if response.is_streamed:
+        return response  # can't be shared without buffering it
+    return (response.get_data(), response.status_code,
+            [(name, value) for name, value in response.headers if name != 'Content-Length'])
+
+
+def _as_response(result: Union[CachedResponse, Response]) -> Response:
+    if isinstance(result, Response):
+        return result
+    body, status, headers = result
+    return Response(body, status=status, headers=headers)
+
+
+def _follow(view: Callable, args, kwargs, result: Union[CachedResponse, Response]) -> Response:
+    """Return a copy of the leader's `result`, else run `view` if it was streamed."""
+    if isinstance(result, Response):
+        return current_app.make_response(view(*args, **kwargs))
+    SINGLE_FLIGHT_COALESCED.inc(request.endpoint)
+    return _as_response(result)
+
+
+def _after_timeout(view: Callable, args, kwargs) -> Response:
+    """Run `view`, having timed out waiting for an identical request."""
+    SINGLE_FLIGHT_TIMEOUTS.inc(request.endpoint)
+    logger.warning(f'Timed out waiting for in-flight {request.endpoint} request')
+    return _as_response(_respond(view, args, kwargs))
+
+
+def single_flight(view: Callable) -> Callable:
+    """Decorate `view` so that concurrent identical requests share a response.
+
+    Must be applied after (i.e. below) `jwt_required`, so the identity of
+    the request is known.
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs) -> Response:
+        flight: SingleFlight = current_app.extensions['single_flight']
+        leader = False
+
+        def shared() -> Union[CachedResponse, Response]:
+            nonlocal leader
+            leader = True
+            return _respond(view, args, kwargs)
+
+        try:
+            result = flight.do(request_key(), shared,
+                               timeout=current_app.config['SINGLE_FLIGHT_TIMEOUT'])
+        except TimeoutError:
+            if leader:  # raised by the view itself
+                raise
+            return _after_timeout(view, args, kwargs)
+        return _as_response(result) if leader else _follow(view, args, kwargs, result)
+    return wrapper
+
+
+def init_single_flight(app: Flask):
+    """Add request coalescing for views decorated with `single_flight` to `app`.
+
+    The `SINGLE_FLIGHT_TIMEOUT` config key sets the maximum number of
+    seconds to wait for an identical request, default is 10.
+    """
+    app.config['SINGLE_FLIGHT_TIMEOUT'] = float(app.config.get('SINGLE_FLIGHT_TIMEOUT', 10))
+    app.extensions['single_flight'] = SingleFlight()
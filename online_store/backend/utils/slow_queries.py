@@ -0,0 +1,158 @@
+"""Provides a slow-query log capturing the query plan of slow SQL statements.
+
+Statements taking at least `SQL_SLOW_QUERY_THRESHOLD_MS` are recorded with
+their SQL, the types (but not values) of their bound parameters, the calling
+endpoint and, for SQLite, the output of ``EXPLAIN QUERY PLAN``. Entries are
+kept in memory for the admin endpoint (see `routes/admin.py`) and written as
+JSON lines to the rotating `SQL_SLOW_QUERY_LOG` file.
+
+"""
+import json
+import os
+import threading
+
+from collections import deque
+from datetime import datetime, timezone
+from typing import Any, Deque, Dict, List, Optional
+
+from flask import Flask, current_app, has_app_context, has_request_context, request
+from loguru import logger
+
+from .config import config_flag
+from .log import add_file_sink
+from .metrics import REGISTRY, Counter
+
+SLOW_QUERIES_TOTAL = REGISTRY.register(Counter(
+    'db_slow_queries_total', 'Number of SQL statements exceeding the slow query threshold.',
+    ['endpoint']))
+
+_slow_query_logger = logger.bind(slow_query=True)
+
+
+def parameter_shapes(parameters: Any) -> Any:
+    """Return the type names of bound `parameters`, without their values."""
+    if isinstance(parameters, dict):
+        return {key: type(value).__name__ for key, value in parameters.items()}
+    if isinstance(parameters, (list, tuple)):
+        if parameters and isinstance(parameters[0], (list, tuple, dict)):
+            # executemany(), so describe the first set of parameters only
+            return [parameter_shapes(parameters[0]), f'x{len(parameters)}']
+        return [type(value).__name__ for value in parameters]
+    return type(parameters).__name__
+
+
+def explain_query_plan(dbapi_connection, statement: str, parameters: Any) -> List[str]:
+    """Return the SQLite query plan for `statement` as indented lines.
+
+    A fresh DB-API cursor is used so that SQLAlchemy events are not triggered
+    (and the plan is never itself reported as a slow query).
+    """
+    if isinstance(parameters, (list, tuple)) and parameters and \
+            isinstance(parameters[0], (list, tuple, dict)):
+        parameters = parameters[0]
+    cursor = dbapi_connection.cursor()
+    try:
+        cursor.execute(f'EXPLAIN QUERY PLAN {statement}', parameters or ())
+        rows = cursor.fetchall()
+    finally:
+        cursor.close()
+
+    depths: Dict[int, int] = {0: -1}
+    lines = []
+    for row in rows:
+        node_id, parent_id, detail = row[0], row[1], row[-1]
+        depths[node_id] = depths.get(parent_id, -1) + 1
+        lines.append('  ' * depths[node_id] + str(detail))
+    return lines
+
+
+class SlowQueryLog:
+    """A bounded, thread-safe record of recent slow queries."""
+
+    def __init__(self, maxlen: int = 100):
+        self._entries: Deque[Dict[str, Any]] = deque(maxlen=maxlen)
+        self._lock = threading.Lock()
+
+    def append(self, entry: Dict[str, Any]):
+        """Add `entry`, discarding the oldest entry if full."""
+        with self._lock:
+            self._entries.append(entry)
+
+    def entries(self) -> List[Dict[str, Any]]:
+        """Return the recorded entries, most recent first."""
+        with self._lock:
+            return list(reversed(self._entries))
+
+    def clear(self):
+        """Remove all entries."""
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+SLOW_QUERIES = SlowQueryLog()
+
+
+def slow_query_threshold() -> Optional[float]:
+    """Return the slow query threshold in seconds for the current app, if any."""
+    if not has_app_context():
+        return None
+    return current_app.config.get('SQL_SLOW_QUERY_THRESHOLD')
+
+
+def record_slow_query(conn, statement: str, parameters: Any, duration: float):
+    """Record `statement` in the slow query log, capturing its query plan."""
+    entry: Dict[str, Any] = {
+        'time': datetime.now(timezone.utc).isoformat(),
+        'duration_ms': round(duration * 1000., 3),
+        'statement': statement,
+        'parameters': parameter_shapes(parameters),
+        'endpoint': None,
+        'plan': None,
+    }
+    if has_request_context():
+        entry.update(endpoint=request.endpoint, method=request.method, path=request.path)
+
+    if conn.dialect.name == 'sqlite' and current_app.config.get('SQL_SLOW_QUERY_EXPLAIN', True):
+        try:
+            entry['plan'] = explain_query_plan(conn.connection, statement, parameters)
+        except Exception as err:  # pylint: disable=broad-except
+            entry['plan'] = [f'EXPLAIN QUERY PLAN failed: {err}']
+
+    SLOW_QUERIES.append(entry)
+    SLOW_QUERIES_TOTAL.inc(entry['endpoint'] or 'none')
+    _slow_query_logger.warning('{}', json.dumps(entry))
+
+
+def is_slow_query_record(record) -> bool:
+    """Return whether the loguru `record` is of a slow query."""
+    return record['extra'].get('slow_query', False)
+
+
+def init_slow_query_log(app: Flask):
+    """Configure the slow query log for `app`.
+
+    The following config keys are used:
+
+        - `SQL_SLOW_QUERY_THRESHOLD_MS`: statements taking at least this many
+          milliseconds are recorded, default is 100. Negative disables.
+        - `SQL_SLOW_QUERY_EXPLAIN`: capture ``EXPLAIN QUERY PLAN`` output
+          (SQLite only), default is True.
+        - `SQL_SLOW_QUERY_LOG`: the rotating log file slow queries are
+          written to as JSON lines (and not to `LOG_FILE`), default is
+          `slow_queries.log` in the directory of `LOG_FILE`. Empty disables.
+    """
+    threshold_ms = float(app.config.get('SQL_SLOW_QUERY_THRESHOLD_MS', 100))
+    app.config['SQL_SLOW_QUERY_THRESHOLD'] = threshold_ms / 1000. if threshold_ms >= 0 else None
+    app.config['SQL_SLOW_QUERY_EXPLAIN'] = config_flag(app.config, 'SQL_SLOW_QUERY_EXPLAIN', True)
+
+    logfile = app.config.get('SQL_SLOW_QUERY_LOG')
+    if logfile is None:
+        logfile = os.path.join(os.path.dirname(app.config.get('LOG_FILE') or ''), 'slow_queries.log')
+    if logfile:
+        add_file_sink(logfile, record_filter=is_slow_query_record, format='{message}',
+                      enqueue=config_flag(app.config, 'LOG_ENQUEUE',
+                                          default=app.config.get('FLASK_ENV') != 'development'),
+                      rotation='10MB', compression='zip')
@@ -0,0 +1,233 @@
+"""Provides per-request SQL statement counting, timing and N+1 detection.
+
+SQLAlchemy `before_cursor_execute`/`after_cursor_execute` events time every
+statement and record it into each active `QueryStats` collector for the
+current thread. A collector is activated for every request by
+`init_sql_profiler()` and by the `query_budget()` context manager, which is
+intended for use in tests:
+
+Examples
+--------
+.. code-block:: python
+
+    with query_budget(2):
+        response = client.get('/api/v1/store/items')
+
+"""
+import re
+import threading
+
+from collections import Counter
+from contextlib import contextmanager
+from time import perf_counter
+from typing import Dict, Iterator, List, Optional
+
+from flask import Flask, Response, current_app, g, request
+from loguru import logger
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from .config import config_flag
+from .metrics import REGISTRY, Counter as CounterMetric, Histogram
+from .slow_queries import record_slow_query, slow_query_threshold
+
+_local = threading.local()
+
+_WHITESPACE_RE = re.compile(r'\s+')
+_PLACEHOLDER_LIST_RE = re.compile(r'\(\s*\?(\s*,\s*\?)+\s*\)')
+
+DB_QUERIES_PER_REQUEST = REGISTRY.register(Histogram(
+    'db_queries_per_request', 'Number of SQL statements executed per request.',
+    ['endpoint'], buckets=(1, 2, 5, 10, 20, 50, 100, 500)))
+DB_TIME_PER_REQUEST = REGISTRY.register(Histogram(
+    'db_time_per_request_seconds', 'Time spent executing SQL statements per request.',
+    ['endpoint']))
+DB_N_PLUS_ONE = REGISTRY.register(CounterMetric(
+    'db_probable_n_plus_one_total',
+    'Number of requests repeating a statement shape at least N times.', ['endpoint']))
+
+
+def statement_shape(statement: str) -> str:
+    """Normalise `statement` so that repeated queries compare equal.
+
+    Whitespace is collapsed and expanded placeholder lists, e.g. from
+    ``IN (?, ?, ?)``, are reduced to a single ``(?)``.
+    """
+    return _PLACEHOLDER_LIST_RE.sub('(?)', _WHITESPACE_RE.sub(' ', statement).strip())
+
+
+class QueryStats:
+    """Collects the number, duration and shapes of executed SQL statements.
+
+    Attributes
+    ----------
+    count: int
+        The number of statements executed.
+    duration: float
+        The total time in seconds spent executing statements.
+    shapes: Counter
+        The number of times each statement shape was executed.
+    """
+
+    __slots__ = ('count', 'duration', 'shapes')
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.
+        self.shapes: Counter = Counter()
+
+    def record(self, statement: str, duration: float):
+        """Record the execution of `statement` taking `duration` seconds."""
+        self.count += 1
+        self.duration += duration
+        self.shapes[statement] += 1
+
+    def repeated(self, threshold: int) -> Dict[str, int]:
+        """Return normalised statement shapes executed at least `threshold` times."""
+        shapes: Counter = Counter()
+        for statement, count in self.shapes.items():
+            shapes[statement_shape(statement)] += count
+        return {shape: count for shape, count in shapes.most_common() if count >= threshold}
+
+    def __repr__(self) -> str:
+        return f'<QueryStats count={self.count} duration={self.duration * 1000.:.3f}ms>'
+
+
+def _active_collectors() -> List[QueryStats]:
+    collectors = getattr(_local, 'collectors', None)
+    if collectors is None:
+        collectors = _local.collectors = []
+    return collectors
+
+
+@contextmanager
+def collect_queries() -> Iterator[QueryStats]:
+    """Context manager collecting statistics of the SQL executed in this thread."""
+    stats = QueryStats()
+    collectors = _active_collectors()
+    collectors.append(stats)
+    try:
+        yield stats
+    finally:
+        collectors.remove(stats)
+
+
+class QueryBudgetExceeded(AssertionError):
+    """Raised when more SQL statements are executed than budgeted for."""
+
+
+@contextmanager
+def query_budget(max_queries: int, max_duration: Optional[float] = None) -> Iterator[QueryStats]:
+    """Assert that at most `max_queries` statements are executed within the block.
+
+    Parameters
+    ----------
+    max_queries: int
+        The maximum number of SQL statements that may be executed.
+    max_duration: Optional[float]
+        The maximum total time in seconds that statements may take.
+
+    Raises
+    ------
+    QueryBudgetExceeded
+        When either budget is exceeded, listing the statements executed.
+    """
+    with collect_queries() as stats:
+        yield stats
+    if stats.count > max_queries or (max_duration is not None and stats.duration > max_duration):
+        statements = '\n'.join(f'  {count}x {shape}' for shape, count in stats.repeated(1).items())
+        raise QueryBudgetExceeded(
+            f'{stats.count} queries taking {stats.duration * 1000.:.3f}ms executed, but '
+            f'budget is {max_queries} queries'
+            + (f' taking {max_duration * 1000.:.3f}ms' if max_duration is not None else '')
+            + f':\n{statements}')
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters,  # pylint: disable=unused-argument,too-many-arguments
+                           context, executemany):  # pylint: disable=unused-argument
+    conn.info.setdefault('query_start_time', []).append((context, perf_counter()))
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters,  # pylint: disable=unused-argument,too-many-arguments
+                          context, executemany):  # pylint: disable=unused-argument
+    _, start_time = conn.info['query_start_time'].pop()
+    duration = perf_counter() - start_time
+    for stats in getattr(_local, 'collectors', ()):
+        stats.record(statement, duration)
+    threshold = slow_query_threshold()
+    if threshold is not None and duration >= threshold:
+        record_slow_query(conn, statement, parameters, duration)
+
+
+def _handle_error(context):
+    # NOTE: after_cursor_execute isn't called for failed statements, so their
+    # start time must be discarded, else later statements of the (pooled)
+    # connection would be timed from the wrong start
+    if context.connection is not None:
+        start_times = context.connection.info.get('query_start_time')
+        if start_times and start_times[-1][0] is context.execution_context:
+            start_times.pop()
+
+
+def install_listeners():
+    """Listen for statement execution on all SQLAlchemy engines (idempotent)."""
+    if not event.contains(Engine, 'before_cursor_execute', _before_cursor_execute):
+        event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+        event.listen(Engine, 'handle_error', _handle_error)
+
+
+def _before_request():
+    stats = g.query_stats = QueryStats()
+    _active_collectors().append(stats)
+
+
+def _after_request(response: Response) -> Response:
+    stats: QueryStats = g.get('query_stats')
+    if stats is None:
+        return response
+    endpoint = request.endpoint or 'unmatched'
+    DB_QUERIES_PER_REQUEST.observe(stats.count, endpoint)
+    DB_TIME_PER_REQUEST.observe(stats.duration, endpoint)
+
+    repeated = stats.repeated(current_app.config['SQL_N_PLUS_ONE_THRESHOLD'])
+    if repeated:
+        DB_N_PLUS_ONE.inc(endpoint)
+        for shape, count in repeated.items():
+            logger.warning('Probable N+1 query in {} ({}x): {}', endpoint, count, shape)
+
+    if current_app.config['SQL_PROFILER_HEADERS']:
+        response.headers['X-DB-Query-Count'] = str(stats.count)
+        response.headers['X-DB-Time'] = f'{stats.duration * 1000.:.3f}'  # milliseconds
+        if repeated:
+            response.headers['X-DB-N-Plus-One'] = str(len(repeated))
+    return response
+
+
+def _teardown_request(exc: Optional[BaseException] = None):  # pylint: disable=unused-argument
+    stats = g.pop('query_stats', None)
+    collectors = getattr(_local, 'collectors', [])
+    if stats is not None and stats in collectors:
+        collectors.remove(stats)
+
+
+def init_sql_profiler(app: Flask):
+    """Count and time SQL statements for every request handled by `app`.
+
+    The following config keys are used:
+
+        - `SQL_PROFILER_HEADERS`: add `X-DB-Query-Count` and `X-DB-Time`
+          (in milliseconds) response headers, by default everywhere but
+          the production environment.
+        - `SQL_N_PLUS_ONE_THRESHOLD`: log a warning (and add an
+          `X-DB-N-Plus-One` header) when a statement shape is executed at
+          least this many times within one request, default is 5.
+    """
+    app.config['SQL_PROFILER_HEADERS'] = config_flag(
+        app.config, 'SQL_PROFILER_HEADERS', default=app.config.get('FLASK_ENV') != 'production')
+    app.config['SQL_N_PLUS_ONE_THRESHOLD'] = int(app.config.get('SQL_N_PLUS_ONE_THRESHOLD', 5))
+
+    install_listeners()
+    app.before_request(_before_request)
+    app.after_request(_after_request)
+    app.teardown_request(_teardown_request)
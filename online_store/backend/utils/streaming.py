@@ -0,0 +1,69 @@
+"""Provides encoders streaming rows as CSV or newline delimited JSON.
+
+Rows are encoded as they are yielded and sent in chunks of roughly
+`CHUNK_SIZE` bytes, so responses use constant memory however many rows there
+are, and clients can start processing before the response is complete.
+
+Examples
+--------
+.. code-block:: python
+
+    rows = ({'id': i} for i in range(3))
+    Response(stream_with_context(encode_rows(rows, 'ndjson', ['id'])),
+             mimetype=STREAM_MIMETYPES['ndjson'])
+
+"""
+import csv
+import io
+import json
+
+from typing import Any, Dict, Iterable, Iterator, List
+
+CHUNK_SIZE = 64 * 1024
+
+STREAM_MIMETYPES = {'csv': 'text/csv', 'ndjson': 'application/x-ndjson'}
+
+
+def _chunked(lines: Iterable[str]) -> Iterator[bytes]:
+    buffer: List[str] = []
+    size = 0
+    for line in lines:
+        buffer.append(line)
+        size += len(line)
+        if size >= CHUNK_SIZE:
+            yield ''.join(buffer).encode('utf8')
+            buffer, size = [], 0
+    if buffer:
+        yield ''.join(buffer).encode('utf8')
+
+
+def _csv_lines(rows: Iterable[Dict[str, Any]], columns: List[str]) -> Iterator[str]:
+    line = io.StringIO()
+    writer = csv.DictWriter(line, columns, extrasaction='ignore')
+    writer.writeheader()
+    for row in rows:
+        yield line.getvalue()
+        line.seek(0)
+        line.truncate()
+        writer.writerow(row)
+    yield line.getvalue()
+
+
+def _ndjson_lines(rows: Iterable[Dict[str, Any]]) -> Iterator[str]:
+    for row in rows:
+        yield json.dumps(row, separators=(',', ':')) + '\n'
+
+
+def encode_rows(rows: Iterable[Dict[str, Any]], fmt: str, columns: List[str]) -> Iterator[bytes]:
+    """Encode `rows` as `fmt` ('csv' or 'ndjson') in chunks.
+
+    Raises
+    ------
+    ValueError
+        If `fmt` is not a supported format.
+    """
+    if fmt == 'csv':
+        return _chunked(_csv_lines(rows, columns))
+    if fmt == 'ndjson':
+        return _chunked(_ndjson_lines(rows))
+    raise ValueError(f'unsupported format {fmt!r}, expected one of {", ".join(STREAM_MIMETYPES)}')
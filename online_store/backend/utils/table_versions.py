@@ -0,0 +1,86 @@
+"""Provides in-process version counters for database tables.
+
+The version of a table is bumped whenever a session commits changes to it,
+so that caches derived from a table can include its version in their keys
+and are implicitly invalidated by any committed write. Tables written to are
+collected from flushed ORM objects and bulk updates and deletes; writes made
+with raw SQL must call `bump_table_versions()` explicitly.
+
+Examples
+--------
+.. code-block:: python
+
+    key = (table_version('items'), normalized_args(request.args))
+    bump_table_versions('items')  # after committing raw SQL changes
+
+"""
+import threading
+
+from typing import Dict, Iterable, Set
+
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+
+_versions: Dict[str, int] = {}
+_lock = threading.Lock()
+_listeners_installed = False
+
+_PENDING_KEY = 'pending_table_versions'
+
+
+def table_version(table: str) -> int:
+    """Return the current version of `table`."""
+    return _versions.get(table, 0)
+
+
+def bump_table_versions(*tables: str):
+    """Increment the versions of `tables`."""
+    with _lock:
+        for table in tables:
+            _versions[table] = _versions.get(table, 0) + 1
+
+
+def _pending(session: Session) -> Set[str]:
+    return session.info.setdefault(_PENDING_KEY, set())
+
+
+def _tables_of(instances: Iterable) -> Set[str]:
+    tables = set()
+    for instance in instances:
+        for table in inspect(instance).mapper.tables:
+            tables.add(table.name)
+    return tables
+
+
+def _after_flush(session: Session, flush_context):  # pylint: disable=unused-argument
+    _pending(session).update(_tables_of(list(session.new) + list(session.dirty) +
+                                        list(session.deleted)))
+
+
+def _after_bulk(update_context):
+    _pending(update_context.session).update(
+        table.name for table in update_context.mapper.tables)
+
+
+def _after_commit(session: Session):
+    tables = session.info.pop(_PENDING_KEY, None)
+    if tables:
+        bump_table_versions(*tables)
+
+
+def _after_rollback(session: Session):
+    session.info.pop(_PENDING_KEY, None)
+
+
+def install_session_listeners():
+    """Track the tables written to by every session (only installed once)."""
+    global _listeners_installed  # pylint: disable=global-statement
+    with _lock:
+        if _listeners_installed:
+            return
+        event.listen(Session, 'after_flush', _after_flush)
+        event.listen(Session, 'after_bulk_update', _after_bulk)
+        event.listen(Session, 'after_bulk_delete', _after_bulk)
+        event.listen(Session, 'after_commit', _after_commit)
+        event.listen(Session, 'after_rollback', _after_rollback)
+        _listeners_installed = True
@@ -0,0 +1 @@
+"""Developer and operations tooling, exposed as `manage.py` commands."""
@@ -0,0 +1,278 @@
+"""Benchmarks API endpoints against a seeded database via the Flask test client.
+
+A temporary SQLite database is seeded with configurable volumes of items,
+users, gift lists, gifts and orders before each endpoint is requested
+repeatedly, recording its throughput and latency percentiles. Results can be
+saved as a JSON baseline and later runs compared against it, failing when an
+endpoint regresses by more than a threshold.
+
+Examples
+--------
+.. code-block:: bash
+
+    $ python manage.py benchmark --items 5000 --output benchmark.json
+    $ python manage.py benchmark --items 5000 --baseline benchmark.json --threshold 0.2
+
+"""
+import json
+import math
+import os
+import platform
+import random
+import tempfile
+
+from collections import namedtuple
+from datetime import datetime, timezone
+from time import perf_counter
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import click
+
+from .datagen import DatasetCounts, generate_data, password_for
+
+DEFAULT_THRESHOLD = 0.2
+
+DEFAULT_COUNTS = DatasetCounts(items=5000, users=500, lists=500, gifts_per_list=20, orders=2000)
+
+# the ids of the seeded rows that scenarios pick their requests from, where
+# `users` are the (username, id, password) of the users requests are
+# authenticated as and `gift_ids` maps each of their ids to their gifts
+SeededData = namedtuple('SeededData', ['item_ids', 'users', 'gift_ids'])
+
+# a scenario returns (method, path, test client kwargs) for a request
+Scenario = Callable[[random.Random, SeededData, int], Tuple[str, str, Dict[str, Any]]]
+
+
+def seed_database(counts: DatasetCounts = DEFAULT_COUNTS, seed: int = 0,
+                  active_users: int = 10) -> SeededData:
+    """Generate a dataset of `counts` rows in the database of the current app.
+
+    See `online_store.tools.datagen.generate_data()`. The gifts of the first
+    `active_users` users with gift lists, as whom requests are authenticated,
+    are given ample availability and every generated item ample stock, so that
+    repeated purchases and orders never run dry.
+    """
+    # pylint: disable=import-outside-toplevel
+    from ..backend.models.database import db
+    from ..backend.models.gift import GiftModel
+    from ..backend.models.item import ItemModel
+    from ..backend.models.user import UserModel
+
+    data = generate_data(db.session.connection(), counts, seed=seed)
+    active = dict(list(zip(data.list_ids, data.user_ids))[:active_users])
+
+    db.session.query(ItemModel) \
+              .filter(ItemModel.id >= data.item_ids.start) \
+              .update({'in_stock_quantity': 1000000}, synchronize_session=False)
+    gifts = GiftModel.query.filter(GiftModel.list_id.in_(active))
+    gifts.update({'available': 1000000}, synchronize_session=False)
+    gift_ids = {user_id: [] for user_id in active.values()}
+    for gift_id, list_id in gifts.with_entities(GiftModel.id, GiftModel.list_id) \
+                                 .order_by(GiftModel.id):
+        gift_ids[active[list_id]].append(gift_id)
+    usernames = dict(UserModel.query.filter(UserModel.id.in_(gift_ids))
+                                    .with_entities(UserModel.id, UserModel.username))
+    db.session.commit()
+
+    return SeededData(item_ids=list(data.item_ids),
+                      users=[(usernames[user_id], user_id, password_for(user_id))
+                             for user_id in gift_ids],
+                      gift_ids=gift_ids)
+
+
+def _user(rng: random.Random, data: SeededData, index: int) -> Tuple[str, int, str]:  # pylint: disable=unused-argument
+    return data.users[index % len(data.users)]
+
+
+SCENARIOS: Dict[str, Scenario] = {
+    'store.items': lambda rng, data, i: ('GET', '/api/v1/store/items', {}),
+    'store.item': lambda rng, data, i: (
+        'GET', f'/api/v1/store/items/id/{rng.choice(data.item_ids)}', {}),
+    'gifts.list': lambda rng, data, i: ('GET', '/api/v1/gifts/list', {}),
+    'gifts.report': lambda rng, data, i: ('GET', '/api/v1/gifts/list/report', {}),
+    'gifts.purchase': lambda rng, data, i: (
+        'POST', f'/api/v1/gifts/list/{rng.choice(data.gift_ids[_user(rng, data, i)[1]])}'
+                '/purchase', {}),
+    'auth.login': lambda rng, data, i: (
+        'POST', '/api/v1/auth/login',
+        {'json': {'username': _user(rng, data, i)[0], 'password': _user(rng, data, i)[2]}}),
+    'store.order': lambda rng, data, i: (
+        'POST', '/api/v1/store/order',
+        {'json': {'user': _user(rng, data, i)[1],
+                  'items': [{'item_id': rng.choice(data.item_ids), 'quantity': 1}]}}),
+}
+
+
+def percentile(values: Sequence[float], q: float) -> float:
+    """Return the `q`-th percentile (0-100) of sorted `values` by nearest rank."""
+    if not values:
+        return 0.
+    rank = max(math.ceil(q / 100. * len(values)) - 1, 0)
+    return values[min(rank, len(values) - 1)]
+
+
+def run_scenario(client, scenario: Scenario, data: SeededData, headers: Sequence[Dict[str, str]],
+                 iterations: int = 100, warmup: int = 5, seed: int = 0) -> Dict[str, float]:
+    """Time `iterations` requests of `scenario`, returning summary statistics.
+
+    Requests rotate through the authentication `headers` of each seeded user
+    in step with the user chosen by the scenario.
+    """
+    rng = random.Random(seed)
+    durations = []
+    errors = 0
+    for i in range(-warmup, iterations):
+        method, path, kwargs = scenario(rng, data, i)
+        kwargs.setdefault('headers', headers[i % len(headers)])
+        start = perf_counter()
+        response = client.open(path, method=method, **kwargs)
+        duration = perf_counter() - start
+        if i < 0:
+            continue  # warm up caches, lazy imports etc.
+        durations.append(duration)
+        errors += response.status_code >= 400
+
+    durations.sort()
+    total = sum(durations)
+    return {
+        'requests': iterations,
+        'errors': errors,
+        'throughput_rps': round(iterations / total, 3) if total else 0.,
+        'mean_ms': round(total / max(iterations, 1) * 1000., 3),
+        'p50_ms': round(percentile(durations, 50) * 1000., 3),
+        'p95_ms': round(percentile(durations, 95) * 1000., 3),
+        'p99_ms': round(percentile(durations, 99) * 1000., 3),
+    }
+
+
+def run_benchmarks(app, data: SeededData, scenarios: Optional[Iterable[str]] = None,
+                   iterations: int = 100, warmup: int = 5, seed: int = 0
+                   ) -> Dict[str, Dict[str, float]]:
+    """Run each of the named `scenarios` (default all) against `app`."""
+    from flask_jwt_extended import create_access_token  # pylint: disable=import-outside-toplevel
+    with app.app_context():
+        headers = [{'Authorization': f'Bearer {create_access_token(username)}'}
+                   for username, _, _ in data.users]
+    client = app.test_client()
+    return {name: run_scenario(client, SCENARIOS[name], data, headers,
+                               iterations=iterations, warmup=warmup, seed=seed)
+            for name in (scenarios or SCENARIOS)}
+
+
+def compare_results(results: Dict[str, Dict[str, float]],
+                    baseline: Dict[str, Dict[str, float]],
+                    threshold: float = DEFAULT_THRESHOLD) -> List[str]:
+    """Return descriptions of scenarios regressing by more than `threshold`.
+
+    A scenario regresses when its p95 latency increases, or its throughput
+    decreases, by more than the `threshold` fraction of the baseline, or when
+    it errors more often than the baseline.
+    """
+    regressions = []
+    for name, result in results.items():
+        before = baseline.get(name)
+        if before is None:
+            continue
+        if result['p95_ms'] > before['p95_ms'] * (1. + threshold):
+            regressions.append(f"{name}: p95 {result['p95_ms']:.3f}ms > "
+                               f"{before['p95_ms']:.3f}ms baseline")
+        if result['throughput_rps'] < before['throughput_rps'] * (1. - threshold):
+            regressions.append(f"{name}: {result['throughput_rps']:.1f} req/s < "
+                               f"{before['throughput_rps']:.1f} req/s baseline")
+        if result['errors'] > before.get('errors', 0):
+            regressions.append(f"{name}: {result['errors']} errors > "
+                               f"{before.get('errors', 0)} baseline")
+    return regressions
+
+
+def format_results(results: Dict[str, Dict[str, float]]) -> str:
+    """Format `results` as a human readable table."""
+    lines = [f'{"scenario":<16} {"requests":>8} {"errors":>6} {"req/s":>9} '
+             f'{"mean ms":>9} {"p50 ms":>9} {"p95 ms":>9} {"p99 ms":>9}']
+    for name, result in results.items():
+        lines.append(f'{name:<16} {result["requests"]:>8} {result["errors"]:>6} '
+                     f'{result["throughput_rps"]:>9.1f} {result["mean_ms"]:>9.3f} '
+                     f'{result["p50_ms"]:>9.3f} {result["p95_ms"]:>9.3f} '
+                     f'{result["p99_ms"]:>9.3f}')
+    return '\n'.join(lines)
+
+
+@click.command('benchmark')
+@click.option('--items', type=int, default=DEFAULT_COUNTS.items, show_default=True,
+              help='Number of store items to seed.')
+@click.option('--users', type=int, default=DEFAULT_COUNTS.users, show_default=True,
+              help='Number of users to seed.')
+@click.option('--lists', type=int, default=DEFAULT_COUNTS.lists, show_default=True,
+              help='Number of gift lists to seed (one per user).')
+@click.option('--gifts-per-list', type=int, default=DEFAULT_COUNTS.gifts_per_list,
+              show_default=True, help='Number of gifts to seed in each gift list.')
+@click.option('--orders', type=int, default=DEFAULT_COUNTS.orders, show_default=True,
+              help='Number of orders to seed.')
+@click.option('--iterations', '-n', type=int, default=100, show_default=True,
+              help='Number of timed requests per scenario.')
+@click.option('--warmup', type=int, default=5, show_default=True,
+              help='Number of untimed requests per scenario.')
+@click.option('--scenario', '-s', 'scenarios', multiple=True, type=click.Choice(list(SCENARIOS)),
+              help='Scenario(s) to run, default is all.')
+@click.option('--seed', type=int, default=0, show_default=True,
+              help='Random seed for the dataset and requests.')
+@click.option('--output', '-o', type=click.Path(dir_okay=False),
+              help='Write results to this JSON file, e.g. to use as a baseline.')
+@click.option('--baseline', '-b', type=click.Path(exists=True, dir_okay=False),
+              help='Compare results against this JSON baseline.')
+@click.option('--threshold', type=float, default=DEFAULT_THRESHOLD, show_default=True,
+              help='Fractional change from the baseline counted as a regression.')
+def benchmark_command(items: int, users: int, lists: int,  # pylint: disable=too-many-arguments,too-many-locals
+                      gifts_per_list: int, orders: int, iterations: int, warmup: int,
+                      scenarios: Tuple[str, ...], seed: int, output: Optional[str],
+                      baseline: Optional[str], threshold: float):
+    """Benchmark API endpoints against a seeded database."""
+    from ..app import create_app  # pylint: disable=import-outside-toplevel
+
+    counts = DatasetCounts(items, users, min(lists, users), gifts_per_list, orders)
+    db_fd, db_path = tempfile.mkstemp(suffix='.db')
+    try:
+        app = create_app(config={
+            'FLASK_ENV': 'production',
+            'SQLALCHEMY_DATABASE_URI': f'sqlite:///{db_path}',
+            'SQLALCHEMY_TRACK_MODIFICATIONS': False,
+        })
+        with app.app_context():
+            start = perf_counter()
+            data = seed_database(counts, seed=seed)
+            click.echo(f'Seeded {counts} in {perf_counter() - start:.1f}s')
+        if not data.users:
+            raise click.ClickException('at least one user must be seeded')
+
+        results = run_benchmarks(app, data, scenarios, iterations=iterations,
+                                 warmup=warmup, seed=seed)
+    finally:
+        os.close(db_fd)
+        os.unlink(db_path)
+
+    click.echo(format_results(results))
+
+    if output:
+        with open(output, 'w') as json_fp:
+            json.dump({
+                'created': datetime.now(timezone.utc).isoformat(),
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+                'seed': seed,
+                'counts': counts._asdict(),
+                'iterations': iterations,
+                'results': results,
+            }, json_fp, indent=2)
+        click.echo(f'Results written to {output}')
+
+    if baseline:
+        with open(baseline) as json_fp:
+            baseline_data = json.load(json_fp)
+        if baseline_data.get('counts') != counts._asdict():
+            click.echo(f'Warning: baseline was seeded with {baseline_data.get("counts")}',
+                       err=True)
+        regressions = compare_results(results, baseline_data.get('results', {}), threshold)
+        if regressions:
+            raise click.ClickException('performance regressed against baseline:\n  '
+                                       + '\n  '.join(regressions))
+        click.echo(f'No regressions against {baseline} (threshold {threshold:.0%})')
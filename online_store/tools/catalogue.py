@@ -0,0 +1,39 @@
+"""Exports the store catalogue to a memory-mapped snapshot file.
+
+The app serves items from the snapshot when `CATALOGUE_SNAPSHOT` is set and
+rebuilds it itself when stale, so exporting is only needed to prepare a
+snapshot in advance, e.g. when deploying many workers at once.
+
+Examples
+--------
+.. code-block:: bash
+
+    $ python manage.py export-catalogue --database sqlite:///large.db catalogue.bin
+    $ CATALOGUE_SNAPSHOT=catalogue.bin python manage.py run
+
+"""
+from time import perf_counter
+
+import click
+
+
+@click.command('export-catalogue')
+@click.argument('output', type=click.Path(dir_okay=False))
+@click.option('--database', '-d', required=True, envvar='SQLALCHEMY_DATABASE_URI',
+              help='Source database URI, e.g. sqlite:///large.db')
+def export_catalogue_command(output: str, database: str):
+    """Export the items table to a catalogue snapshot file."""
+    # pylint: disable=import-outside-toplevel
+    from sqlalchemy import create_engine
+    from ..backend.catalogue import write_snapshot
+
+    engine = create_engine(database)
+    start = perf_counter()
+    connection = engine.raw_connection()
+    try:
+        count, version = write_snapshot(connection, output)
+    finally:
+        connection.close()
+        engine.dispose()
+    click.echo(f'Exported {count} items (items version {version}) to {output} '
+               f'in {perf_counter() - start:.2f}s')
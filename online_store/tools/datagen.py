@@ -0,0 +1,302 @@
+"""Generates large, realistic and deterministic datasets for scale testing.
+
+Items, users, gift lists, gifts and orders are bulk inserted with
+SQLAlchemy Core ``executemany()`` in chunks. The popularity of items within
+gift lists and orders, and of users placing orders, follows a Zipf
+distribution so that hot rows look like production. The same `seed` (and
+starting database) always generates identical data, so benchmarks and
+capacity tests can share fixtures.
+
+Examples
+--------
+.. code-block:: bash
+
+    $ python manage.py generate-data --database sqlite:///large.db --items 1000000
+
+"""
+import random
+
+from collections import namedtuple
+from datetime import datetime, timedelta
+from itertools import islice
+from time import perf_counter
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence
+
+import click
+
+INSERT_CHUNK_SIZE = 10000
+PASSWORD_POOL_SIZE = 8
+DEFAULT_ZIPF_EXPONENT = 1.1
+
+DatasetCounts = namedtuple('DatasetCounts',
+                           ['items', 'users', 'lists', 'gifts_per_list', 'orders'])
+DatasetCounts.__new__.__defaults__ = (100000, 10000, 5000, 20, 50000)
+
+# the id ranges of the generated rows
+GeneratedData = namedtuple('GeneratedData', ['item_ids', 'user_ids', 'list_ids', 'order_ids'])
+
+FIRST_NAMES = ('Alice', 'Ben', 'Chloe', 'Daniel', 'Emma', 'Felix', 'Grace', 'Harry',
+               'Isla', 'Jack', 'Katie', 'Liam', 'Mia', 'Noah', 'Olivia', 'Priya',
+               'Quinn', 'Ruby', 'Sam', 'Theo', 'Uma', 'Victor', 'Wendy', 'Zara')
+LAST_NAMES = ('Smith', 'Jones', 'Taylor', 'Brown', 'Williams', 'Wilson', 'Johnson',
+              'Davies', 'Patel', 'Wright', 'Walker', 'Khan', 'Evans', 'Roberts',
+              'Green', 'Hall', 'Wood', 'Clarke', 'Hughes', 'Edwards')
+STREETS = ('High Street', 'Station Road', 'Church Lane', 'Park Avenue', 'Victoria Road',
+           'Green Lane', 'Manor Road', 'Mill Lane', 'Kings Road', 'Queens Road')
+TOWNS = ('London', 'Manchester', 'Birmingham', 'Leeds', 'Bristol', 'Edinburgh',
+         'Cardiff', 'Belfast', 'Oxford', 'Cambridge', 'York', 'Brighton')
+ADJECTIVES = ('Classic', 'Deluxe', 'Vintage', 'Modern', 'Rustic', 'Copper', 'Ceramic',
+              'Stainless', 'Oak', 'Glass', 'Linen', 'Velvet', 'Marble', 'Bamboo')
+PRODUCTS = ('Tea Pot', 'Cafetiere', 'Dinner Set', 'Wine Glasses', 'Toaster', 'Kettle',
+            'Bath Towels', 'Duvet Cover', 'Cutlery Set', 'Casserole Dish', 'Photo Frame',
+            'Candle Holder', 'Blender', 'Stand Mixer', 'Chopping Board', 'Vase')
+BRANDS = ('BRABANTIA', 'LE CREUSET', 'SMEG', 'KITCHENAID', 'DENBY', 'JOSEPH JOSEPH',
+          'ROBERT WELCH', 'DUALIT', 'LSA', 'PORTMEIRION', 'ANTHROPOLOGIE', 'HABITAT')
+CURRENCIES = ('GBP', 'EUR', 'USD')
+CURRENCY_WEIGHTS = (0.8, 0.1, 0.1)
+
+
+def chunked(iterable: Iterable[Any], size: int = INSERT_CHUNK_SIZE) -> Iterator[List[Any]]:
+    """Yield lists of at most `size` consecutive elements from `iterable`."""
+    iterator = iter(iterable)
+    chunk = list(islice(iterator, size))
+    while chunk:
+        yield chunk
+        chunk = list(islice(iterator, size))
+
+
+def password_for(user_id: int) -> str:
+    """Return the plain text password of the generated user with `user_id`.
+
+    Hashing is deliberately slow, so users share a small pool of precomputed
+    password hashes rather than hashing each of (potentially) millions.
+    """
+    return f'password{user_id % PASSWORD_POOL_SIZE}'
+
+
+def password_hashes(rng: random.Random) -> List[str]:
+    """Return the pool of password hashes, salted deterministically by `rng`.
+
+    These use the same scheme as `UserModel.generate_hash()`.
+    """
+    from passlib.hash import pbkdf2_sha256  # pylint: disable=import-outside-toplevel
+    return [pbkdf2_sha256.using(salt=bytes(rng.getrandbits(8) for _ in range(16)))
+                         .hash(password_for(i))
+            for i in range(PASSWORD_POOL_SIZE)]
+
+
+class ZipfSampler:
+    """Samples from `population` where the element of rank k has weight 1/k^s.
+
+    Cumulative weights are computed once so that each sample is a bisection.
+    """
+
+    def __init__(self, population: Sequence[Any], exponent: float = DEFAULT_ZIPF_EXPONENT,
+                 rng: Optional[random.Random] = None):
+        self.population = population
+        self._rng = rng or random.Random()
+        total = 0.
+        self.cum_weights = []
+        for rank in range(1, len(population) + 1):
+            total += rank ** -exponent
+            self.cum_weights.append(total)
+
+    def sample(self, k: int = 1) -> List[Any]:
+        """Return `k` elements sampled with replacement."""
+        return self._rng.choices(self.population, cum_weights=self.cum_weights, k=k)
+
+
+def _next_id(conn, table) -> int:
+    from sqlalchemy import func, select  # pylint: disable=import-outside-toplevel
+    return (conn.execute(select([func.max(table.c.id)])).scalar() or 0) + 1
+
+
+def _insert(conn, table, rows: Iterable[Dict[str, Any]], chunk_size: int) -> int:
+    count = 0
+    for chunk in chunked(rows, chunk_size):
+        conn.execute(table.insert(), chunk)
+        count += len(chunk)
+    return count
+
+
+def _items(rng: random.Random, item_ids: Iterable[int]) -> Iterator[Dict[str, Any]]:
+    for item_id in item_ids:
+        yield {
+            'id': item_id,
+            'name': f'{rng.choice(ADJECTIVES)} {rng.choice(PRODUCTS)} {item_id}',
+            'brand': rng.choice(BRANDS),
+            'price': round(min(rng.lognormvariate(3.5, 1.), 5000.), 2),
+            'currency': rng.choices(CURRENCIES, CURRENCY_WEIGHTS)[0],
+            'in_stock_quantity': rng.randint(0, 500),
+        }
+
+
+def _users(rng: random.Random, user_ids: Iterable[int],
+           hashes: Sequence[str]) -> Iterator[Dict[str, Any]]:
+    for user_id in user_ids:
+        first, last = rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)
+        username = f'{first}.{last}{user_id}'.lower()
+        yield {
+            'id': user_id,
+            'username': username,
+            'email': f'{username}@example.com',
+            'password': hashes[user_id % len(hashes)],
+            'phone_number': f'07{rng.randrange(10 ** 9):09d}',
+            'address': f'{rng.randint(1, 200)} {rng.choice(STREETS)}, {rng.choice(TOWNS)}',
+        }
+
+
+def _gifts(rng: random.Random, items: ZipfSampler, list_ids: Iterable[int],
+           first_id: int, gifts_per_list: int) -> Iterator[Dict[str, Any]]:
+    gift_id = first_id
+    for list_id in list_ids:
+        size = rng.randint(1, 2 * gifts_per_list - 1) if gifts_per_list > 0 else 0
+        for item_id in sorted(set(items.sample(size))):
+            desired = rng.randint(1, 5)
+            purchased = rng.randint(0, desired)
+            yield {'id': gift_id, 'item_id': item_id, 'list_id': list_id,
+                   'available': desired - purchased, 'purchased': purchased}
+            gift_id += 1
+
+
+def _orders(rng: random.Random, users: ZipfSampler,
+            order_ids: Iterable[int]) -> Iterator[Dict[str, Any]]:
+    from ..backend.models.order import OrderStatus  # pylint: disable=import-outside-toplevel
+    statuses = [int(status) for status in OrderStatus if status is not OrderStatus.INVALID]
+    epoch = datetime(2020, 1, 1)
+    for order_id in order_ids:
+        created = epoch + timedelta(seconds=rng.randrange(365 * 24 * 3600))
+        yield {'id': order_id, 'user': users.sample()[0], 'created': created,
+               'last_updated': created + timedelta(seconds=rng.randrange(7 * 24 * 3600)),
+               'status': rng.choices(statuses, (10, 20, 10, 50, 5, 5))[0]}
+
+
+def _order_items(rng: random.Random, items: ZipfSampler,
+                 order_ids: Iterable[int]) -> Iterator[Dict[str, Any]]:
+    for order_id in order_ids:
+        for item_id in sorted(set(items.sample(rng.choice((1, 1, 1, 2, 2, 3, 4))))):
+            yield {'order_id': order_id, 'item': item_id, 'quantity': rng.randint(1, 3)}
+
+
+def generate_data(conn, counts: DatasetCounts = DatasetCounts(), seed: int = 0,  # pylint: disable=too-many-locals
+                  exponent: float = DEFAULT_ZIPF_EXPONENT,
+                  chunk_size: int = INSERT_CHUNK_SIZE,
+                  echo=None) -> GeneratedData:
+    """Bulk insert a generated dataset of `counts` rows using `conn`.
+
+    Parameters
+    ----------
+    conn: sqlalchemy.engine.Connection
+        The connection to insert rows with. Rows are committed unless `conn`
+        is already within a transaction, which is left to the caller.
+    counts: DatasetCounts
+        The number of items, users, gift lists (one per user), mean gifts per
+        list and orders to generate.
+    seed: int
+        The random seed, identical seeds generate identical data.
+    exponent: float
+        The Zipf exponent for item and user popularity.
+    chunk_size: int
+        The number of rows inserted per ``executemany()``.
+    echo: Optional[Callable[[str], None]]
+        Called with progress messages.
+
+    Returns
+    -------
+    GeneratedData
+        The ranges of the generated item, user, gift list and order ids.
+        Ids follow on from any existing rows.
+    """
+    # pylint: disable=import-outside-toplevel
+    from ..backend.models.gift import GiftListModel, GiftModel
+    from ..backend.models.item import ItemModel
+    from ..backend.models.order import OrderItemModel, OrderModel
+    from ..backend.models.user import UserModel
+
+    echo = echo or (lambda message: None)
+    rng = random.Random(seed)
+    transaction = None if conn.in_transaction() else conn.begin()
+
+    def insert(model, rows):
+        start = perf_counter()
+        count = _insert(conn, model.__table__, rows, chunk_size)
+        echo(f'Inserted {count} {model.__tablename__} in {perf_counter() - start:.1f}s')
+
+    first = _next_id(conn, ItemModel.__table__)
+    item_ids = range(first, first + counts.items)
+    insert(ItemModel, _items(rng, item_ids))
+
+    hashes = password_hashes(rng)
+    first = _next_id(conn, UserModel.__table__)
+    user_ids = range(first, first + counts.users)
+    insert(UserModel, _users(rng, user_ids, hashes))
+
+    first = _next_id(conn, GiftListModel.__table__)
+    list_ids = range(first, first + min(counts.lists, counts.users))
+    insert(GiftListModel, ({'id': list_id, 'user_id': user_id}
+                           for list_id, user_id in zip(list_ids, user_ids)))
+
+    # shuffle so that popularity is independent of id
+    popular_items = list(item_ids)
+    rng.shuffle(popular_items)
+    items = ZipfSampler(popular_items, exponent, rng)
+    insert(GiftModel, _gifts(rng, items, list_ids, _next_id(conn, GiftModel.__table__),
+                             counts.gifts_per_list) if item_ids else ())
+
+    first = _next_id(conn, OrderModel.__table__)
+    order_ids = range(first, first + counts.orders) if user_ids else range(0)
+    popular_users = list(user_ids)
+    rng.shuffle(popular_users)
+    insert(OrderModel, _orders(rng, ZipfSampler(popular_users, exponent, rng), order_ids))
+    insert(OrderItemModel, _order_items(rng, items, order_ids) if item_ids else ())
+
+    if transaction is not None:
+        transaction.commit()
+    return GeneratedData(item_ids=item_ids, user_ids=user_ids,
+                         list_ids=list_ids, order_ids=order_ids)
+
+
+@click.command('generate-data')
+@click.option('--database', '-d', required=True, envvar='SQLALCHEMY_DATABASE_URI',
+              help='Target database URI, e.g. sqlite:///large.db')
+@click.option('--items', type=int, default=DatasetCounts().items, show_default=True,
+              help='Number of store items.')
+@click.option('--users', type=int, default=DatasetCounts().users, show_default=True,
+              help='Number of users.')
+@click.option('--lists', type=int, default=DatasetCounts().lists, show_default=True,
+              help='Number of gift lists (at most one per user).')
+@click.option('--gifts-per-list', type=int, default=DatasetCounts().gifts_per_list,
+              show_default=True, help='Mean number of gifts per gift list.')
+@click.option('--orders', type=int, default=DatasetCounts().orders, show_default=True,
+              help='Number of orders.')
+@click.option('--seed', type=int, default=0, show_default=True,
+              help='Random seed, identical seeds generate identical data.')
+@click.option('--zipf', 'exponent', type=float, default=DEFAULT_ZIPF_EXPONENT,
+              show_default=True, help='Zipf exponent of item and user popularity.')
+@click.option('--chunk-size', type=int, default=INSERT_CHUNK_SIZE, show_default=True,
+              help='Number of rows per bulk insert.')
+def generate_data_command(database: str, items: int, users: int, lists: int,  # pylint: disable=too-many-arguments
+                          gifts_per_list: int, orders: int, seed: int,
+                          exponent: float, chunk_size: int):
+    """Bulk insert a large, deterministic synthetic dataset into a database."""
+    # pylint: disable=import-outside-toplevel
+    from sqlalchemy import create_engine
+    from ..backend.models.database import db
+    from ..backend.models import gift, item, order, user  # noqa: F401 pylint: disable=unused-import
+
+    engine = create_engine(database)
+    db.Model.metadata.create_all(bind=engine)
+    start = perf_counter()
+    with engine.connect() as conn:
+        if engine.dialect.name == 'sqlite':
+            # the data is disposable until committed, so trade durability for speed
+            conn.execute('PRAGMA synchronous = OFF')
+            conn.execute('PRAGMA journal_mode = MEMORY')
+        data = generate_data(conn, DatasetCounts(items, users, lists, gifts_per_list, orders),
+                             seed=seed, exponent=exponent, chunk_size=chunk_size,
+                             echo=click.echo)
+    engine.dispose()
+    click.echo(f'Generated {len(data.item_ids)} items, {len(data.user_ids)} users, '
+               f'{len(data.list_ids)} gift lists and {len(data.order_ids)} orders '
+               f'in {perf_counter() - start:.1f}s (passwords are password0-'
+               f'password{PASSWORD_POOL_SIZE - 1}, by user id modulo {PASSWORD_POOL_SIZE})')
@@ -0,0 +1,238 @@
+"""Micro-benchmarks the in-memory gift list engines with a large number of gifts.
+
+Each engine adds `--gifts` distinct items to a new gift list, purchases one
+of each, creates a report and finally removes every gift, recording the
+throughput of each operation and the memory allocated per gift.
+
+With `--threads`, the `concurrent` engine is also benchmarked with several
+threads purchasing every gift until sold out, using striped locks and a
+single global lock, as is the `journal` engine (which fsyncs the purchases
+of concurrent threads together), verifying that no gift was oversold.
+
+The `journal` engine writes to a temporary directory, so is as durable as
+the filesystem of `$TMPDIR`, whilst the `shared` engine is benchmarked from a
+single process.
+
+Examples
+--------
+.. code-block:: bash
+
+    $ python manage.py giftbench --gifts 100000 --threads 8
+
+"""
+import io
+import os
+import random
+import tempfile
+import threading
+import tracemalloc
+
+from contextlib import contextmanager, redirect_stdout
+from time import perf_counter
+from typing import TYPE_CHECKING, Any, Callable, Dict, Iterator, List
+
+import click
+
+if TYPE_CHECKING:  # pragma: no cover
+    from ..backend.gift_list import ConcurrentGiftList
+
+# NOTE: the gift lists (and so the ORM models) are imported by the functions
+# below, so that `manage.py` stays cheap to start, see `.importtime`
+
+ENGINES = ('basic', 'columnar', 'concurrent', 'journal', 'shared')
+OPERATIONS = ('add', 'purchase', 'report', 'remove')
+MEMORY_GIFTS = 10000
+
+
+def _concurrent_gift_list(stripes: int) -> 'ConcurrentGiftList':
+    from ..backend.gift_list import ConcurrentGiftList  # pylint: disable=import-outside-toplevel
+    return ConcurrentGiftList('bench', stripes=stripes)
+
+
+def _journaled_gift_list(directory: str) -> 'ConcurrentGiftList':
+    from ..backend.gift_journal import JournaledGiftList  # pylint: disable=import-outside-toplevel
+    return JournaledGiftList('bench', directory=directory, snapshot_every=10 ** 9)
+
+
+# create the thread-safe gift list of each locking strategy in a directory
+LOCKING: Dict[str, Callable[[str], 'ConcurrentGiftList']] = {
+    'striped': lambda directory: _concurrent_gift_list(stripes=64),
+    'global': lambda directory: _concurrent_gift_list(stripes=1),
+    'journal': _journaled_gift_list,
+}
+
+
+def bench_items(gifts: int) -> List[Dict[str, Any]]:
+    """Return `gifts` distinct items, shaped like those of the store."""
+    return [{'id': item_id, 'name': f'Gift {item_id}', 'brand': 'Bench', 'price': 1.0,
+             'currency': 'GBP', 'in_stock_quantity': 10} for item_id in range(1, gifts + 1)]
+
+
+@contextmanager
+def _gift_list(engine: str, gifts: int) -> Iterator[Any]:
+    """Create an empty `engine` gift list for `gifts` gifts, in a temporary directory."""
+    # pylint: disable=import-outside-toplevel
+    from ..backend.gift_journal import JournaledGiftList
+    from ..backend.gift_list import GiftListFactory
+    from ..backend.shared_gifts import SharedMemoryGiftList
+    with tempfile.TemporaryDirectory() as directory:
+        if engine == 'journal':
+            gift_list = JournaledGiftList('bench', directory=directory, snapshot_every=10 ** 9)
+        elif engine == 'shared':
+            gift_list = SharedMemoryGiftList('bench', name=f'gifts_bench_{os.getpid()}',
+                                             capacity=2 * gifts)
+        else:
+            gift_list = GiftListFactory.CLASSES[engine]('bench')
+        try:
+            yield gift_list
+        finally:
+            if isinstance(gift_list, (JournaledGiftList, SharedMemoryGiftList)):
+                gift_list.close()
+            if isinstance(gift_list, SharedMemoryGiftList):
+                gift_list.unlink()
+
+
+def run_giftbench(engine: str, gifts: int = 100000) -> Dict[str, float]:
+    """Time each operation of the `engine` gift list with `gifts` gifts.
+
+    Returns
+    -------
+    Dict[str, float]
+        The elapsed seconds of each of `OPERATIONS` and the number of bytes
+        retained per gift by adding them, including any items kept by the
+        gift list, which is measured separately with at most `MEMORY_GIFTS`
+        gifts, as tracing allocations is slow.
+    """
+    items = bench_items(gifts)
+    result: Dict[str, float] = {}
+    with _gift_list(engine, gifts) as gift_list:
+        count = min(gifts, MEMORY_GIFTS)
+        tracemalloc.start()
+        try:
+            # NOTE: the items are created whilst tracing, and only the gift list
+            # keeps references to them, so that the memory of any items kept is
+            # counted, as it would be for items loaded from the store
+            for item in bench_items(count):
+                gift_list.add_item(item, 2)
+            result['bytes_per_gift'] = tracemalloc.get_traced_memory()[0] / max(count, 1)
+        finally:
+            tracemalloc.stop()
+
+    with _gift_list(engine, gifts) as gift_list:
+        start = perf_counter()
+        for item in items:
+            gift_list.add_item(item, 2)
+        result['add'] = perf_counter() - start
+
+        start = perf_counter()
+        for item in items:
+            gift_list.purchase_item(item, 1)
+        result['purchase'] = perf_counter() - start
+
+        with redirect_stdout(io.StringIO()):
+            start = perf_counter()
+            gift_list.create_report()
+            result['report'] = perf_counter() - start
+
+        start = perf_counter()
+        for item in items:
+            gift_list.remove_item(item)
+        result['remove'] = perf_counter() - start
+    return result
+
+
+def run_contention(locking: str, threads: int = 8, gifts: int = 1000,
+                   quantity: int = 10) -> Dict[str, float]:
+    """Purchase every unit of `gifts` gifts from `threads` threads at once.
+
+    The gift list is created by the `locking` strategy of `LOCKING`.
+
+    Each thread attempts to purchase one unit at a time of every gift
+    `quantity` times, in its own random order, so that each gift is
+    oversubscribed `threads` times.
+
+    Returns
+    -------
+    Dict[str, float]
+        The number of purchases attempted and sold, the number of units
+        oversold (which must be zero), the elapsed time and the throughput.
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        gift_list = LOCKING[locking](directory)
+        try:
+            return _run_purchases(gift_list, bench_items(gifts), threads, quantity)
+        finally:
+            if locking == 'journal':
+                gift_list.close()
+
+
+def _run_purchases(gift_list: 'ConcurrentGiftList', items: List[Dict[str, Any]],
+                   threads: int, quantity: int) -> Dict[str, float]:
+    for item in items:
+        gift_list.add_item(item, quantity)
+    sold: List[int] = []
+    barrier = threading.Barrier(threads + 1)
+
+    def worker(seed: int):
+        order = items * quantity
+        random.Random(seed).shuffle(order)
+        count = 0
+        barrier.wait()
+        for item in order:
+            try:
+                gift_list.purchase_item(item)
+            except ValueError:
+                continue
+            count += 1
+        sold.append(count)
+
+    workers = [threading.Thread(target=worker, args=(seed,)) for seed in range(threads)]
+    for thread in workers:
+        thread.start()
+    barrier.wait()
+    start = perf_counter()
+    for thread in workers:
+        thread.join()
+    elapsed = perf_counter() - start
+
+    attempts = threads * len(items) * quantity
+    oversold = sum(max(purchased - quantity, 0) + max(-available, 0)
+                   for available, purchased in map(gift_list.get_quantities, items))
+    return {'attempts': attempts, 'sold': sum(sold), 'oversold': oversold,
+            'elapsed': elapsed, 'throughput_ops': attempts / elapsed if elapsed else 0.}
+
+
+@click.command('giftbench')
+@click.option('--gifts', '-n', type=int, default=100000, show_default=True,
+              help='Number of distinct gifts in the list.')
+@click.option('--engine', '-e', 'engines', multiple=True, type=click.Choice(ENGINES),
+              help='Gift list engine to benchmark (repeatable), default is all.')
+@click.option('--threads', '-t', type=int, default=0, show_default=True,
+              help='Number of concurrent buyers of the lock comparison, zero skips it.')
+def giftbench_command(gifts: int, engines: List[str], threads: int):
+    """Benchmark the in-memory gift list engines."""
+    click.echo(f'Benchmarking {gifts} gifts\n')
+    click.echo(f'{"engine":<12}' + ''.join(f'{operation + " ops/s":>16}' for operation in OPERATIONS)
+               + f'{"bytes/gift":>12}')
+    for engine in engines or ENGINES:
+        result = run_giftbench(engine, gifts)
+        # the report is a single operation, so is reported as gifts per second
+        click.echo(f'{engine:<12}'
+                   + ''.join(f'{gifts / result[op] if result[op] else 0.:>16.0f}'
+                             for op in OPERATIONS)
+                   + f'{result["bytes_per_gift"]:>12.0f}')
+    if threads < 1:
+        return
+
+    contended, quantity = min(gifts, 10000), 10
+    click.echo(f'\nPurchasing {contended} gifts from {threads} threads\n')
+    click.echo(f'{"locking":<12} {"attempts":>10} {"sold":>10} {"oversold":>10} {"ops/s":>10}')
+    failed = []
+    for locking in LOCKING:
+        result = run_contention(locking, threads=threads, gifts=contended, quantity=quantity)
+        click.echo(f'{locking:<12} {result["attempts"]:>10} {result["sold"]:>10} '
+                   f'{result["oversold"]:>10} {result["throughput_ops"]:>10.0f}')
+        if result['oversold'] or result['sold'] != contended * quantity:
+            failed.append(locking)
+    if failed:
+        raise click.ClickException(f'gifts oversold or lost by: {", ".join(failed)}')
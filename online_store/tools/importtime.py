@@ -0,0 +1,96 @@
+"""Profiles module import time using the interpreter's `-X importtime` option.
+
+Examples
+--------
+.. code-block:: bash
+
+    $ python manage.py import-time --module online_store.app --budget-ms 250
+
+"""
+import os
+import subprocess  # nosec
+import sys
+
+from collections import namedtuple
+from typing import Iterable, List, Optional
+
+import click
+
+DEFAULT_MODULE = 'online_store.app'
+DEFAULT_BUDGET_MS = 500.0
+
+ImportTiming = namedtuple('ImportTiming', ['module', 'self_us', 'cumulative_us', 'depth'])
+
+
+def parse_importtime(output: str) -> List[ImportTiming]:
+    """Parse the stderr output of `python -X importtime`.
+
+    Each line is of the form::
+
+        import time: self [us] | cumulative | imported package
+
+    where nested imports are indented by two spaces per level.
+    """
+    timings = []
+    for line in output.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        try:
+            self_us, cumulative_us, name = line[len('import time:'):].split('|')
+            timing = ImportTiming(module=name.strip(),
+                                  self_us=int(self_us),
+                                  cumulative_us=int(cumulative_us),
+                                  depth=(len(name) - len(name.lstrip()) - 1) // 2)
+        except ValueError:
+            continue  # header line, i.e. "self [us] | cumulative | ..."
+        timings.append(timing)
+    return timings
+
+
+def profile_import(module: str = DEFAULT_MODULE,
+                   python: Optional[str] = None) -> List[ImportTiming]:
+    """Import `module` in a fresh interpreter and return its import timings."""
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(
+        filter(None, [os.getcwd(), os.environ.get('PYTHONPATH')])))
+    proc = subprocess.run([python or sys.executable, '-X', 'importtime',  # nosec
+                           '-c', f'import {module}'],
+                          stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                          universal_newlines=True, env=env, check=False)
+    if proc.returncode != 0:
+        raise RuntimeError(f'Unable to import {module}: {proc.stderr.strip()[-500:]}')
+    return parse_importtime(proc.stderr)
+
+
+def total_import_time(timings: Iterable[ImportTiming], module: str) -> int:
+    """Return the cumulative import time of `module` in microseconds."""
+    return max((timing.cumulative_us for timing in timings
+                if timing.module == module), default=0)
+
+
+@click.command('import-time')
+@click.option('--module', '-m', default=DEFAULT_MODULE, show_default=True,
+              help='Module to profile.')
+@click.option('--budget-ms', type=float, envvar='IMPORT_TIME_BUDGET_MS',
+              default=DEFAULT_BUDGET_MS, show_default=True,
+              help='Fail when cumulative import time exceeds this budget.')
+@click.option('--top', type=int, default=15, show_default=True,
+              help='Number of slowest imports to display.')
+@click.option('--repeat', type=int, default=3, show_default=True,
+              help='Number of runs, the fastest of which is reported.')
+def import_time_command(module: str, budget_ms: float, top: int, repeat: int):
+    """Report `-X importtime` totals for a module and enforce a budget."""
+    runs = [profile_import(module) for _ in range(max(repeat, 1))]
+    timings = min(runs, key=lambda run: total_import_time(run, module))
+    total_ms = total_import_time(timings, module) / 1000.
+
+    click.echo(f'{"self [ms]":>10} | {"cumulative [ms]":>15} | module')
+    for timing in sorted(timings, key=lambda t: t.cumulative_us, reverse=True)[:top]:
+        click.echo(f'{timing.self_us / 1000.:10.1f} | '
+                   f'{timing.cumulative_us / 1000.:15.1f} | '
+                   f'{"  " * timing.depth}{timing.module}')
+    click.echo(f'\n{module}: {total_ms:.1f} ms over {len(timings)} imports '
+               f'(budget: {budget_ms:.1f} ms)')
+
+    if total_ms > budget_ms:
+        raise click.ClickException(f'import time of {module} ({total_ms:.1f} ms) '
+                                   f'exceeds budget of {budget_ms:.1f} ms')
@@ -0,0 +1,353 @@
+"""Generates wedding-day load against a running server with concurrent virtual users.
+
+Every virtual user logs in with the couple's credentials and then repeatedly
+picks a scenario from a weighted mix:
+
+    - `browse`: view the couple's gift list.
+    - `login`: log in again.
+    - `purchase`: purchase one of the few most wanted ("hot") gifts.
+    - `report`: view the purchased/available report.
+
+Throughput, latency percentiles and a breakdown of errors are reported per
+scenario. Finally the gifts and items purchased from are reconciled against
+the purchases acknowledged to the virtual users, so that oversold gifts, lost
+updates and stock not matching the purchases are detected.
+
+Examples
+--------
+.. code-block:: bash
+
+    $ python manage.py run --with-threads &
+    $ python manage.py loadtest --url http://127.0.0.1:5000 --users 50 --duration 30 \\
+          --username couple --password secret --mix browse=40,purchase=50,report=10
+
+"""
+import json
+import random
+import threading
+
+from collections import Counter, defaultdict
+from time import perf_counter
+from typing import Any, Dict, List, Mapping, Optional, Sequence, Tuple
+from urllib.error import HTTPError, URLError
+from urllib.request import Request, urlopen
+
+import click
+
+from .benchmark import percentile
+
+DEFAULT_MIX = 'browse=40,login=5,purchase=45,report=10'
+SCENARIOS = ('browse', 'login', 'purchase', 'report')
+
+
+def parse_mix(mix: str) -> Dict[str, int]:
+    """Parse a scenario mix of the form 'browse=40,purchase=60' into weights."""
+    weights = {}
+    for pair in mix.split(','):
+        name, _, weight = pair.partition('=')
+        name = name.strip()
+        if not name:
+            continue
+        if name not in SCENARIOS:
+            raise ValueError(f'unknown scenario {name!r}, expected one of {SCENARIOS}')
+        weights[name] = int(weight or 1)
+    if not any(weights.values()):
+        raise ValueError(f'scenario mix {mix!r} has no weight')
+    return weights
+
+
+class ApiClient:
+    """A minimal JSON client for the store API."""
+
+    def __init__(self, base_url: str, timeout: float = 10.):
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        self.token: Optional[str] = None
+
+    def request(self, method: str, path: str, data: Any = None) -> Tuple[int, Any]:
+        """Return the status code and decoded JSON body (if any) of a request.
+
+        HTTP errors are returned rather than raised, other errors (e.g.
+        connection refused) are raised.
+        """
+        headers = {'Content-Type': 'application/json'}
+        if self.token:
+            headers['Authorization'] = f'Bearer {self.token}'
+        body = json.dumps(data).encode('utf8') if data is not None else None
+        request = Request(self.base_url + path, data=body, headers=headers, method=method)
+        try:
+            with urlopen(request, timeout=self.timeout) as response:  # nosec
+                status, content = response.status, response.read()
+        except HTTPError as err:
+            status, content = err.code, err.read()
+        try:
+            return status, json.loads(content.decode('utf8')) if content else None
+        except ValueError:
+            return status, None
+
+    def login(self, username: str, password: str) -> Tuple[int, Any]:
+        """Log in, keeping the access token for later requests."""
+        status, body = self.request('POST', '/api/v1/auth/login',
+                                    {'username': username, 'password': password})
+        if status == 200:
+            self.token = body['access_token']
+        return status, body
+
+
+class LoadStats:
+    """Thread-safe record of request latencies and outcomes per scenario."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.errors: Dict[str, Counter] = defaultdict(Counter)
+        self.purchases: Counter = Counter()  # acknowledged purchases per gift id
+
+    def record(self, scenario: str, latency: float, error: Optional[str] = None,
+               gift_id: Optional[int] = None):
+        """Record a request of `scenario`, with `error` describing any failure."""
+        with self._lock:
+            self.latencies[scenario].append(latency)
+            if error is not None:
+                self.errors[scenario][error] += 1
+            elif gift_id is not None:
+                self.purchases[gift_id] += 1
+
+    def summary(self, elapsed: float) -> Dict[str, Dict[str, float]]:
+        """Return throughput and latency percentiles (in ms) per scenario."""
+        summary = {}
+        for scenario, latencies in sorted(self.latencies.items()):
+            latencies = sorted(latencies)
+            summary[scenario] = {
+                'requests': len(latencies),
+                'errors': sum(self.errors[scenario].values()),
+                'throughput_rps': round(len(latencies) / elapsed, 3) if elapsed else 0.,
+                'p50_ms': round(percentile(latencies, 50) * 1000., 3),
+                'p95_ms': round(percentile(latencies, 95) * 1000., 3),
+                'p99_ms': round(percentile(latencies, 99) * 1000., 3),
+                'max_ms': round(latencies[-1] * 1000., 3) if latencies else 0.,
+            }
+        return summary
+
+
+def _describe_error(status: int, body: Any) -> Optional[str]:
+    if status < 400:
+        return None
+    msg = body.get('msg') if isinstance(body, dict) else None
+    return f'HTTP {status}' + (f': {str(msg)[:80]}' if msg else '')
+
+
+def snapshot(client: ApiClient, gift_ids: Sequence[int]) -> Dict[str, Dict[int, Any]]:
+    """Return the gifts (from the couple's list) and their items' stock."""
+    status, gifts = client.request('GET', '/api/v1/gifts/list')
+    gifts = {gift['id']: gift for gift in (gifts or []) if status == 200 and gift['id'] in gift_ids}
+    stock = {}
+    for item_id in sorted({gift['item_id'] for gift in gifts.values()}):
+        status, item = client.request('GET', f'/api/v1/store/items/id/{item_id}')
+        if status == 200 and item:
+            stock[item_id] = item['in_stock_quantity']
+    return {'gifts': gifts, 'stock': stock}
+
+
+def reconcile(before: Mapping[str, Dict[int, Any]], after: Mapping[str, Dict[int, Any]],
+              purchases: Mapping[int, int]) -> List[str]:
+    """Return descriptions of any inconsistencies caused by the load test.
+
+    Assumes that only the load test modified the gifts and items, i.e. that
+    the number purchased of each gift increased by exactly the number of
+    purchases acknowledged, and the stock of each item fell by exactly the
+    number acknowledged of its gifts, without any gift or item going
+    negative. With `STOCK_LEDGER_ENABLED`, stock leased but not yet
+    consolidated (see `..backend.stock`) is reported as a mismatch.
+    """
+    return _reconcile_gifts(before, after, purchases) + _reconcile_stock(before, after, purchases)
+
+
+def _reconcile_gifts(before: Mapping[str, Dict[int, Any]], after: Mapping[str, Dict[int, Any]],
+                     purchases: Mapping[int, int]) -> List[str]:
+    issues = []
+    for gift_id, gift in sorted(before['gifts'].items()):
+        final = after['gifts'].get(gift_id)
+        if final is None:
+            issues.append(f'gift {gift_id}: missing after load test')
+            continue
+        acknowledged = purchases.get(gift_id, 0)
+        recorded = final['purchased'] - gift['purchased']
+        if final['available'] < 0:
+            issues.append(f'gift {gift_id}: oversold, {final["available"]} available')
+        if acknowledged > gift['available']:
+            issues.append(f'gift {gift_id}: oversold, {acknowledged} purchases acknowledged '
+                          f'but only {gift["available"]} were available')
+        if recorded != acknowledged:
+            issues.append(f'gift {gift_id}: {acknowledged} purchases acknowledged, '
+                          f'but {recorded} recorded (lost updates)')
+        if final['available'] + final['purchased'] != gift['available'] + gift['purchased']:
+            issues.append(f'gift {gift_id}: desired quantity changed from '
+                          f'{gift["available"] + gift["purchased"]} to '
+                          f'{final["available"] + final["purchased"]}')
+    return issues
+
+
+def _reconcile_stock(before: Mapping[str, Dict[int, Any]], after: Mapping[str, Dict[int, Any]],
+                     purchases: Mapping[int, int]) -> List[str]:
+    issues = []
+    sold: Counter = Counter()
+    for gift_id, gift in before['gifts'].items():
+        sold[gift['item_id']] += purchases.get(gift_id, 0)
+    for item_id, quantity in sorted(after['stock'].items()):
+        if quantity < 0:
+            issues.append(f'item {item_id}: negative stock of {quantity}')
+        initial = before['stock'].get(item_id)
+        if initial is not None and initial - quantity != sold[item_id]:
+            issues.append(f'item {item_id}: {sold[item_id]} purchases acknowledged, '
+                          f'but stock fell by {initial - quantity}')
+    return issues
+
+
+def _virtual_user(index: int, base_url: str, credentials: Tuple[str, str],  # pylint: disable=too-many-arguments
+                  weights: Mapping[str, int], hot_gifts: Sequence[int], stats: LoadStats,
+                  stop: threading.Event, budget: List[int], budget_lock: threading.Lock,
+                  seed: int):
+    rng = random.Random(seed + index)
+    client = ApiClient(base_url)
+    scenarios, cum_weights = list(weights), []
+    for weight in weights.values():
+        cum_weights.append((cum_weights[-1] if cum_weights else 0) + weight)
+
+    scenario = 'login'  # every virtual user starts by logging in
+    while not stop.is_set():
+        with budget_lock:
+            if budget[0] == 0:
+                break
+            budget[0] -= 1
+        gift_id = None
+        start = perf_counter()
+        try:
+            if scenario == 'login':
+                status, body = client.login(*credentials)
+            elif scenario == 'browse':
+                status, body = client.request('GET', '/api/v1/gifts/list')
+            elif scenario == 'report':
+                status, body = client.request('GET', '/api/v1/gifts/list/report')
+            else:
+                gift_id = rng.choice(hot_gifts)
+                status, body = client.request(
+                    'POST', f'/api/v1/gifts/list/{gift_id}/purchase?quantity=1')
+            error = _describe_error(status, body)
+        except (URLError, OSError) as err:
+            error = f'{err.__class__.__name__}: {getattr(err, "reason", err)}'
+        stats.record(scenario, perf_counter() - start, error, gift_id)
+        scenario = rng.choices(scenarios, cum_weights=cum_weights)[0]
+
+
+def run_loadtest(base_url: str, username: str, password: str,  # pylint: disable=too-many-arguments,too-many-locals
+                 users: int = 20, duration: float = 30., max_requests: int = -1,
+                 mix: str = DEFAULT_MIX, hot_gifts: int = 3, seed: int = 0
+                 ) -> Dict[str, Any]:
+    """Run the load test and return its summary, errors and reconciliation issues.
+
+    Parameters
+    ----------
+    base_url: str
+        The URL of the running server, e.g. 'http://127.0.0.1:5000'.
+    username, password: str
+        The credentials of the couple whose gift list is purchased from.
+    users: int
+        The number of concurrent virtual users.
+    duration: float
+        The maximum number of seconds to run for.
+    max_requests: int
+        The maximum total number of requests, unlimited when negative.
+    mix: str
+        The weight of each scenario, see `parse_mix()`.
+    hot_gifts: int
+        The number of gifts (with the most available) that purchases target.
+    seed: int
+        The random seed for the virtual users' choices.
+    """
+    weights = parse_mix(mix)
+    client = ApiClient(base_url)
+    status, body = client.login(username, password)
+    if status != 200:
+        raise RuntimeError(f'unable to log in as {username!r}: {_describe_error(status, body)}')
+    status, gifts = client.request('GET', '/api/v1/gifts/list')
+    gifts = sorted(gifts or [], key=lambda gift: (-gift['available'], gift['id']))
+    hot = [gift['id'] for gift in gifts[:hot_gifts]]
+    if weights.get('purchase') and not hot:
+        raise RuntimeError(f'the gift list of {username!r} is empty, nothing to purchase')
+
+    before = snapshot(client, hot)
+    stats = LoadStats()
+    stop = threading.Event()
+    budget, budget_lock = [max_requests], threading.Lock()
+    threads = [threading.Thread(target=_virtual_user, name=f'virtual-user-{i}', daemon=True,
+                                args=(i, base_url, (username, password), weights, hot,
+                                      stats, stop, budget, budget_lock, seed))
+               for i in range(users)]
+    start = perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(max(duration - (perf_counter() - start), 0.))
+    stop.set()
+    for thread in threads:
+        thread.join()
+    elapsed = perf_counter() - start
+
+    after = snapshot(client, hot)
+    return {
+        'elapsed': elapsed,
+        'summary': stats.summary(elapsed),
+        'errors': {scenario: dict(errors) for scenario, errors in stats.errors.items()},
+        'purchases': dict(stats.purchases),
+        'issues': reconcile(before, after, stats.purchases),
+    }
+
+
+@click.command('loadtest')
+@click.option('--url', default='http://127.0.0.1:5000', show_default=True,
+              help='Base URL of the running server.')
+@click.option('--username', '-u', required=True, help="The couple's username.")
+@click.option('--password', '-p', required=True, help="The couple's password.")
+@click.option('--users', '-c', type=int, default=20, show_default=True,
+              help='Number of concurrent virtual users.')
+@click.option('--duration', '-t', type=float, default=30., show_default=True,
+              help='Maximum number of seconds to run for.')
+@click.option('--requests', '-n', 'max_requests', type=int, default=-1,
+              help='Maximum total number of requests (default unlimited).')
+@click.option('--mix', default=DEFAULT_MIX, show_default=True,
+              help='Weights of the browse, login, purchase and report scenarios.')
+@click.option('--hot-gifts', type=int, default=3, show_default=True,
+              help='Number of gifts that purchases are concentrated on.')
+@click.option('--seed', type=int, default=0, show_default=True,
+              help="Random seed for the virtual users' choices.")
+def loadtest_command(url: str, username: str, password: str, users: int,  # pylint: disable=too-many-arguments
+                     duration: float, max_requests: int, mix: str, hot_gifts: int, seed: int):
+    """Run concurrent virtual users purchasing from one couple's gift list."""
+    try:
+        result = run_loadtest(url, username, password, users=users, duration=duration,
+                              max_requests=max_requests, mix=mix, hot_gifts=hot_gifts,
+                              seed=seed)
+    except (RuntimeError, ValueError, URLError) as err:
+        raise click.ClickException(str(err))
+
+    total = sum(stats['requests'] for stats in result['summary'].values())
+    click.echo(f'{total} requests from {users} virtual users in {result["elapsed"]:.1f}s '
+               f'({total / result["elapsed"]:.1f} req/s)\n')
+    click.echo(f'{"scenario":<10} {"requests":>8} {"errors":>6} {"req/s":>8} '
+               f'{"p50 ms":>9} {"p95 ms":>9} {"p99 ms":>9} {"max ms":>9}')
+    for scenario, stats in result['summary'].items():
+        click.echo(f'{scenario:<10} {stats["requests"]:>8} {stats["errors"]:>6} '
+                   f'{stats["throughput_rps"]:>8.1f} {stats["p50_ms"]:>9.3f} '
+                   f'{stats["p95_ms"]:>9.3f} {stats["p99_ms"]:>9.3f} {stats["max_ms"]:>9.3f}')
+
+    if any(result['errors'].values()):
+        click.echo('\nErrors:')
+        for scenario, errors in sorted(result['errors'].items()):
+            for error, count in sorted(errors.items(), key=lambda pair: -pair[1]):
+                click.echo(f'  {scenario:<10} {count:>6}x {error}')
+
+    click.echo(f'\nPurchases acknowledged per gift: {result["purchases"]}')
+    if result['issues']:
+        raise click.ClickException('reconciliation failed:\n  ' + '\n  '.join(result['issues']))
+    click.echo('Reconciliation OK: no oversold gifts, lost updates or stock mismatches')
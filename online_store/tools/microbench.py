@@ -0,0 +1,154 @@
+"""Micro-benchmarks concurrent stock decrements of a single (flash sale) item.
+
+Each strategy sells the entire stock of one item one unit at a time from
+several threads, verifying that exactly the initial stock was sold and none
+oversold:
+
+    - `row`: a conditional update of the item's row per unit, i.e. the best
+      case without the ledger, as every buyer serializes on the row.
+    - `ledger`: reservations from a `StockLedger` with one shard.
+    - `sharded`: reservations from a `StockLedger` with `--shards` shards.
+
+Examples
+--------
+.. code-block:: bash
+
+    $ python manage.py microbench --threads 8 --stock 20000
+
+"""
+import os
+import tempfile
+import threading
+
+from time import perf_counter
+from typing import TYPE_CHECKING, Dict, List, Optional
+
+import click
+
+if TYPE_CHECKING:  # pragma: no cover
+    from ..backend.stock import StockLedger
+
+# NOTE: SQLAlchemy and the stock ledger are imported by the functions below,
+# so that `manage.py` stays cheap to start, see `.importtime`
+
+STRATEGIES = ('row', 'ledger', 'sharded')
+
+_DECREMENT = ('UPDATE items SET in_stock_quantity = in_stock_quantity - 1 '
+              'WHERE id = :item_id AND in_stock_quantity >= 1')
+
+
+def _sell_by_row(engine, item_id: int) -> int:
+    from sqlalchemy import text  # pylint: disable=import-outside-toplevel
+    decrement = text(_DECREMENT)
+    sold = 0
+    while True:
+        with engine.begin() as conn:
+            if not conn.execute(decrement, item_id=item_id).rowcount:
+                return sold
+        sold += 1
+
+
+def _sell_by_ledger(ledger: 'StockLedger', item_id: int) -> int:
+    # pylint: disable=import-outside-toplevel
+    from ..backend.models.order import StockUnavailableError
+    sold = 0
+    while True:
+        try:
+            reservation = ledger.reserve(item_id, 1)
+        except StockUnavailableError:
+            return sold
+        ledger.commit(reservation)
+        sold += 1
+
+
+def run_microbench(engine, strategy: str, threads: int = 8, stock: int = 10000,
+                   shards: int = 8, lease_size: int = 100) -> Dict[str, float]:
+    """Sell `stock` units of a new item from `threads` threads using `strategy`.
+
+    Returns
+    -------
+    Dict[str, float]
+        The number of units sold, the stock remaining in the items table,
+        the elapsed time and the throughput.
+    """
+    # pylint: disable=import-outside-toplevel
+    from sqlalchemy import text
+    from ..backend.stock import StockLedger
+    with engine.begin() as conn:
+        item_id = conn.execute(text(
+            "INSERT INTO items (name, brand, price, currency, in_stock_quantity) "
+            "VALUES ('Flash sale', 'Bench', 1.0, 'GBP', :stock)"), stock=stock).lastrowid
+
+    ledger = None
+    if strategy != 'row':
+        ledger = StockLedger(engine, shards=shards if strategy == 'sharded' else 1,
+                             lease_size=lease_size)
+    sold: List[int] = []
+    barrier = threading.Barrier(threads + 1)
+
+    def worker():
+        barrier.wait()
+        count = _sell_by_row(engine, item_id) if ledger is None \
+            else _sell_by_ledger(ledger, item_id)
+        sold.append(count)
+
+    workers = [threading.Thread(target=worker) for _ in range(threads)]
+    for thread in workers:
+        thread.start()
+    barrier.wait()
+    start = perf_counter()
+    for thread in workers:
+        thread.join()
+    elapsed = perf_counter() - start
+    if ledger is not None:
+        ledger.consolidate()
+
+    with engine.connect() as conn:
+        remaining = conn.execute(text('SELECT in_stock_quantity FROM items WHERE id = :item_id'),
+                                 item_id=item_id).scalar()
+    return {'sold': sum(sold), 'remaining': remaining, 'elapsed': elapsed,
+            'throughput_ops': sum(sold) / elapsed if elapsed else 0.}
+
+
+@click.command('microbench')
+@click.option('--threads', '-t', type=int, default=8, show_default=True,
+              help='Number of concurrent buyers.')
+@click.option('--stock', type=int, default=10000, show_default=True,
+              help='Initial stock of the item, i.e. the number of decrements.')
+@click.option('--shards', type=int, default=8, show_default=True,
+              help='Number of shards of the sharded ledger.')
+@click.option('--lease-size', type=int, default=100, show_default=True,
+              help='Number of units leased from the items table at once.')
+@click.option('--strategy', '-s', 'strategies', multiple=True, type=click.Choice(STRATEGIES),
+              help='Strategy to benchmark (repeatable), default is all.')
+@click.option('--database', '-d',
+              help='Database URI to benchmark, by default a temporary SQLite database.')
+def microbench_command(threads: int, stock: int, shards: int, lease_size: int,  # pylint: disable=too-many-arguments
+                       strategies: List[str], database: Optional[str]):
+    """Benchmark concurrent stock decrements of a single item."""
+    # pylint: disable=import-outside-toplevel
+    from sqlalchemy import create_engine
+    from ..backend.models.database import db
+    from ..backend.models import item  # noqa: F401 pylint: disable=unused-import
+
+    db_fd, db_path = (None, None) if database else tempfile.mkstemp(suffix='.db')
+    engine = create_engine(database or f'sqlite:///{db_path}')
+    try:
+        db.Model.metadata.create_all(bind=engine)
+        click.echo(f'Selling {stock} units from {threads} threads\n')
+        click.echo(f'{"strategy":<10} {"sold":>8} {"remaining":>10} {"ops/s":>10} {"elapsed s":>10}')
+        failed = []
+        for strategy in strategies or STRATEGIES:
+            result = run_microbench(engine, strategy, threads=threads, stock=stock,
+                                    shards=shards, lease_size=lease_size)
+            click.echo(f'{strategy:<10} {result["sold"]:>8} {result["remaining"]:>10} '
+                       f'{result["throughput_ops"]:>10.0f} {result["elapsed"]:>10.3f}')
+            if result['sold'] != stock or result['remaining'] != 0:
+                failed.append(strategy)
+    finally:
+        engine.dispose()
+        if db_path:
+            os.close(db_fd)
+            os.unlink(db_path)
+    if failed:
+        raise click.ClickException(f'stock oversold or lost by: {", ".join(failed)}')
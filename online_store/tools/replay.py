@@ -0,0 +1,189 @@
+"""Replays captured requests against a local instance of the app.
+
+Requests captured with `REQUEST_CAPTURE_FILE` (see
+`online_store.backend.utils.capture`) are issued through Flask test clients at
+their original offsets (optionally sped up), by as many concurrent workers as
+requests were in flight at once when captured. Authenticated requests are
+sent with a freshly minted access token for a local user.
+
+Captured credentials are redacted, so e.g. logins are expected to fail; such
+status code mismatches are reported separately from the latencies.
+
+Examples
+--------
+.. code-block:: bash
+
+    $ python manage.py generate-data --database sqlite:///large.db
+    $ python manage.py replay requests.ndjson --database sqlite:///large.db --speed 2
+
+"""
+import json
+import os
+import tempfile
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
+from time import perf_counter, sleep
+from typing import Any, Dict, Iterable, List, Optional
+from urllib.parse import urlencode
+
+import click
+
+from .datagen import DatasetCounts, generate_data
+from .loadtest import LoadStats
+
+
+def load_capture(path: str) -> List[Dict[str, Any]]:
+    """Return the captured requests in `path`, ordered by start time."""
+    records = []
+    with open(path, encoding='utf8') as capture_fp:
+        for line in capture_fp:
+            line = line.strip()
+            if line:
+                records.append(json.loads(line))
+    return sorted(records, key=lambda record: record['ts'])
+
+
+def max_concurrency(records: Iterable[Dict[str, Any]]) -> int:
+    """Return the maximum number of captured requests in flight at once."""
+    events = []
+    for record in records:
+        events.append((record['ts'], 1))
+        events.append((record['ts'] + record.get('ms', 0.) / 1000., -1))
+    in_flight = peak = 0
+    for _, change in sorted(events):  # ends sort before starts at the same time
+        in_flight += change
+        peak = max(peak, in_flight)
+    return peak
+
+
+def replay(app, records: List[Dict[str, Any]], identity: Optional[str] = None,  # pylint: disable=too-many-locals
+           speed: float = 1., concurrency: Optional[int] = None) -> Dict[str, Any]:
+    """Replay `records` against `app`, returning a summary per endpoint.
+
+    Parameters
+    ----------
+    app: Flask
+        The app to replay requests against.
+    records: List[Dict[str, Any]]
+        The captured requests, see `load_capture()`.
+    identity: Optional[str]
+        The username to authenticate requests as, if captured with auth.
+    speed: float
+        The factor to speed up (or slow down) the captured timings by, where
+        zero issues requests as fast as possible.
+    concurrency: Optional[int]
+        The number of concurrent workers, by default the captured maximum.
+    """
+    from flask_jwt_extended import create_access_token  # pylint: disable=import-outside-toplevel
+    headers = {}
+    if identity:
+        with app.app_context():
+            headers['Authorization'] = f'Bearer {create_access_token(identity)}'
+
+    stats = LoadStats()
+    mismatches: Dict[str, Dict[str, int]] = {}
+    mismatch_lock = threading.Lock()
+    local = threading.local()
+
+    def send(record: Dict[str, Any]):
+        client = getattr(local, 'client', None)
+        if client is None:
+            client = local.client = app.test_client()
+        kwargs = {'method': record['method'],
+                  'headers': headers if record.get('auth') else {},
+                  'query_string': urlencode(record.get('args', {}), doseq=True)}
+        if 'json' in record:
+            kwargs['json'] = record['json']
+        endpoint = f"{record['method']} {record.get('endpoint') or record['path']}"
+        start = perf_counter()
+        response = client.open(record['path'], **kwargs)
+        stats.record(endpoint, perf_counter() - start)
+        if response.status_code != record.get('status', response.status_code):
+            key = f"{record.get('status')} -> {response.status_code}"
+            with mismatch_lock:
+                counts = mismatches.setdefault(endpoint, {})
+                counts[key] = counts.get(key, 0) + 1
+
+    concurrency = concurrency or max(max_concurrency(records), 1)
+    max_lag = 0.
+    start = perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        first = records[0]['ts'] if records else 0.
+        for record in records:
+            delay = (record['ts'] - first) / speed - (perf_counter() - start) if speed else 0.
+            if delay > 0:
+                sleep(delay)
+            else:
+                max_lag = max(max_lag, -delay)
+            executor.submit(send, record)
+    elapsed = perf_counter() - start
+
+    return {'elapsed': elapsed, 'concurrency': concurrency, 'max_lag': max_lag,
+            'summary': stats.summary(elapsed), 'mismatches': mismatches}
+
+
+@click.command('replay')
+@click.argument('capture_file', type=click.Path(exists=True, dir_okay=False))
+@click.option('--database', '-d',
+              help='Database URI to replay against, by default a temporary database '
+                   'seeded with generated data.')
+@click.option('--identity', '-u',
+              help='Username to authenticate requests as, default is the first user.')
+@click.option('--speed', type=float, default=1., show_default=True,
+              help='Replay speed factor, use 0 to replay as fast as possible.')
+@click.option('--concurrency', '-c', type=int,
+              help='Number of concurrent workers, default is the captured maximum.')
+@click.option('--items', type=int, default=10000, show_default=True,
+              help='Number of items to generate for a temporary database.')
+@click.option('--users', type=int, default=1000, show_default=True,
+              help='Number of users to generate for a temporary database.')
+def replay_command(capture_file: str, database: Optional[str],  # pylint: disable=too-many-arguments,too-many-locals
+                   identity: Optional[str], speed: float, concurrency: Optional[int],
+                   items: int, users: int):
+    """Replay captured requests against a local instance of the app."""
+    # pylint: disable=import-outside-toplevel
+    from ..app import create_app
+    from ..backend.models.database import db
+    from ..backend.models.user import UserModel
+
+    records = load_capture(capture_file)
+    if not records:
+        raise click.ClickException(f'no requests captured in {capture_file}')
+
+    db_fd, db_path = (None, None) if database else tempfile.mkstemp(suffix='.db')
+    try:
+        app = create_app(config={
+            'FLASK_ENV': 'production',
+            'SQLALCHEMY_DATABASE_URI': database or f'sqlite:///{db_path}',
+            'SQLALCHEMY_TRACK_MODIFICATIONS': False,
+        })
+        with app.app_context():
+            if db_path:
+                generate_data(db.session.connection(),
+                              DatasetCounts(items, users, users, 20, users * 5))
+                db.session.commit()
+            if identity is None:
+                user = UserModel.query.order_by(UserModel.id).first()
+                identity = user.username if user else None
+
+        click.echo(f'Replaying {len(records)} requests as {identity!r}...')
+        result = replay(app, records, identity=identity, speed=speed, concurrency=concurrency)
+    finally:
+        if db_path:
+            os.close(db_fd)
+            os.unlink(db_path)
+
+    click.echo(f'Replayed in {result["elapsed"]:.1f}s with {result["concurrency"]} workers '
+               f'(max scheduling lag {result["max_lag"] * 1000.:.1f}ms)\n')
+    width = max(len(endpoint) for endpoint in result['summary'])
+    click.echo(f'{"endpoint":<{width}} {"requests":>8} {"req/s":>8} '
+               f'{"p50 ms":>9} {"p95 ms":>9} {"p99 ms":>9}')
+    for endpoint, stats in result['summary'].items():
+        click.echo(f'{endpoint:<{width}} {stats["requests"]:>8} {stats["throughput_rps"]:>8.1f} '
+                   f'{stats["p50_ms"]:>9.3f} {stats["p95_ms"]:>9.3f} {stats["p99_ms"]:>9.3f}')
+    if result['mismatches']:
+        click.echo('\nStatus codes differing from capture:')
+        for endpoint, counts in sorted(result['mismatches'].items()):
+            for change, count in sorted(counts.items()):
+                click.echo(f'  {endpoint:<{width}} {count:>6}x {change}')
@@ -0,0 +1,113 @@
+"""Benchmarks full-text item search against `LIKE '%term%'` with many items.
+
+Generates `--items` items (see `.datagen`) into a temporary SQLite database,
+builds the FTS5 index of their names and brands, then times a page of
+results for each of `QUERIES` with the index and with `LIKE`. Common terms
+let `LIKE` stop scanning early, whereas rare or missing terms scan every
+item, as do the index's results as they are ranked.
+
+The in-memory suggestions index (see `..backend.suggest`) is also built and
+timed suggesting the ten most popular items for each query.
+
+Examples
+--------
+.. code-block:: bash
+
+    $ python manage.py searchbench --items 1000000
+
+"""
+import os
+import tempfile
+
+from time import perf_counter
+from typing import TYPE_CHECKING, Dict, List, Optional
+
+import click
+
+from .datagen import DatasetCounts, generate_data
+
+if TYPE_CHECKING:  # pragma: no cover
+    from ..backend.suggest import ItemSuggestions
+
+# NOTE: SQLAlchemy, search and suggestions are imported by the functions
+# below, so that `manage.py` stays cheap to start, see `.importtime`
+
+# common, multi-word, prefix, rare and missing terms
+QUERIES = ('kettle', 'le cre', 'copper kettle', 'smeg toa', 'vintage vase 77777', 'zebra')
+
+
+def run_searchbench(engine, queries=QUERIES, repeat: int = 5, per_page: int = 20,
+                    suggestions: Optional['ItemSuggestions'] = None) -> Dict[str, Dict[str, float]]:
+    """Time a page of results of each of `queries`, with and without the index.
+
+    Returns
+    -------
+    Dict[str, Dict[str, float]]
+        The mean seconds of each query using `fts` and `like`, and the
+        number of items on the page of each, as well as using `suggest`
+        if `suggestions` are given.
+    """
+    from ..backend.search import ItemSearch  # pylint: disable=import-outside-toplevel
+    results: Dict[str, Dict[str, float]] = {}
+    with engine.connect() as conn:
+        for query in queries:
+            result: Dict[str, float] = {}
+            for mode, search in (('fts', ItemSearch(fts=True)), ('like', ItemSearch(fts=False))):
+                start = perf_counter()
+                for _ in range(repeat):
+                    found = search.search(conn, query, limit=per_page)
+                result[mode] = (perf_counter() - start) / repeat
+                result[f'{mode}_found'] = len(found)
+            if suggestions is not None:
+                start = perf_counter()
+                for _ in range(repeat):
+                    suggestions.suggest(query, limit=10)
+                result['suggest'] = (perf_counter() - start) / repeat
+            results[query] = result
+    return results
+
+
+@click.command('searchbench')
+@click.option('--items', '-n', type=int, default=1000000, show_default=True,
+              help='Number of store items to generate.')
+@click.option('--query', '-q', 'queries', multiple=True,
+              help='Query to benchmark (repeatable), default is a mix of common and rare terms.')
+@click.option('--repeat', '-r', type=int, default=5, show_default=True,
+              help='Number of times each query is timed.')
+def searchbench_command(items: int, queries: List[str], repeat: int):
+    """Benchmark full-text item search against LIKE."""
+    # pylint: disable=import-outside-toplevel
+    from sqlalchemy import create_engine
+    from ..backend.models.database import db
+    from ..backend.search import install_search_index
+    from ..backend.suggest import ItemSuggestions, install_activity_tracking
+    from ..backend.models import gift, item, order, user  # noqa: F401 pylint: disable=unused-import
+
+    db_fd, db_path = tempfile.mkstemp(suffix='.db')
+    engine = create_engine(f'sqlite:///{db_path}')
+    try:
+        db.Model.metadata.create_all(bind=engine)
+        with engine.connect() as conn:
+            generate_data(conn, DatasetCounts(items, 0, 0, 0, 0), echo=click.echo)
+        start = perf_counter()
+        if not install_search_index(engine):
+            raise click.ClickException('SQLite was built without FTS5')
+        click.echo(f'Indexed {items} items in {perf_counter() - start:.1f}s')
+        install_activity_tracking(engine)
+        suggestions = ItemSuggestions(engine)
+        start = perf_counter()
+        suggestions.build()
+        click.echo(f'Built suggestions of {items} items in {perf_counter() - start:.1f}s\n')
+
+        click.echo(f'{"query":<22} {"fts ms":>9} {"like ms":>9} {"speedup":>8} '
+                   f'{"fts found":>10} {"like found":>10} {"suggest µs":>11}')
+        for query, result in run_searchbench(engine, queries or QUERIES, repeat,
+                                             suggestions=suggestions).items():
+            click.echo(f'{query:<22} {1000 * result["fts"]:>9.2f} {1000 * result["like"]:>9.2f} '
+                       f'{result["like"] / result["fts"] if result["fts"] else 0.:>8.1f} '
+                       f'{result["fts_found"]:>10} {result["like_found"]:>10} '
+                       f'{1e6 * result["suggest"]:>11.1f}')
+    finally:
+        engine.dispose()
+        os.close(db_fd)
+        os.unlink(db_path)
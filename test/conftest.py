@@ -9,6 +9,7 @@ from flask_jwt_extended import create_access_token, create_refresh_token
 
 from online_store.app import create_app
 from online_store.backend.models.database import db, get_db
+from online_store.backend.utils.sql_profiler import query_budget as _query_budget
 
 try:
     with open(Path(__file__).parent / 'data.sql', 'rb') as f:
@@ -19,14 +20,15 @@ except FileNotFoundError as err:
 
 
 @pytest.fixture
-def app():
+def app(tmp_path):
     db_fd, db_path = tempfile.mkstemp()
 
     app = create_app(config={
         'TESTING': True,
         'DATABASE': db_path,
         'SQLALCHEMY_DATABASE_URI': f'sqlite:///{db_path}',
-        'SQLALCHEMY_TRACK_MODIFICATIONS': False
+        'SQLALCHEMY_TRACK_MODIFICATIONS': False,
+        'SQL_SLOW_QUERY_LOG': str(tmp_path / 'slow_queries.log'),
     })
 
     with app.app_context():
@@ -69,6 +71,15 @@ def test_auth_headers_with_refresh_token(app):
         yield headers
 
 
+@pytest.fixture
+def query_budget(app):
+    """Context manager asserting the maximum number of SQL queries executed.
+
+    Usage: ``with query_budget(2): client.get('/api/v1/store/items')``
+    """
+    return _query_budget
+
+
 class AuthActions(object):
     def __init__(self, client):
         self._client = client
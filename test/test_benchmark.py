@@ -0,0 +1,86 @@
+import json
+
+import pytest
+
+from click.testing import CliRunner
+from online_store.backend.models.database import db
+from online_store.backend.models.gift import GiftListModel, GiftModel
+from online_store.backend.models.user import UserModel
+from online_store.tools.benchmark import (
+    SCENARIOS, benchmark_command, compare_results, percentile,
+    run_benchmarks, seed_database
+)
+from online_store.tools.datagen import DatasetCounts
+
+SMALL_COUNTS = DatasetCounts(items=50, users=5, lists=5, gifts_per_list=3, orders=10)
+
+
+@pytest.fixture
+def app(app):
+    # data.sql assigns gift list 1 to the non-existent user 2, whose id would
+    # otherwise be taken by the first seeded user
+    with app.app_context():
+        GiftModel.query.delete()
+        GiftListModel.query.delete()
+        db.session.commit()
+    return app
+
+
+@pytest.mark.parametrize('q,expected', [(0, 1), (50, 5), (95, 10), (100, 10)])
+def test_percentile(q, expected):
+    assert percentile(list(range(1, 11)), q) == expected
+
+
+def test_seed_database(app):
+    with app.app_context():
+        data = seed_database(SMALL_COUNTS, active_users=2)
+        assert len(data.item_ids) == 50
+        assert [user_id for _, user_id, _ in data.users] == list(data.gift_ids)
+        assert len(data.users) == 2
+        assert UserModel.query.count() == 1 + 5
+        assert GiftListModel.query.filter(GiftListModel.user_id.in_(data.gift_ids)).count() == 2
+        assert all(gifts for gifts in data.gift_ids.values())
+        gift = GiftModel.query.get(data.gift_ids[data.users[0][1]][0])
+        assert gift.available == 1000000
+
+
+def test_run_benchmarks(app):
+    with app.app_context():
+        data = seed_database(SMALL_COUNTS, active_users=2)
+    results = run_benchmarks(app, data, iterations=3, warmup=1)
+    assert set(results) == set(SCENARIOS)
+    for result in results.values():
+        assert result['requests'] == 3
+        assert result['errors'] == 0
+        assert result['p95_ms'] >= result['p50_ms'] > 0
+
+
+def test_compare_results():
+    baseline = {'store.item': {'p95_ms': 10., 'throughput_rps': 100., 'errors': 0}}
+    assert compare_results({'store.item': {'p95_ms': 11., 'throughput_rps': 90., 'errors': 0}},
+                           baseline, threshold=0.2) == []
+    regressions = compare_results(
+        {'store.item': {'p95_ms': 13., 'throughput_rps': 70., 'errors': 1},
+         'store.items': {'p95_ms': 100., 'throughput_rps': 1., 'errors': 0}},
+        baseline, threshold=0.2)
+    assert len(regressions) == 3
+    assert all(regression.startswith('store.item:') for regression in regressions)
+
+
+def test_benchmark_command_baseline(tmp_path):
+    output = tmp_path / 'benchmark.json'
+    args = ['--items', '20', '--users', '2', '--gifts-per-list', '2', '--orders', '5',
+            '--iterations', '2', '--warmup', '0', '-s', 'store.item', '-s', 'gifts.list']
+    # NOTE: the app logs slow queries next to its log file by default
+    runner = CliRunner(env={'SQL_SLOW_QUERY_LOG': str(tmp_path / 'slow_queries.log')})
+    result = runner.invoke(benchmark_command, args + ['--output', str(output)])
+    assert result.exit_code == 0, result.output
+    baseline = json.loads(output.read_text())
+    assert set(baseline['results']) == {'store.item', 'gifts.list'}
+
+    for result in baseline['results'].values():
+        result.update(p95_ms=1e-6, throughput_rps=1e9)
+    output.write_text(json.dumps(baseline))
+    result = runner.invoke(benchmark_command, args + ['--baseline', str(output)])
+    assert result.exit_code != 0
+    assert 'regressed' in result.output
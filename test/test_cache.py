@@ -0,0 +1,174 @@
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
+from time import sleep
+
+import pytest
+
+from online_store.backend.models.database import get_db
+from online_store.backend.utils.cache import LRUCache, SingleFlight
+from online_store.backend.utils.invalidation import InvalidationBus
+
+
+def test_LRUCache_eviction():
+    cache = LRUCache(maxsize=2)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    assert cache.get('a') == 1  # 'b' is now least recently used
+    cache.set('c', 3)
+    assert 'b' not in cache
+    assert cache.get('b') is None
+    assert cache.stats == {'size': 2, 'maxsize': 2, 'hits': 1, 'misses': 1, 'evictions': 1}
+
+
+def test_LRUCache_invalidate():
+    cache = LRUCache()
+    for key in 'abc':
+        cache.set(key, key)
+    cache.invalidate('a', 'missing')
+    assert len(cache) == 2
+    cache.invalidate()
+    assert len(cache) == 0
+
+
+def test_LRUCache_disabled():
+    cache = LRUCache(maxsize=0)
+    cache.set('a', 1)
+    assert cache.get('a') is None
+
+
+def test_item_cache_hit(client, query_budget):
+    first = client.get('/api/v1/store/items/id/1')
+    assert first.status_code == 200
+    with query_budget(0):
+        second = client.get('/api/v1/store/items/id/1')
+    assert second.get_data() == first.get_data()
+    assert client.get('/api/v1/store/items/id/999').status_code == 204
+
+
+def _stock(client, item_id: int) -> int:
+    return client.get(f'/api/v1/store/items/id/{item_id}').get_json()['in_stock_quantity']
+
+
+def test_item_cache_invalidated_by_order(client):
+    stock = _stock(client, 1)
+    response = client.post('/api/v1/store/order',
+                           json={'user': 1, 'items': [{'item_id': 1, 'quantity': 2}]})
+    assert response.status_code == 200
+    assert _stock(client, 1) == stock - 2
+
+
+def test_item_cache_invalidated_by_purchase(client, test_auth_headers):
+    stock = _stock(client, 2)
+    client.post('/api/v1/gifts/list/add?item_id=2&quantity=2', headers=test_auth_headers)
+    gift_id = client.get('/api/v1/gifts/list', headers=test_auth_headers).get_json()[-1]['id']
+    response = client.post(f'/api/v1/gifts/list/{gift_id}/purchase', headers=test_auth_headers)
+    assert response.status_code == 200
+    assert _stock(client, 2) == stock - 1
+
+
+@pytest.mark.parametrize('result', ['hit', 'miss'])
+def test_item_cache_metrics(client, result):
+    client.get('/api/v1/store/items/id/1')
+    client.get('/api/v1/store/items/id/1')
+    metrics = client.get('/metrics').get_data(as_text=True)
+    assert f'cache_requests_total{{cache="items",result="{result}"}}' in metrics
+
+
+def test_LRUCache_ttl(monkeypatch):
+    now = [100.]
+    monkeypatch.setattr('online_store.backend.utils.cache.monotonic', lambda: now[0])
+    cache = LRUCache(ttl=10)
+    cache.set('a', 1)
+    now[0] += 9.9
+    assert cache.get('a') == 1
+    now[0] += 0.1
+    assert cache.get('a') is None
+    assert len(cache) == 0
+
+
+def test_SingleFlight_coalesces():
+    flight = SingleFlight()
+    started, release = threading.Event(), threading.Event()
+    calls = []
+
+    def build():
+        calls.append(1)
+        started.set()
+        release.wait(5)
+        return 'value'
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        leader = executor.submit(flight.do, 'key', build)
+        started.wait(5)
+        followers = [executor.submit(flight.do, 'key', build) for _ in range(3)]
+        while flight.coalesced < 3:
+            sleep(0.001)
+        release.set()
+        results = [leader.result()] + [future.result() for future in followers]
+    assert results == ['value'] * 4
+    assert len(calls) == 1
+
+
+def test_SingleFlight_shares_errors():
+    flight = SingleFlight()
+    with pytest.raises(ValueError):
+        flight.do('key', lambda: int('x'))
+    assert flight.do('key', lambda: 1) == 1  # errors are not remembered
+
+
+def test_items_response_cache_hit(client, query_budget):
+    first = client.get('/api/v1/store/items?fields=id,name&id=1')
+    assert first.status_code == 200
+    with query_budget(0):
+        second = client.get('/api/v1/store/items?id=1&fields=id,name')
+    assert second.get_data() == first.get_data()
+    assert second.headers['Content-Type'] == 'application/json'
+
+
+def test_items_response_cache_invalidated_by_order(client):
+    stock = client.get('/api/v1/store/items?id=1').get_json()[0]['in_stock_quantity']
+    response = client.post('/api/v1/store/order',
+                           json={'user': 1, 'items': [{'item_id': 1, 'quantity': 2}]})
+    assert response.status_code == 200
+    assert client.get('/api/v1/store/items?id=1').get_json()[0]['in_stock_quantity'] == stock - 2
+
+
+def test_items_response_cache_ignores_errors(client):
+    assert client.get('/api/v1/store/items?missing=1').status_code == 400
+    assert len(client.application.extensions['items_response_cache']) == 0
+
+
+def test_invalidation_bus_other_connection(app, client):
+    stock = _stock(client, 1)
+    assert client.get('/api/v1/store/items?id=1').get_json()[0]['in_stock_quantity'] == stock
+    with app.app_context():  # e.g. a purchase by another worker
+        conn = get_db()
+        conn.execute('UPDATE items SET in_stock_quantity = 42 WHERE id = 1')
+        conn.commit()
+    assert _stock(client, 1) == 42
+    assert client.get('/api/v1/store/items?id=1').get_json()[0]['in_stock_quantity'] == 42
+    metrics = client.get('/metrics').get_data(as_text=True)
+    assert 'cache_bus_invalidations_total{table="items"}' in metrics
+
+
+def test_invalidation_bus_triggers_registered_tables_only(app):
+    with app.app_context():
+        triggers = {name for name, in get_db().execute(
+            "SELECT name FROM sqlite_master WHERE type = 'trigger' AND name LIKE '%_version'")}
+    # NOTE: e.g. gift purchases needn't write to the versions table
+    assert triggers == {f'{table}_{operation}_version' for table in ('items', 'item_activity')
+                        for operation in ('insert', 'update', 'delete')}
+
+
+def test_invalidation_bus_interval(app):
+    bus = InvalidationBus(interval=60)
+    bus.register(LRUCache(), 'items')
+    with app.app_context():
+        conn = get_db()
+        assert bus.poll(conn) == set()
+        conn.execute('UPDATE items SET in_stock_quantity = 42 WHERE id = 1')
+        conn.commit()
+        assert bus.poll(conn) == set()  # throttled
+        bus.interval = 0
+        assert bus.poll(conn) == {'items'}
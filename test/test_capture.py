@@ -0,0 +1,76 @@
+import json
+
+import pytest
+
+from click.testing import CliRunner
+
+from online_store.app import create_app
+from online_store.backend.utils.capture import REDACTED, is_sensitive, sanitize
+from online_store.tools.replay import load_capture, max_concurrency, replay_command
+
+
+@pytest.fixture
+def capture_file(tmp_path):
+    db_path = tmp_path / 'capture.db'
+    capture_path = tmp_path / 'requests.ndjson'
+    app = create_app(config={
+        'TESTING': True,
+        'SQLALCHEMY_DATABASE_URI': f'sqlite:///{db_path}',
+        'SQLALCHEMY_TRACK_MODIFICATIONS': False,
+        'REQUEST_CAPTURE_FILE': str(capture_path),
+        'SQL_SLOW_QUERY_LOG': str(tmp_path / 'slow_queries.log'),
+    })
+    client = app.test_client()
+    client.get('/api/v1/store/items?name=Tea%20pot')
+    client.get('/api/v1/store/items/id/1')
+    client.post('/api/v1/auth/login', json={'username': 'test', 'password': 'secret'})
+    client.get('/metrics')  # excluded by default
+    app.extensions['request_capture'].close()
+    return capture_path
+
+
+def test_sanitize():
+    data = {'username': 'test', 'password': 'secret', 'nested': [{'email': 'a@b.c', 'id': 1}],
+            'access_token': 'abc'}
+    assert sanitize(data) == {'username': 'test', 'password': REDACTED,
+                              'nested': [{'email': REDACTED, 'id': 1}],
+                              'access_token': REDACTED}
+
+
+@pytest.mark.parametrize('key,sensitive', [
+    ('password', True), ('Authorization', True), ('X-Auth-Token', True), ('accessToken', True),
+    ('card_number', True), ('billing_address', True), ('author', False),
+    ('ip_address', False), ('passenger', False), ('tokens_used', False), ('item_id', False),
+])
+def test_is_sensitive(key, sensitive):
+    assert is_sensitive(key) is sensitive
+
+
+def test_request_capture(capture_file):
+    records = [json.loads(line) for line in capture_file.read_text().splitlines()]
+    assert [record['path'] for record in records] == \
+        ['/api/v1/store/items', '/api/v1/store/items/id/1', '/api/v1/auth/login']
+    assert records[0]['args'] == {'name': ['Tea pot']}
+    assert records[0]['endpoint'] == 'store.items'
+    assert records[1]['status'] == 200
+    assert records[2]['json'] == {'username': 'test', 'password': REDACTED}
+    assert 'secret' not in capture_file.read_text()
+    assert all(record['ms'] >= 0 and not record['auth'] for record in records)
+
+
+def test_max_concurrency():
+    records = [{'ts': 0., 'ms': 100.}, {'ts': 0.05, 'ms': 100.}, {'ts': 0.1, 'ms': 10.},
+               {'ts': 1., 'ms': 1.}]
+    assert max_concurrency(records) == 2
+
+
+def test_replay_command(capture_file, tmp_path):
+    assert len(load_capture(str(capture_file))) == 3
+    # NOTE: the app logs slow queries next to its log file by default
+    runner = CliRunner(env={'SQL_SLOW_QUERY_LOG': str(tmp_path / 'slow_queries.log')})
+    result = runner.invoke(replay_command, [
+        str(capture_file), '--speed', '0', '--items', '20', '--users', '2'])
+    assert result.exit_code == 0, result.output
+    assert 'Replaying 3 requests' in result.output
+    assert 'GET store.item ' in result.output
+    assert 'POST auth.login' in result.output
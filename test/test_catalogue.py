@@ -0,0 +1,92 @@
+import json
+import os
+import sqlite3
+
+import pytest
+
+from click.testing import CliRunner
+
+from online_store.app import create_app
+from online_store.backend.catalogue import CatalogueSnapshot, SnapshotError, write_snapshot
+from online_store.backend.models.database import get_db
+from online_store.tools.catalogue import export_catalogue_command
+
+
+@pytest.fixture
+def snapshot_app(app, tmp_path):
+    """An app serving items from a catalogue snapshot of the `app` database."""
+    snapshot_app = create_app(config={
+        'TESTING': True,
+        'DATABASE': app.config['DATABASE'],
+        'SQLALCHEMY_DATABASE_URI': app.config['SQLALCHEMY_DATABASE_URI'],
+        'SQLALCHEMY_TRACK_MODIFICATIONS': False,
+        'CATALOGUE_SNAPSHOT': str(tmp_path / 'catalogue.bin'),
+        'SQL_SLOW_QUERY_LOG': app.config['SQL_SLOW_QUERY_LOG'],
+    })
+    yield snapshot_app
+    thread = snapshot_app.extensions['catalogue_snapshot'].rebuild_thread
+    if thread is not None:
+        thread.join()
+
+
+def test_snapshot_matches_orm(app, client, snapshot_app, query_budget):
+    snapshot_client = snapshot_app.test_client()
+    expected = {path: client.get(path).get_data() for path in (
+        '/api/v1/store/items', '/api/v1/store/items/id/1', '/api/v1/store/items/id/20')}
+    with query_budget(0):
+        for path, body in expected.items():
+            assert snapshot_client.get(path).get_data() == body
+        assert snapshot_client.get('/api/v1/store/items/id/999').status_code == 204
+        item = snapshot_client.get('/api/v1/store/items?id=2&fields=name').get_json()
+    assert item == client.get('/api/v1/store/items?id=2').get_json()
+    brand = item[0]['brand']
+    assert snapshot_client.get(f'/api/v1/store/items?brand={brand}').get_data() == \
+        client.get(f'/api/v1/store/items?brand={brand}').get_data()
+
+
+def test_snapshot_rebuilt_when_stale(snapshot_app):
+    client = snapshot_app.test_client()
+    snapshots = snapshot_app.extensions['catalogue_snapshot']
+    client.get('/api/v1/store/items/id/1')
+    old = snapshots.snapshot
+    with snapshot_app.app_context():  # e.g. a purchase by another worker
+        conn = get_db()
+        conn.execute('UPDATE items SET in_stock_quantity = 42 WHERE id = 1')
+        conn.commit()
+    # served by the ORM until the snapshot has been rebuilt
+    assert client.get('/api/v1/store/items/id/1').get_json()['in_stock_quantity'] == 42
+    snapshots.rebuild_thread.join()
+    assert snapshots.snapshot is not old
+    assert snapshots.snapshot.get(1)['in_stock_quantity'] == 42
+    assert old.get(1)['in_stock_quantity'] != 42  # replaced atomically, old mapping intact
+
+
+def test_snapshot_nulls(tmp_path):
+    conn = sqlite3.connect(str(tmp_path / 'items.db'))
+    conn.execute('CREATE TABLE items (id INTEGER PRIMARY KEY, name TEXT, brand TEXT, '
+                 'price FLOAT, currency TEXT, in_stock_quantity INTEGER)')
+    conn.execute("INSERT INTO items VALUES (7, 'Café set', NULL, NULL, '', 3)")
+    conn.commit()
+    path = str(tmp_path / 'catalogue.bin')
+    assert write_snapshot(conn, path) == (1, -1)
+    snapshot = CatalogueSnapshot(path)
+    assert snapshot.get(7) == {'brand': None, 'currency': '', 'id': 7, 'in_stock_quantity': 3,
+                               'name': 'Café set', 'price': None}
+    assert json.loads(snapshot.item_json(7))['name'] == 'Café set'
+    assert snapshot.get(6) is None and snapshot.get(8) is None
+    assert sorted(os.listdir(tmp_path)) == ['catalogue.bin', 'items.db']  # no temporary files
+
+
+def test_snapshot_invalid(tmp_path):
+    path = tmp_path / 'catalogue.bin'
+    path.write_bytes(b'not a snapshot' * 4)
+    with pytest.raises(SnapshotError):
+        CatalogueSnapshot(str(path))
+
+
+def test_export_catalogue_command(app, tmp_path):
+    output = tmp_path / 'catalogue.bin'
+    result = CliRunner().invoke(export_catalogue_command, [
+        str(output), '--database', app.config['SQLALCHEMY_DATABASE_URI']])
+    assert result.exit_code == 0, result.output
+    assert len(CatalogueSnapshot(str(output))) == 20
@@ -0,0 +1,62 @@
+import random
+
+import pytest
+
+from click.testing import CliRunner
+from sqlalchemy import create_engine
+
+from online_store.tools.datagen import (
+    DatasetCounts, ZipfSampler, generate_data, generate_data_command, password_for
+)
+
+COUNTS = DatasetCounts(items=200, users=20, lists=10, gifts_per_list=5, orders=50)
+
+
+def test_ZipfSampler_skew():
+    sampler = ZipfSampler(list(range(100)), exponent=1.1, rng=random.Random(0))
+    samples = sampler.sample(10000)
+    assert samples.count(0) > samples.count(1) > samples.count(50)
+
+
+def _dump(db_uri):
+    engine = create_engine(db_uri)
+    tables = ['items', 'users', 'gift_lists', 'gifts', 'orders', 'order_items']
+    dump = {table: engine.execute(f'SELECT * FROM {table} ORDER BY id').fetchall()
+            for table in tables}
+    engine.dispose()
+    return dump
+
+
+@pytest.mark.parametrize('seed', [0])
+def test_generate_data_command_is_deterministic(tmp_path, seed):
+    runner = CliRunner()
+    dumps = []
+    for name in ('a.db', 'b.db'):
+        db_uri = f'sqlite:///{tmp_path / name}'
+        result = runner.invoke(generate_data_command, [
+            '--database', db_uri, '--items', str(COUNTS.items), '--users', str(COUNTS.users),
+            '--lists', str(COUNTS.lists), '--gifts-per-list', str(COUNTS.gifts_per_list),
+            '--orders', str(COUNTS.orders), '--seed', str(seed)])
+        assert result.exit_code == 0, result.output
+        dumps.append(_dump(db_uri))
+
+    assert dumps[0] == dumps[1]
+    assert len(dumps[0]['items']) == COUNTS.items
+    assert len(dumps[0]['users']) == COUNTS.users
+    assert len(dumps[0]['gift_lists']) == COUNTS.lists
+    assert len(dumps[0]['orders']) == COUNTS.orders
+    assert dumps[0]['gifts'] and dumps[0]['order_items']
+
+
+def test_generate_data_follows_existing_rows(app):
+    from online_store.backend.models.database import db
+    from online_store.backend.models.item import ItemModel
+    from online_store.backend.models.user import UserModel
+    with app.app_context():
+        existing_items = ItemModel.query.count()
+        data = generate_data(db.session.connection(), COUNTS)
+        db.session.commit()
+        assert data.item_ids.start > existing_items
+        assert ItemModel.query.count() == existing_items + COUNTS.items
+        user = UserModel.query.get(data.user_ids[0])
+        assert UserModel.verify_hash(password_for(user.id), user.password)
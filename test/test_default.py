@@ -1,6 +1,8 @@
 
 
-def test_default_route(client):
+def test_default_route(client, monkeypatch, tmp_path):
+    # the routes are listed by a `manage.py` subprocess, which creates its own app
+    monkeypatch.setenv('SQL_SLOW_QUERY_LOG', str(tmp_path / 'slow_queries.log'))
     response = client.get('/')
     assert response.status_code == 200
 
@@ -0,0 +1,63 @@
+import pytest
+
+from online_store.backend.facets import parse_price_buckets
+from online_store.backend.models.database import get_db
+
+FACETS = '/api/v1/store/items/facets'
+
+
+def counts(facet):
+    return {entry['value']: entry['count'] for entry in facet}
+
+
+def test_parse_price_buckets():
+    assert parse_price_buckets(' 50, 100.5,') == (50., 100.5)
+    assert parse_price_buckets([10, 20]) == (10., 20.) and parse_price_buckets('') == ()
+    for buckets in ('100,50', '50,50', 'nan', 'ten', ','.join(map(str, range(21)))):
+        with pytest.raises(ValueError):
+            parse_price_buckets(buckets)
+
+
+def test_facets(client):
+    body = client.get(FACETS).get_json()
+    assert body['filters'] == {} and body['total'] == 20
+    brands = body['facets']['brand']
+    assert brands[0] == {'value': 'GARDENSTORE', 'count': 3} and sum(counts(brands).values()) == 20
+    assert counts(body['facets']['currency']) == {'GBP': 20}
+    assert body['facets']['price'] == [
+        {'min': None, 'max': 50.0, 'count': 2}, {'min': 50.0, 'max': 100.0, 'count': 7},
+        {'min': 100.0, 'max': 250.0, 'count': 6}, {'min': 250.0, 'max': 500.0, 'count': 4},
+        {'min': 500.0, 'max': None, 'count': 1}]
+
+
+def test_facets_filters_and_buckets(client):
+    body = client.get(f'{FACETS}?brand=KITCHENAID&price_buckets=100').get_json()
+    assert body['filters'] == {'brand': 'KITCHENAID'} and body['total'] == 2
+    assert counts(body['facets']['brand']) == {'KITCHENAID': 2}
+    assert [bucket['count'] for bucket in body['facets']['price']] == [1, 1]
+
+    body = client.get(f'{FACETS}?brand=OKA&currency=USD').get_json()
+    assert body['total'] == 0 and body['facets']['brand'] == []
+    assert [bucket['count'] for bucket in body['facets']['price']] == [0] * 5
+
+
+@pytest.mark.parametrize('args', ['colour=red', 'price=cheap', 'price_buckets=100,50'])
+def test_facets_invalid(client, args):
+    response = client.get(f'{FACETS}?{args}')
+    assert response.status_code == 400
+    assert response.get_json()['status'] == 'error'
+
+
+def test_facets_cached(app, client, query_budget):
+    with query_budget(1):  # every facet is counted in one round trip
+        client.get(f'{FACETS}?currency=GBP')
+    with query_budget(0):
+        assert client.get(f'{FACETS}?currency=GBP').get_json()['total'] == 20
+    with app.app_context():  # e.g. by another worker
+        conn = get_db()
+        conn.execute("INSERT INTO items (id, name, brand, price, currency, in_stock_quantity) "
+                     "VALUES (22, 'Stand Fan', 'OKA', 30, 'GBP', 5)")
+        conn.commit()
+    body = client.get(f'{FACETS}?currency=GBP').get_json()
+    assert body['total'] == 21 and counts(body['facets']['brand'])['OKA'] == 2
+    assert body['facets']['price'][0]['count'] == 3
@@ -1,11 +1,20 @@
+import os
 import pytest
 import random
+import sys
+import threading
+import time
 
 from io import StringIO
 from contextlib import redirect_stdout
-from unittest.mock import Mock
 
-from online_store.backend.gift_list import AbstractGiftList, BasicGiftList
+from online_store.backend import columnar_gifts
+from online_store.backend.columnar_gifts import ColumnarGiftList
+from online_store.backend.gift_journal import JournaledGiftList
+from online_store.backend.gift_list import (
+    AbstractGiftList, BasicGiftList, ConcurrentGiftList, GiftListFactory
+)
+from online_store.backend.shared_gifts import SharedMemoryGiftList
 
 
 def test_AbstractGiftList__init__raises_TypeError():
@@ -55,9 +64,8 @@ def test_BasicGiftList__init__():
     assert isinstance(giftlist, BasicGiftList)
     assert giftlist.gift_list == []
     assert giftlist.user is 'test_user'
-    assert not giftlist._availability_map
-    assert not giftlist._purchase_map
-    assert giftlist._purchase_map[random.random()] == 0
+    assert len(giftlist) == 0
+    assert giftlist.get_quantities({'id': random.random()}) == (0, 0)
 
 
 @pytest.mark.parametrize('user', ['test_user', None, 1, -1, 0])
@@ -67,17 +75,14 @@ def test_BasicGiftList_get_user(user):
 
 
 def test_BasicGiftList_create_list():
-    mock_giftlist = Mock()
-    assert not isinstance(mock_giftlist.gift_list, list)
-    assert isinstance(BasicGiftList.create_list(mock_giftlist), list)
-    assert isinstance(mock_giftlist.gift_list, list)
-    assert mock_giftlist.gift_list == []
+    giftlist = BasicGiftList('test_user')
+    giftlist.add_item({'id': 1})
+    assert giftlist.gift_list == [{'id': 1}]
 
     # test list is reset on second call
-    mock_giftlist.gift_list = [1, 2, 3]
-    assert mock_giftlist.gift_list != []
-    BasicGiftList.create_list(mock_giftlist)
-    assert mock_giftlist.gift_list == []
+    assert giftlist.create_list() == []
+    assert giftlist.gift_list == []
+    assert giftlist.get_quantities({'id': 1}) == (0, 0)
 
 
 @pytest.mark.parametrize('item,error_cls,modified_list,available_quantity', [
@@ -93,21 +98,19 @@ def test_BasicGiftList_create_list():
 def test_BasicGiftList_add_item(item, error_cls, modified_list, available_quantity):
     basic_giftlist = BasicGiftList('test_user')
     assert basic_giftlist.gift_list == []
-    assert not basic_giftlist._availability_map
-    assert not basic_giftlist._purchase_map
 
     try:
         # test adding item
         basic_giftlist.add_item(item, available_quantity)
         assert basic_giftlist.gift_list == modified_list
-        quantity = basic_giftlist._availability_map[frozenset(item.items())]
+        quantity, purchased = basic_giftlist.get_quantities(item)
         assert quantity == available_quantity
-        assert not basic_giftlist._purchase_map  # should not be modified
+        assert purchased == 0  # should not be modified
 
         # attempt to add item twice
         basic_giftlist.add_item(item, available_quantity)
         assert basic_giftlist.gift_list == modified_list
-        quantity = basic_giftlist._availability_map[frozenset(item.items())]
+        quantity, _ = basic_giftlist.get_quantities(item)
         assert quantity == (2 * available_quantity)
     except AssertionError:
         raise
@@ -115,60 +118,59 @@ def test_BasicGiftList_add_item(item, error_cls, modified_list, available_quanti
         assert isinstance(err, error_cls)
 
 
-@pytest.mark.parametrize('gift_list', [None, {}, (1, 2, 3), 1.0])
-def test_BasicGiftList_get_list(gift_list):
-    mock_giftlist = Mock()
-    mock_giftlist.gift_list = gift_list
-    # test that the get_list() method simply returns the gift_list attribute
-    assert BasicGiftList.get_list(mock_giftlist) == mock_giftlist.gift_list
+def test_BasicGiftList_add_item_keys_items_by_id():
+    basic_giftlist = BasicGiftList('test_user')
+    basic_giftlist.add_item({'id': 1, 'name': 'Tea pot'})
+    basic_giftlist.add_item({'id': 1, 'name': 'Tea pot'}, 2)
+    basic_giftlist.add_item({'name': 'Tea pot'})
+    assert basic_giftlist.gift_list == [{'id': 1, 'name': 'Tea pot'}, {'name': 'Tea pot'}]
+    assert basic_giftlist.get_quantities({'id': 1}) == (3, 0)
 
 
 @pytest.mark.parametrize('gift_list,item,result,exception', [
-    ([None, 1], None, [1], None), 
     ([{'id': 1}, {'id': 2}], {'id': 2}, [{'id': 1}], None),
-    ([1, 2, 3], 1, [2, 3], None),
-    ([1, 2, 3], 4, [2, 3], ValueError),  # item not in list
-    ([2, 2, 2], 2, [2, 2], None),
-    ((1, 2), 2, (1, 2), AttributeError)  # gift_list is not a list
+    ([{'id': 1}, {'id': 2}, {'id': 3}], {'id': 1}, [{'id': 2}, {'id': 3}], None),
+    ([{}, {'id': 2}], {}, [{'id': 2}], None),
+    ([{'id': 1}, {'id': 2}], {'id': 4}, [{'id': 1}, {'id': 2}], ValueError),  # not in list
+    ([{'id': 1}], 1, [{'id': 1}], AttributeError)  # item should be a dict
 ])
 def test_BasicGiftList_remove_item(gift_list, item, result, exception):
-    mock_giftlist = Mock()
-    mock_giftlist.gift_list = gift_list
+    basic_giftlist = BasicGiftList('test_user')
+    for gift in gift_list:
+        basic_giftlist.add_item(gift)
     try:
-        BasicGiftList.remove_item(mock_giftlist, item)
-        assert mock_giftlist.gift_list == result
+        basic_giftlist.remove_item(item)
+        assert exception is None
     except AssertionError:
         raise
     except Exception as err:
         assert isinstance(err, exception)
+    assert basic_giftlist.gift_list == result
 
 
 @pytest.mark.parametrize(
     'gift_list,item,quantity_available,quantity_to_purchase,exception', [
-    ([{'id': 1}], {'id': 1}, 1, 1, None),
-    ([{'id': 1}], {'id': 1}, 0, 1, ValueError),  # not enough availability
-])
+        ([{'id': 1}], {'id': 1}, 1, 1, None),
+        ([{'id': 1}], {'id': 1}, 2, 3, ValueError),  # not enough availability
+        ([{'id': 1}], {'id': 1}, 2, 0, ValueError),  # quantity should be a +ve int
+        ([{'id': 1}], {'id': 2}, 1, 1, ValueError),  # not in list
+    ])
 def test_BasicGiftList_purchase_item(
     gift_list, item, quantity_available, quantity_to_purchase, exception):
     basic_giftlist = BasicGiftList('test_user')
+    for gift in gift_list:
+        basic_giftlist.add_item(gift, quantity_available)
     try:
-        key = frozenset(item.items())
-        assert not basic_giftlist.gift_list
-        basic_giftlist.gift_list = gift_list
-        assert basic_giftlist.gift_list == gift_list
-        assert not basic_giftlist._availability_map
-        basic_giftlist._availability_map[key] = quantity_available
-        assert basic_giftlist._availability_map[key] == quantity_available
-        assert basic_giftlist._purchase_map[key] == 0
         basic_giftlist.purchase_item(item, quantity_to_purchase)
-        assert basic_giftlist._availability_map[key] == \
-            quantity_available - quantity_to_purchase
-        assert basic_giftlist._purchase_map[key] == quantity_to_purchase
+        assert exception is None
+        assert basic_giftlist.get_quantities(item) == \
+            (quantity_available - quantity_to_purchase, quantity_to_purchase)
     except AssertionError:
         raise
     except Exception as err:
         if not isinstance(err, exception):
             raise  # recover traceback for debugging
+        assert basic_giftlist.get_quantities(gift_list[0]) == (quantity_available, 0)
 
 
 @pytest.mark.parametrize(
@@ -183,14 +185,11 @@ def test_BasicGiftList_create_report(
 ):
     basic_giftlist = BasicGiftList(user)
 
-    basic_giftlist.gift_list = gift_list
-    assert basic_giftlist.gift_list == gift_list
-
     # set availability and purchase amounts
-    for item, quantity in purchased_items:
-        basic_giftlist._purchase_map[frozenset(item.items())] = quantity
-    for item, quantity in available_items:
-        basic_giftlist._availability_map[frozenset(item.items())] = quantity
+    for (item, purchased), (_, available) in zip(purchased_items, available_items):
+        basic_giftlist.add_item(item, purchased + available)
+        basic_giftlist.purchase_item(item, purchased)
+    assert basic_giftlist.gift_list == gift_list
 
     with StringIO() as buf, redirect_stdout(buf):
         basic_giftlist.create_report()
@@ -209,3 +208,347 @@ def test_BasicGiftList_create_report(
                 assert item_line not in report
    
     assert user in report
+
+
+def test_giftbench_command():
+    from click.testing import CliRunner
+    from online_store.tools.giftbench import giftbench_command, run_giftbench
+
+    result = run_giftbench('basic', gifts=100)
+    assert set(result) == {'add', 'purchase', 'report', 'remove', 'bytes_per_gift'}
+    result = CliRunner().invoke(giftbench_command, ['--gifts', '50', '--threads', '2'])
+    assert result.exit_code == 0, result.output
+    assert 'basic' in result.output and 'global' in result.output
+
+
+@pytest.fixture
+def switch_often():
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)  # make races between threads likely
+    yield
+    sys.setswitchinterval(interval)
+
+
+@pytest.mark.parametrize('stripes', [64, 1])
+def test_ConcurrentGiftList_never_oversells(switch_often, stripes):
+    gift_list = ConcurrentGiftList('test_user', stripes=stripes)
+    items = [{'id': item_id} for item_id in range(1, 5)]
+    for item in items:
+        gift_list.add_item(item, 500)
+    sold = []
+
+    def buy():
+        count = 0
+        for _ in range(400):
+            for item in items:
+                try:
+                    gift_list.purchase_item(item)
+                    count += 1
+                except ValueError:
+                    pass
+        sold.append(count)
+
+    threads = [threading.Thread(target=buy) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sum(sold) == 2000
+    assert [gift_list.get_quantities(item) for item in items] == [(0, 500)] * 4
+
+
+def test_ConcurrentGiftList_is_registered():
+    gift_list = GiftListFactory.CLASSES['concurrent']('test_user')
+    assert isinstance(gift_list, ConcurrentGiftList)
+    gift_list.add_item({'id': 1}, 2)
+    gift_list.purchase_item({'id': 1})
+    assert gift_list.get_list() == [{'id': 1}]
+    gift_list.remove_item({'id': 1})
+    assert len(gift_list) == 0
+
+
+def test_run_contention():
+    from online_store.tools.giftbench import run_contention
+
+    for locking in ('striped', 'journal'):
+        result = run_contention(locking, threads=4, gifts=20, quantity=5)
+        assert result['sold'] == 100 and result['oversold'] == 0
+
+
+@pytest.fixture(params=['array', 'numpy'])
+def columnar_backend(request, monkeypatch):
+    if request.param == 'numpy':
+        pytest.importorskip('numpy')
+    else:
+        monkeypatch.setattr(columnar_gifts, 'numpy', None)
+    return request.param
+
+
+def _columnar_and_basic():
+    gift_lists = ColumnarGiftList('test_user'), BasicGiftList('test_user')
+    for gift_list in gift_lists:
+        for item_id in range(1, 6):
+            gift_list.add_item({'id': item_id, 'price': 2.5}, item_id)
+        gift_list.purchase_item({'id': 2}, 2)
+        gift_list.purchase_item({'id': 3})
+        gift_list.remove_item({'id': 1})
+    return gift_lists
+
+
+def test_ColumnarGiftList_matches_BasicGiftList(columnar_backend):
+    columnar, basic = _columnar_and_basic()
+    assert len(columnar) == 4
+    # the last gift is moved into the slot of a removed gift
+    assert columnar.get_list() == [{'id': 5, 'price': 2.5}] + basic.get_list()[:-1]
+    for item in basic.get_list():
+        assert columnar.get_quantities(item) == basic.get_quantities(item)
+
+    reports = []
+    for gift_list in (columnar, basic):
+        with StringIO() as buf, redirect_stdout(buf):
+            gift_list.create_report()
+            reports.append(sorted(buf.getvalue().splitlines()))
+    assert reports[0] == reports[1]
+
+
+def test_ColumnarGiftList_totals(columnar_backend):
+    columnar, _ = _columnar_and_basic()
+    assert columnar.totals() == {
+        'total_desired': 14, 'total_purchased': 3, 'value_purchased': 7.5,
+        'value_outstanding': 27.5, 'unpurchased': 2, 'partially_purchased': 1,
+        'fully_purchased': 1}
+    assert columnar.create_list() == []
+    assert columnar.totals()['total_desired'] == 0
+
+
+@pytest.mark.parametrize('item,quantity', [
+    ({'name': 'Tea pot'}, 1),  # items must have an integer id
+    ({'id': '1'}, 1),
+    ({'id': 1}, 0),  # quantity should be a +ve int
+])
+def test_ColumnarGiftList_add_item_raises_ValueError(item, quantity):
+    with pytest.raises(ValueError):
+        ColumnarGiftList('test_user').add_item(item, quantity)
+
+
+def test_ColumnarGiftList_purchase_item_raises_ValueError():
+    columnar = GiftListFactory.CLASSES['columnar']('test_user')
+    columnar.add_item({'id': 1}, 2)
+    with pytest.raises(ValueError):
+        columnar.purchase_item({'id': 1}, 3)
+    with pytest.raises(ValueError):
+        columnar.purchase_item({'id': 2})
+    with pytest.raises(ValueError):
+        columnar.remove_item({'id': 2})
+    assert columnar.get_quantities({'id': 1}) == (2, 0)
+
+
+def test_ColumnarGiftList_resolves_items(app):
+    columnar = ColumnarGiftList('test_user')
+    for item_id in (1, 2, 999):  # no item 999 in the store
+        columnar.add_item({'id': item_id, 'name': 'Not kept', 'price': 5.0})
+    columnar.purchase_item({'id': 2})
+    with app.app_context():
+        items = columnar.get_list()
+        assert [item['id'] for item in items] == [1, 2, 999]
+        assert items[0]['name'] == 'Tea pot' and items[1]['brand'] == 'Le Creuset'
+        with StringIO() as buf, redirect_stdout(buf):
+            columnar.create_report()
+            assert 'Tea pot' in buf.getvalue()
+    assert items[2] == {'id': 999, 'price': 5.0}
+
+    resolved = []
+    columnar = ColumnarGiftList('test_user', resolve=lambda ids: resolved.extend(ids) or {})
+    columnar.add_item({'id': 7, 'price': 1})
+    assert columnar.get_list() == [{'id': 7, 'price': 1.0}] and resolved == [7]
+
+
+def _journaled_changes(gift_list):
+    for item_id in range(1, 4):
+        gift_list.add_item({'id': item_id, 'name': f'Gift {item_id}'}, 3)
+    gift_list.purchase_item({'id': 1}, 2)
+    gift_list.remove_item({'id': 2})
+    gift_list.add_item({'id': 3, 'name': 'Gift 3'})
+    gift_list.purchase_item({'id': 3})
+
+
+@pytest.mark.parametrize('snapshot_every', [1, 4, 1000])
+def test_JournaledGiftList_recovers(tmp_path, snapshot_every):
+    gift_list = JournaledGiftList('test_user', directory=str(tmp_path),
+                                  snapshot_every=snapshot_every)
+    _journaled_changes(gift_list)
+    gift_list.close()
+
+    recovered = JournaledGiftList('test_user', directory=str(tmp_path))
+    assert recovered.get_list() == [{'id': 1, 'name': 'Gift 1'}, {'id': 3, 'name': 'Gift 3'}]
+    assert recovered.get_quantities({'id': 1}) == (1, 2)
+    assert recovered.get_quantities({'id': 3}) == (3, 1)
+    assert recovered.create_list() == []
+    recovered.close()
+    assert JournaledGiftList('test_user', directory=str(tmp_path)).get_list() == []
+
+
+def test_JournaledGiftList_compacts(tmp_path):
+    gift_list = JournaledGiftList('a/b', directory=str(tmp_path), snapshot_every=4)
+    _journaled_changes(gift_list)  # 7 changes, the last 3 after the snapshot
+    assert sorted(os.listdir(tmp_path)) == ['a%2Fb.1.journal', 'a%2Fb.snapshot']
+    assert len((tmp_path / 'a%2Fb.1.journal').read_text().splitlines()) == 3
+    gift_list.compact()
+    assert (tmp_path / 'a%2Fb.2.journal').read_text() == ''
+    gift_list.close()
+
+
+def test_JournaledGiftList_discards_torn_record(tmp_path):
+    gift_list = JournaledGiftList('test_user', directory=str(tmp_path))
+    _journaled_changes(gift_list)
+    gift_list.close()
+    journal = tmp_path / 'test_user.0.journal'
+    complete = journal.read_text()
+    with open(journal, 'a') as journal_fp:
+        journal_fp.write('["p",{"id":3}')  # crashed whilst writing
+
+    recovered = JournaledGiftList('test_user', directory=str(tmp_path))
+    assert recovered.get_quantities({'id': 3}) == (3, 1)
+    recovered.purchase_item({'id': 3})
+    recovered.close()
+    assert journal.read_text() == complete + '["p",{"id":3},1]\n'
+
+
+def test_JournaledGiftList_recovers_crash_whilst_compacting(tmp_path):
+    gift_list = JournaledGiftList('test_user', directory=str(tmp_path))
+    _journaled_changes(gift_list)
+    stale = (tmp_path / 'test_user.0.journal').read_text()
+    gift_list.compact()
+    gift_list.close()
+    # the snapshot replaced, but the previous journal not yet removed
+    (tmp_path / 'test_user.0.journal').write_text(stale)
+
+    recovered = JournaledGiftList('test_user', directory=str(tmp_path))
+    assert recovered.get_quantities({'id': 1}) == (1, 2)
+    assert not (tmp_path / 'test_user.0.journal').exists()
+    recovered.close()
+
+
+def test_JournaledGiftList_fsyncs_concurrent_changes_together(tmp_path, monkeypatch):
+    from online_store.backend.gift_journal import GIFT_JOURNAL_FSYNCS, GIFT_JOURNAL_RECORDS
+
+    monkeypatch.setenv('GIFT_JOURNAL_DIR', str(tmp_path))
+    gift_list = GiftListFactory.CLASSES['journal']('test_user')
+    items = [{'id': item_id} for item_id in range(1, 9)]
+    for item in items:
+        gift_list.add_item(item, 50)
+    fsyncs, records = GIFT_JOURNAL_FSYNCS.get(), GIFT_JOURNAL_RECORDS.get()
+    fsync = os.fsync
+
+    def slow_fsync(fd):  # so that other threads append whilst waiting for the disk
+        time.sleep(0.002)
+        fsync(fd)
+
+    monkeypatch.setattr(os, 'fsync', slow_fsync)
+
+    def buy(item):
+        for _ in range(50):
+            gift_list.purchase_item(item)
+
+    threads = [threading.Thread(target=buy, args=(item,)) for item in items]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert GIFT_JOURNAL_RECORDS.get() - records == 400
+    assert GIFT_JOURNAL_FSYNCS.get() - fsyncs < 400  # shared by concurrent purchases
+    gift_list.close()
+
+    recovered = JournaledGiftList('test_user', directory=str(tmp_path))
+    assert [recovered.get_quantities(item) for item in items] == [(0, 50)] * 8
+    recovered.close()
+
+
+@pytest.fixture
+def shared_name():
+    pytest.importorskip('multiprocessing.shared_memory')
+    pytest.importorskip('fcntl')
+    name = f'gifts_test_{os.getpid()}'
+    yield name
+    # remove the list, should a test fail before doing so
+    gift_list = SharedMemoryGiftList('test_user', name=name)
+    gift_list.close()
+    gift_list.unlink()
+
+
+def test_SharedMemoryGiftList_is_shared(shared_name):
+    gift_list = SharedMemoryGiftList('test_user', name=shared_name, capacity=8)
+    other = GiftListFactory.CLASSES['shared']('test_user', name=shared_name)
+    assert other._table.capacity == 8  # set by the list's creator
+    for item_id in (3, 11, 19):  # every item collides
+        gift_list.add_item({'id': item_id, 'name': f'Gift {item_id}'}, 2)
+    other.purchase_item({'id': 11})
+    gift_list.remove_item({'id': 3})
+    other.add_item({'id': 27}, 1)
+    assert gift_list.get_list() == [{'id': 11, 'name': 'Gift 11'},
+                                    {'id': 19, 'name': 'Gift 19'}, {'id': 27}]
+    assert gift_list.get_quantities({'id': 11}) == (1, 1)
+    assert len(other) == 3
+
+    with pytest.raises(ValueError):
+        other.purchase_item({'id': 11}, 2)
+    with pytest.raises(ValueError):
+        other.remove_item({'id': 3})
+    with pytest.raises(ValueError):
+        gift_list.add_item({'id': 1, 'name': 'x' * 300})  # too long as JSON
+
+    with StringIO() as buf, redirect_stdout(buf):
+        other.create_report()
+        report = buf.getvalue()
+    assert "{'id': 11, 'name': 'Gift 11'} (quantity: 1)" in report
+    assert other.create_list() == [] and gift_list.get_list() == []
+    other.close()
+    gift_list.close()
+
+
+def test_SharedMemoryGiftList_full(shared_name):
+    gift_list = SharedMemoryGiftList('test_user', name=shared_name, capacity=4)
+    for item_id in range(4):
+        gift_list.add_item({'id': item_id})
+    with pytest.raises(ValueError):
+        gift_list.add_item({'id': 4})
+    gift_list.remove_item({'id': 0})
+    gift_list.add_item({'id': 4})  # reuses the removed gift's slot
+    assert [item['id'] for item in gift_list.get_list()] == [1, 2, 3, 4]
+    gift_list.close()
+
+
+def _buy_shared(name, items, sold):
+    gift_list = SharedMemoryGiftList('test_user', name=name)
+    count = 0
+    for _ in range(100):
+        for item in items:
+            try:
+                gift_list.purchase_item(item)
+                count += 1
+            except ValueError:
+                pass
+    gift_list.close()
+    sold.put(count)
+
+
+def test_SharedMemoryGiftList_never_oversells_across_processes(shared_name):
+    import multiprocessing
+
+    if 'fork' not in multiprocessing.get_all_start_methods():
+        pytest.skip('requires forking processes')
+    context = multiprocessing.get_context('fork')
+    gift_list = SharedMemoryGiftList('test_user', name=shared_name)
+    items = [{'id': item_id} for item_id in range(1, 5)]
+    for item in items:
+        gift_list.add_item(item, 150)
+    sold = context.Queue()
+    processes = [context.Process(target=_buy_shared, args=(shared_name, items, sold))
+                 for _ in range(4)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+    assert sum(sold.get() for _ in processes) == 600
+    assert [gift_list.get_quantities(item) for item in items] == [(0, 150)] * 4
+    gift_list.close()
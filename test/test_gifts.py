@@ -1,6 +1,14 @@
-import pytest
+import csv
+import io
 import json
 
+import pytest
+
+from online_store.backend.gift_list import SqlDatabaseGiftList
+from online_store.backend.models.database import db
+from online_store.backend.models.gift import GiftListSummaryModel
+from online_store.backend.models.user import UserRole
+
 
 def test_list_get(client, test_auth_headers):
     response = client.get('/api/v1/gifts/list',
@@ -56,3 +64,85 @@ def test_protected_endpoint(client, test_auth_headers,
     response = request(endpoint, headers=test_auth_headers if has_auth else {},
                        data=data, mimetype='application/json')
     assert response.status_code == code
+
+
+def _prices(client, *item_ids):
+    return {item_id: client.get(f'/api/v1/store/items/id/{item_id}').get_json()['price']
+            for item_id in item_ids}
+
+
+def test_list_summary_maintained(app, client, test_auth_headers):
+    price = _prices(client, 1, 2)
+    client.post('/api/v1/gifts/list/add?item_id=1&quantity=3', headers=test_auth_headers)
+    client.post('/api/v1/gifts/list/add?item_id=2&quantity=1', headers=test_auth_headers)
+    gifts = client.get('/api/v1/gifts/list', headers=test_auth_headers).get_json()
+    client.post(f'/api/v1/gifts/list/{gifts[0]["id"]}/purchase?quantity=2',
+                headers=test_auth_headers)
+    client.post(f'/api/v1/gifts/list/{gifts[1]["id"]}/purchase', headers=test_auth_headers)
+
+    summary = client.get('/api/v1/gifts/list/summary', headers=test_auth_headers).get_json()
+    assert summary == pytest.approx({
+        'list_id': 2, 'gifts': 2, 'total_desired': 4, 'total_purchased': 3,
+        'value_purchased': 2 * price[1] + price[2], 'value_outstanding': price[1],
+        'unpurchased': 0, 'partially_purchased': 1, 'fully_purchased': 1, 'progress': 0.75})
+    report = client.get('/api/v1/gifts/list/report', headers=test_auth_headers).get_json()
+    assert report['summary'] == summary
+
+    client.delete(f'/api/v1/gifts/list/{gifts[1]["id"]}', headers=test_auth_headers)
+    with app.app_context():
+        stored = GiftListSummaryModel.query.get(2).as_dict()
+        assert stored == pytest.approx(SqlDatabaseGiftList.build_summary(2).as_dict())
+        assert stored['fully_purchased'] == 0 and stored['total_purchased'] == 2
+
+
+def test_list_summary_query_budget(client, query_budget, test_auth_headers):
+    client.post('/api/v1/gifts/list/add?item_id=1', headers=test_auth_headers)
+    with query_budget(4):  # user (twice), gift list and summary, regardless of size
+        response = client.get('/api/v1/gifts/list/summary', headers=test_auth_headers)
+    assert response.get_json()['total_desired'] == 1
+
+
+@pytest.fixture
+def report_gifts(client, test_auth_headers):
+    client.post('/api/v1/gifts/list/add?item_id=1&quantity=3', headers=test_auth_headers)
+    client.post('/api/v1/gifts/list/add?item_id=2', headers=test_auth_headers)
+    gifts = client.get('/api/v1/gifts/list', headers=test_auth_headers).get_json()
+    client.post(f'/api/v1/gifts/list/{gifts[0]["id"]}/purchase', headers=test_auth_headers)
+    return gifts
+
+
+def test_list_report_csv(client, test_auth_headers, report_gifts):
+    response = client.get('/api/v1/gifts/list/report?format=csv', headers=test_auth_headers)
+    assert response.status_code == 200
+    assert response.is_streamed and response.mimetype == 'text/csv'
+    rows = list(csv.DictReader(io.StringIO(response.get_data(as_text=True))))
+    assert [(row['gift_id'], row['status'], row['quantity']) for row in rows] == [
+        (str(report_gifts[0]['id']), 'purchased', '1'),
+        (str(report_gifts[0]['id']), 'available', '2'),
+        (str(report_gifts[1]['id']), 'available', '1')]
+    assert {row['list_id'] for row in rows} == {'2'}
+
+
+def test_list_report_ndjson(client, test_auth_headers, report_gifts):
+    response = client.get('/api/v1/gifts/list/report?format=ndjson', headers=test_auth_headers)
+    assert response.mimetype == 'application/x-ndjson'
+    rows = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    assert len(rows) == 3 and rows[0]['name'] and rows[0]['user_id'] == 1
+
+
+def test_list_report_all_lists(app, client, test_auth_headers, report_gifts):
+    url = '/api/v1/gifts/list/report?format=ndjson&scope=all'
+    assert client.get(url, headers=test_auth_headers).status_code == 403
+    with app.app_context():
+        db.session.execute(f'UPDATE users SET role = {int(UserRole.ADMIN)} WHERE id = 1')
+        db.session.commit()
+    response = client.get(url, headers=test_auth_headers)
+    rows = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    assert {row['list_id'] for row in rows} == {1, 2}
+    assert client.get('/api/v1/gifts/list/report?scope=all',
+                      headers=test_auth_headers).status_code == 400
+
+
+def test_list_report_unsupported_format(client, test_auth_headers):
+    response = client.get('/api/v1/gifts/list/report?format=xml', headers=test_auth_headers)
+    assert response.status_code == 400
@@ -0,0 +1,50 @@
+import pytest
+
+from click.testing import CliRunner
+from online_store.tools.importtime import (
+    import_time_command, parse_importtime, profile_import, total_import_time
+)
+
+IMPORTTIME_OUTPUT = """\
+import time: self [us] | cumulative | imported package
+import time:       120 |        120 |   _io
+import time:       300 |        450 | encodings
+import time:        50 |         50 |     json.decoder
+import time:       200 |        250 |   json
+import time:       100 |        350 | online_store.app
+"""
+
+
+def test_parse_importtime():
+    timings = parse_importtime(IMPORTTIME_OUTPUT)
+    assert [t.module for t in timings] == \
+        ['_io', 'encodings', 'json.decoder', 'json', 'online_store.app']
+    assert [t.depth for t in timings] == [1, 0, 2, 1, 0]
+    assert timings[-1].self_us == 100
+    assert timings[-1].cumulative_us == 350
+    assert total_import_time(timings, 'online_store.app') == 350
+    assert total_import_time(timings, 'missing') == 0
+
+
+@pytest.mark.parametrize('module,lazy_modules', [
+    ('online_store.app', ['flasgger', 'flask_cors', 'passlib', 'sqlalchemy',
+                          'online_store.backend.routes.store']),
+    ('online_store.backend.models.user', ['passlib']),
+    ('manage', ['sqlalchemy', 'online_store.backend.models.database']),
+])
+def test_profile_import_is_lazy(module, lazy_modules):
+    imported = {timing.module for timing in profile_import(module)}
+    assert module in imported
+    for lazy_module in lazy_modules:
+        assert lazy_module not in imported
+
+
+def test_import_time_command_budget():
+    runner = CliRunner()
+    result = runner.invoke(import_time_command, ['--budget-ms', '100000', '--repeat', '1'])
+    assert result.exit_code == 0
+    assert 'online_store.app' in result.output
+
+    result = runner.invoke(import_time_command, ['--budget-ms', '0', '--repeat', '1'])
+    assert result.exit_code != 0
+    assert 'exceeds budget' in result.output
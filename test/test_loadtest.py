@@ -0,0 +1,94 @@
+import threading
+
+import pytest
+
+from click.testing import CliRunner
+from werkzeug.serving import make_server
+
+from online_store.tools.loadtest import (
+    LoadStats, loadtest_command, parse_mix, reconcile, run_loadtest
+)
+
+
+@pytest.fixture
+def server_url(app, client, test_auth_headers):
+    for item_id, quantity in ((1, 3), (2, 50)):
+        response = client.post(f'/api/v1/gifts/list/add?item_id={item_id}&quantity={quantity}',
+                               headers=test_auth_headers)
+        assert response.status_code == 200
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f'http://127.0.0.1:{server.server_port}'
+    server.shutdown()
+    thread.join()
+
+
+def test_parse_mix():
+    assert parse_mix('browse=40, purchase=60') == {'browse': 40, 'purchase': 60}
+    with pytest.raises(ValueError):
+        parse_mix('checkout=1')
+    with pytest.raises(ValueError):
+        parse_mix('browse=0')
+
+
+def test_LoadStats_summary():
+    stats = LoadStats()
+    for latency in (0.01, 0.02, 0.03):
+        stats.record('purchase', latency, gift_id=1)
+    stats.record('purchase', 0.04, error='HTTP 500')
+    summary = stats.summary(elapsed=2.)
+    assert summary['purchase']['requests'] == 4
+    assert summary['purchase']['errors'] == 1
+    assert summary['purchase']['throughput_rps'] == 2.
+    assert summary['purchase']['p95_ms'] == 40.
+    assert stats.purchases == {1: 3}
+
+
+def test_reconcile():
+    before = {'gifts': {1: {'item_id': 10, 'available': 2, 'purchased': 0},
+                        2: {'item_id': 10, 'available': 1, 'purchased': 0}},
+              'stock': {10: 5}}
+    after = {'gifts': {1: {'item_id': 10, 'available': 0, 'purchased': 2},
+                       2: {'item_id': 10, 'available': 0, 'purchased': 1}},
+             'stock': {10: 2}}
+    assert reconcile(before, after, {1: 2, 2: 1}) == []
+
+    after['stock'] = {10: 3}  # e.g. a purchase recorded without taking stock
+    assert reconcile(before, after, {1: 2, 2: 1}) == \
+        ['item 10: 3 purchases acknowledged, but stock fell by 2']
+
+    after = {'gifts': {1: {'item_id': 10, 'available': -1, 'purchased': 2},
+                       2: {'item_id': 10, 'available': 1, 'purchased': 0}},
+             'stock': {10: -1}}
+    issues = reconcile(before, after, {1: 3})
+    assert any('oversold' in issue for issue in issues)
+    assert any('lost updates' in issue for issue in issues)
+    assert any('negative stock' in issue for issue in issues)
+    assert any('stock fell by 6' in issue for issue in issues)
+
+
+@pytest.mark.parametrize('users', [1, 8])
+def test_run_loadtest(server_url, users):
+    result = run_loadtest(server_url, 'test', 'test', users=users, max_requests=80,
+                          mix='browse=1,purchase=6,report=1', hot_gifts=2)
+    summary = result['summary']
+    assert sum(stats['requests'] for stats in summary.values()) == 80
+    assert summary['login']['requests'] == users
+    assert sum(result['purchases'].values()) > 0
+    # purchases beyond the 3 available of item 1 are rejected, not oversold,
+    # including those of concurrent users
+    assert result['issues'] == []
+
+
+def test_loadtest_command(server_url):
+    result = CliRunner().invoke(loadtest_command, [
+        '--url', server_url, '-u', 'test', '-p', 'test', '-c', '4', '-n', '40'])
+    assert result.exit_code == 0, result.output
+    assert 'requests from 4 virtual users' in result.output
+    assert 'Reconciliation OK' in result.output
+
+    result = CliRunner().invoke(loadtest_command, [
+        '--url', server_url, '-u', 'test', '-p', 'wrong', '-n', '1'])
+    assert result.exit_code != 0
+    assert 'unable to log in' in result.output
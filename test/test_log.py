@@ -0,0 +1,99 @@
+import json
+import threading
+
+import pytest
+
+from loguru import logger
+from online_store.backend.utils.log import (
+    BoundedQueueWriter, LevelSampler, QueuedSink, RotatingFileWriter,
+    add_file_sink, get_log_stats, parse_sample_rates, parse_size,
+    remove_file_sink
+)
+
+
+@pytest.mark.parametrize('size,expected', [
+    (10, 10), ('10', 10), ('1KB', 1024), ('10MB', 10 * 1024 ** 2), ('0.5 GB', 1024 ** 3 // 2)
+])
+def test_parse_size(size, expected):
+    assert parse_size(size) == expected
+
+
+@pytest.mark.parametrize('rates,expected', [
+    (None, {}), ('', {}), ('DEBUG=100', {'DEBUG': 100}),
+    ('debug=100, INFO=10', {'DEBUG': 100, 'INFO': 10}), ({'info': '2'}, {'INFO': 2})
+])
+def test_parse_sample_rates(rates, expected):
+    assert parse_sample_rates(rates) == expected
+
+
+def test_LevelSampler():
+    messages = []
+    sampler = LevelSampler({'DEBUG': 5})
+    handler_id = logger.add(messages.append, format='{message}', filter=sampler)
+    try:
+        for i in range(10):
+            logger.debug('hot {}', i)
+            logger.info('cold {}', i)
+    finally:
+        logger.remove(handler_id)
+    assert [m.strip() for m in messages if 'hot' in m] == ['hot 0', 'hot 5']
+    assert len([m for m in messages if 'cold' in m]) == 10
+    assert sampler.sampled_out == 8
+
+
+def test_BoundedQueueWriter_drops_when_full():
+    release = threading.Event()
+    written = []
+
+    def slow_write(item):
+        release.wait(5)
+        written.append(item)
+
+    writer = BoundedQueueWriter(slow_write, maxsize=2)
+    results = [writer.put(i) for i in range(10)]
+    assert not all(results)  # never blocks, instead drops items
+    assert writer.dropped == results.count(False)
+    release.set()
+    writer.close()
+    assert len(written) == results.count(True)
+    assert writer.written == len(written)
+
+
+def test_QueuedSink_json(tmp_path):
+    logfile = tmp_path / 'app.log'
+    sink = QueuedSink(logfile, serialize=True)
+    handler_id = logger.add(sink, format='{message}')
+    try:
+        logger.bind(request_id='abc').info('hello {}', 'world')
+    finally:
+        logger.remove(handler_id)
+        sink.close()
+    record = json.loads(logfile.read_text().strip())
+    assert record['message'] == 'hello world'
+    assert record['level'] == 'INFO'
+    assert record['extra'] == {'request_id': 'abc'}
+    assert sink.stats['written'] == 1
+    assert sink.stats['dropped'] == 0
+
+
+def test_RotatingFileWriter(tmp_path):
+    writer = RotatingFileWriter(tmp_path / 'rotating.log', rotation=100)
+    for _ in range(5):
+        writer.write('x' * 60 + '\n')
+    writer.close()
+    assert len(list(tmp_path.glob('rotating.*.log.zip'))) == 4
+    assert (tmp_path / 'rotating.log').stat().st_size == 61
+
+
+@pytest.mark.parametrize('enqueue', [False, True])
+def test_add_file_sink_replaces_existing(tmp_path, enqueue):
+    logfile = tmp_path / 'replaced.log'
+    first_id = add_file_sink(logfile, enqueue=enqueue, serialize=True)
+    second_id = add_file_sink(logfile, enqueue=enqueue, serialize=True)
+    assert first_id != second_id
+    logger.info('written once')
+    assert str(logfile) in get_log_stats()
+    remove_file_sink(logfile)
+    assert str(logfile) not in get_log_stats()
+    lines = [line for line in logfile.read_text().splitlines() if 'written once' in line]
+    assert len(lines) == 1
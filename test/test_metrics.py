@@ -0,0 +1,93 @@
+import pytest
+
+from online_store.backend.gift_list import BasicGiftList, SqlDatabaseGiftList
+from online_store.backend.models.gift import GiftModel
+from online_store.backend.utils.metrics import (
+    CONTENT_TYPE, GIFT_OVERSELL_REJECTIONS, GIFT_PURCHASES, REQUEST_IN_FLIGHT,
+    REQUEST_LATENCY, Counter, Gauge, Histogram, MetricsRegistry, render_metrics
+)
+
+
+def test_Counter_render():
+    counter = Counter('things_total', 'Number of things.', ['kind'])
+    counter.inc('a')
+    counter.inc('a', amount=2)
+    counter.inc('b "quoted"')
+    assert counter.get('a') == 3
+    assert counter.render().splitlines() == [
+        '# HELP things_total Number of things.',
+        '# TYPE things_total counter',
+        'things_total{kind="a"} 3.0',
+        'things_total{kind="b \\"quoted\\""} 1.0',
+    ]
+
+
+def test_Gauge_callback():
+    gauge = Gauge('level', 'Current level.', ['name'], callback=lambda: {('x',): 7})
+    assert 'level{name="x"} 7.0' in gauge.render()
+
+
+def test_Histogram_render():
+    histogram = Histogram('latency_seconds', 'Latency.', buckets=(0.1, 1))
+    for value in (0.05, 0.1, 0.5, 2):
+        histogram.observe(value)
+    assert histogram.get_count() == 4
+    lines = histogram.render().splitlines()[2:]
+    assert lines == [
+        'latency_seconds_bucket{le="0.1"} 2.0',
+        'latency_seconds_bucket{le="1"} 3.0',
+        'latency_seconds_bucket{le="+Inf"} 4.0',
+        'latency_seconds_sum 2.65',
+        'latency_seconds_count 4.0',
+    ]
+
+
+def test_render_metrics_registry():
+    registry = MetricsRegistry([Counter('a_total', 'A.'), Counter('b_total', 'B.')])
+    text = render_metrics(registry)
+    assert text.endswith('\n')
+    assert '# TYPE a_total counter' in text
+    assert '# TYPE b_total counter' in text
+
+
+def test_metrics_endpoint(client):
+    before = REQUEST_LATENCY.get_count('store.items', 'GET', 200)
+    response = client.get('/api/v1/store/items')
+    assert response.status_code == 200
+    assert REQUEST_LATENCY.get_count('store.items', 'GET', 200) == before + 1
+    assert REQUEST_IN_FLIGHT.get('store.items') == 0
+
+    response = client.get('/metrics')
+    assert response.status_code == 200
+    assert response.content_type == CONTENT_TYPE
+    body = response.get_data(as_text=True)
+    assert 'http_request_duration_seconds_bucket{endpoint="store.items",method="GET",' \
+           'status="200",le="+Inf"}' in body
+    assert 'http_response_size_bytes_count{endpoint="store.items"}' in body
+    assert '# TYPE gift_purchases_total counter' in body
+
+
+def test_gift_purchase_counters(app):
+    purchases = GIFT_PURCHASES.get('sql')
+    rejections = GIFT_OVERSELL_REJECTIONS.get('sql')
+    with app.app_context():
+        gift = GiftModel.query.get(2)
+        gift_list = SqlDatabaseGiftList.__new__(SqlDatabaseGiftList)
+        gift_list.purchase_item(gift, 1)
+        assert GIFT_PURCHASES.get('sql') == purchases + 1
+        assert GiftModel.query.get(2).purchased == 1
+        with pytest.raises(ValueError):
+            gift_list.purchase_item(gift, 100)
+        assert GIFT_OVERSELL_REJECTIONS.get('sql') == rejections + 1
+
+
+def test_basic_gift_purchase_counters():
+    purchases = GIFT_PURCHASES.get('basic')
+    rejections = GIFT_OVERSELL_REJECTIONS.get('basic')
+    gift_list = BasicGiftList('test_user')
+    gift_list.add_item({'id': 1})
+    gift_list.purchase_item({'id': 1})
+    with pytest.raises(ValueError):
+        gift_list.purchase_item({'id': 1})
+    assert GIFT_PURCHASES.get('basic') == purchases + 1
+    assert GIFT_OVERSELL_REJECTIONS.get('basic') == rejections + 1
@@ -0,0 +1,100 @@
+import pytest
+
+from online_store.app import create_app
+from online_store.backend.models.database import get_db
+from online_store.backend.search import match_expression, search_terms
+
+SEARCH = '/api/v1/store/items/search'
+
+
+@pytest.fixture(params=[True, False], ids=['fts', 'like'])
+def search_client(app, request):
+    """A client of the `app` database, searching with FTS5 or LIKE."""
+    search_app = create_app(config={
+        'TESTING': True,
+        'DATABASE': app.config['DATABASE'],
+        'SQLALCHEMY_DATABASE_URI': app.config['SQLALCHEMY_DATABASE_URI'],
+        'SQLALCHEMY_TRACK_MODIFICATIONS': False,
+        'SEARCH_FTS': request.param,
+        'SQL_SLOW_QUERY_LOG': app.config['SQL_SLOW_QUERY_LOG'],
+    })
+    assert search_app.extensions['item_search'].fts is request.param
+    return search_app.test_client()
+
+
+def test_search_terms():
+    assert search_terms('  Le-Creuset "NEAR" 50\'s_mixer*') == \
+        ['Le', 'Creuset', 'NEAR', '50', 's', 'mixer']
+    assert match_expression(['le', 'cre']) == '"le"* "cre"*'
+    assert search_terms('%_*') == []
+
+
+def test_search_prefixes(search_client):
+    response = search_client.get(f'{SEARCH}?q=stand+MIX')
+    assert response.status_code == 200
+    found = response.get_json()['items']
+    assert sorted(item['id'] for item in found) == [6, 7, 8]
+    assert all('<mark>Stand</mark> <mark>Mix' in item['highlight']['name'] for item in found)
+
+    found = search_client.get(f'{SEARCH}?q=graham+sea').get_json()['items']
+    assert [item['id'] for item in found] == [19]
+    # highlights are escaped, as names and brands are not HTML
+    assert found[0]['highlight']['brand'] == '<mark>GRAHAM</mark> &amp; GREEN'
+    assert found[0]['name'] == 'Sea Green Honeycomb Glass Lamp'
+    assert search_client.get(f'{SEARCH}?q=zebra').get_json()['items'] == []
+
+
+def test_search_ranking(client):
+    found = client.get(f'{SEARCH}?q=white').get_json()['items']
+    # names are weighted above brands
+    assert found[-1]['id'] == 16 and found[-1]['highlight']['name'] == 'Ceramic Bottle Lamp, Small'
+    scores = [item['score'] for item in found]
+    assert scores == sorted(scores)
+
+
+def test_search_pagination(client):
+    pages = []
+    next_page = 1
+    while next_page is not None:
+        body = client.get(f'{SEARCH}?q=lamp&per_page=2&page={next_page}').get_json()
+        assert body['page'] == next_page and len(body['items']) <= 2
+        pages.append([item['id'] for item in body['items']])
+        next_page = body['next_page']
+    assert len(pages) == 3
+    assert sorted(sum(pages, [])) == [16, 17, 18, 19, 20]
+
+
+@pytest.mark.parametrize('args', ['', 'q=+', 'q=lamp&page=0', 'q=lamp&per_page=101',
+                                  'q=lamp&page=two'])
+def test_search_invalid(client, args):
+    response = client.get(f'{SEARCH}?{args}')
+    assert response.status_code == 400
+    assert response.get_json()['status'] == 'error'
+
+
+def test_search_index_follows_writes(app, client):
+    with app.app_context():
+        conn = get_db()
+        conn.execute("INSERT INTO items (id, name, brand, price, currency, in_stock_quantity) "
+                     "VALUES (22, 'Crème Brûlée Set', 'Le Creuset', 30, 'GBP', 5)")
+        conn.execute("UPDATE items SET name = 'Porcelain Tea Pot' WHERE id = 1")
+        conn.execute("UPDATE items SET in_stock_quantity = 0 WHERE id = 2")
+        conn.execute('DELETE FROM items WHERE id = 19')
+        conn.commit()
+
+    def ids(query):
+        return [item['id'] for item in client.get(f'{SEARCH}?q={query}').get_json()['items']]
+
+    assert ids('creme brulee') == [22]  # ignoring diacritics
+    assert ids('porcelain') == [1]
+    assert sorted(ids('creuset')) == [1, 2, 22]
+    assert ids('honeycomb') == []
+
+
+def test_searchbench_command():
+    from click.testing import CliRunner
+    from online_store.tools.searchbench import searchbench_command
+
+    result = CliRunner().invoke(searchbench_command, ['--items', '200', '--repeat', '1'])
+    assert result.exit_code == 0, result.output
+    assert 'Indexed 200 items' in result.output and 'copper kettle' in result.output
@@ -0,0 +1,66 @@
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
+from time import sleep
+
+import pytest
+
+from online_store.backend.gift_list import SqlDatabaseGiftList
+
+
+@pytest.fixture
+def slow_report(monkeypatch):
+    """Block gift list reports until released, counting the reports created."""
+    calls, release = [], threading.Event()
+    create_report = SqlDatabaseGiftList.create_report
+
+    def blocking_create_report(self):
+        calls.append(1)
+        release.wait(5)
+        return create_report(self)
+
+    monkeypatch.setattr(SqlDatabaseGiftList, 'create_report', blocking_create_report)
+    return calls, release
+
+
+def _wait_for_coalesced(app, count: int):
+    flight = app.extensions['single_flight']
+    while flight.coalesced < count:
+        sleep(0.001)
+
+
+def test_single_flight_report(app, test_auth_headers, slow_report):
+    calls, release = slow_report
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        futures = [executor.submit(app.test_client().get, '/api/v1/gifts/list/report',
+                                   headers=test_auth_headers) for _ in range(4)]
+        _wait_for_coalesced(app, 3)
+        release.set()
+        responses = [future.result() for future in futures]
+    assert len(calls) == 1
+    assert {response.status_code for response in responses} == {200}
+    assert len({response.get_data() for response in responses}) == 1
+    assert all(response.headers['Content-Type'] == 'application/json'
+               for response in responses)
+
+
+def test_single_flight_timeout(app, test_auth_headers, slow_report):
+    calls, release = slow_report
+    app.config['SINGLE_FLIGHT_TIMEOUT'] = 0.01
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        leader = executor.submit(app.test_client().get, '/api/v1/gifts/list/report',
+                                 headers=test_auth_headers)
+        while not calls:
+            sleep(0.001)
+        follower = executor.submit(app.test_client().get, '/api/v1/gifts/list/report',
+                                   headers=test_auth_headers)
+        while len(calls) < 2:  # the follower gave up waiting and ran the view
+            sleep(0.001)
+        release.set()
+        assert leader.result().status_code == follower.result().status_code == 200
+
+
+def test_single_flight_keyed_by_args(client):
+    first = client.get('/api/v1/store/items?id=1').get_json()
+    second = client.get('/api/v1/store/items?id=2').get_json()
+    assert [item['id'] for item in first + second] == [1, 2]
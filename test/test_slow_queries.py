@@ -0,0 +1,82 @@
+import json
+
+import pytest
+
+from online_store.app import create_app
+from online_store.backend.models.database import get_db
+from online_store.backend.utils.slow_queries import (
+    SLOW_QUERIES, SlowQueryLog, parameter_shapes
+)
+
+
+@pytest.fixture
+def slow_queries(app):
+    app.config['SQL_SLOW_QUERY_THRESHOLD'] = 0.  # record every statement
+    SLOW_QUERIES.clear()
+    yield SLOW_QUERIES
+    SLOW_QUERIES.clear()
+
+
+@pytest.mark.parametrize('parameters,shapes', [
+    ((1, 'Tea pot', 2.5), ['int', 'str', 'float']),
+    ({'name': 'Tea pot'}, {'name': 'str'}),
+    ([(1, 'a'), (2, 'b')], [['int', 'str'], 'x2']),
+])
+def test_parameter_shapes(parameters, shapes):
+    assert parameter_shapes(parameters) == shapes
+
+
+def test_SlowQueryLog_bounded():
+    log = SlowQueryLog(maxlen=2)
+    for i in range(3):
+        log.append({'id': i})
+    assert [entry['id'] for entry in log.entries()] == [2, 1]
+
+
+def test_slow_query_recorded_with_plan(client, slow_queries):
+    client.get('/api/v1/store/items?name=Tea%20pot')
+    entries = [entry for entry in slow_queries.entries() if entry['endpoint'] == 'store.items']
+    assert entries
+    entry = entries[0]
+    assert entry['method'] == 'GET'
+    assert 'Tea pot' not in str(entry['parameters'])  # values are never logged
+    assert any('SCAN' in line for line in entry['plan'])
+
+
+def test_slow_query_threshold_disabled(client, slow_queries, app):
+    app.config['SQL_SLOW_QUERY_THRESHOLD'] = None
+    client.get('/api/v1/store/items/id/1')
+    assert len(slow_queries) == 0
+
+
+def test_admin_slow_queries(app, client, slow_queries, test_auth_headers):
+    response = client.get('/api/v1/admin/slow-queries', headers=test_auth_headers)
+    assert response.status_code == 403
+
+    with app.app_context():
+        get_db().execute("UPDATE users SET role = 2 WHERE username = 'test'")
+        get_db().commit()
+
+    response = client.get('/api/v1/admin/slow-queries', headers=test_auth_headers)
+    assert response.status_code == 200
+    assert isinstance(response.json, list) and response.json
+
+    response = client.delete('/api/v1/admin/slow-queries', headers=test_auth_headers)
+    assert response.status_code == 200
+    assert len(slow_queries) <= 1  # only the statement(s) following the clear
+
+
+def test_slow_query_log_file(app, tmp_path):
+    log_app = create_app(config={
+        'TESTING': True,
+        'SQLALCHEMY_DATABASE_URI': app.config['SQLALCHEMY_DATABASE_URI'],
+        'SQLALCHEMY_TRACK_MODIFICATIONS': False,
+        'LOG_FILE': str(tmp_path / 'app.log'),
+        'LOG_ENQUEUE': False,
+        'SQL_SLOW_QUERY_THRESHOLD_MS': 0,
+    })
+    log_app.test_client().get('/api/v1/store/items?name=Tea%20pot')
+    # written next to the app log by default, and only to the slow query log
+    entries = [json.loads(line) for line in (tmp_path / 'slow_queries.log').read_text().splitlines()]
+    assert any(entry['endpoint'] == 'store.items' for entry in entries)
+    assert '"statement"' not in (tmp_path / 'app.log').read_text()
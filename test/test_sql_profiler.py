@@ -0,0 +1,102 @@
+import pytest
+
+from online_store.backend.utils.sql_profiler import (
+    QueryBudgetExceeded, QueryStats, collect_queries, query_budget, statement_shape
+)
+from online_store.backend.models.item import ItemModel
+
+
+@pytest.mark.parametrize('statement,shape', [
+    ('SELECT *\n  FROM items\n WHERE id = ?', 'SELECT * FROM items WHERE id = ?'),
+    ('SELECT * FROM items WHERE id IN (?, ?, ?)', 'SELECT * FROM items WHERE id IN (?)'),
+    ('SELECT * FROM items WHERE id IN (?,?)', 'SELECT * FROM items WHERE id IN (?)'),
+])
+def test_statement_shape(statement, shape):
+    assert statement_shape(statement) == shape
+
+
+def test_QueryStats_repeated():
+    stats = QueryStats()
+    for i in range(5):
+        stats.record('SELECT * FROM items WHERE id = ?', 0.001)
+    stats.record('SELECT * FROM users', 0.002)
+    assert stats.count == 6
+    assert stats.duration == pytest.approx(0.007)
+    assert stats.repeated(5) == {'SELECT * FROM items WHERE id = ?': 5}
+    assert stats.repeated(6) == {}
+
+
+def test_collect_queries(app):
+    with app.app_context():
+        with collect_queries() as outer:
+            ItemModel.query.first()
+            with collect_queries() as inner:
+                ItemModel.query.first()
+        assert outer.count == 2
+        assert inner.count == 1
+
+
+def test_query_budget(app):
+    with app.app_context():
+        with query_budget(1):
+            ItemModel.query.first()
+        with pytest.raises(QueryBudgetExceeded) as excinfo:
+            with query_budget(1):
+                ItemModel.query.first()
+                ItemModel.query.all()
+        assert '2 queries' in str(excinfo.value)
+
+
+def test_failed_statements_are_not_timed(app):
+    from online_store.backend.models.database import db
+    import sqlalchemy.exc
+    with app.app_context():
+        with db.engine.connect() as conn:
+            for _ in range(3):
+                with pytest.raises(sqlalchemy.exc.OperationalError):
+                    conn.execute('SELECT * FROM no_such_table')
+            conn.execute('SELECT 1')
+            assert conn.info['query_start_time'] == []
+
+
+def test_query_headers(client):
+    response = client.get('/api/v1/store/items/id/1')
+    assert response.headers['X-DB-Query-Count'] == '1'
+    assert float(response.headers['X-DB-Time']) >= 0
+
+
+def test_query_headers_disabled(app):
+    app.config['SQL_PROFILER_HEADERS'] = False
+    response = app.test_client().get('/api/v1/store/items/id/1')
+    assert 'X-DB-Query-Count' not in response.headers
+
+
+def test_n_plus_one_header(app, client, test_auth_headers):
+    app.config['SQL_N_PLUS_ONE_THRESHOLD'] = 2
+    for item_id in (1, 2, 4):
+        client.post(f'/api/v1/gifts/list/add?item_id={item_id}', headers=test_auth_headers)
+    response = client.get('/api/v1/gifts/list/report', headers=test_auth_headers)
+    assert response.status_code == 200
+    assert int(response.headers['X-DB-N-Plus-One']) >= 1
+
+
+@pytest.mark.parametrize('endpoint,budget', [
+    ('/api/v1/store/items', 1),
+    ('/api/v1/store/items/id/1', 1),
+    ('/api/v1/store/orders', 1),
+    ('/api/v1/store/orders/id/1', 1),
+])
+def test_endpoint_query_budget(client, query_budget, endpoint, budget):
+    with query_budget(budget):
+        response = client.get(endpoint)
+    assert response.status_code < 500
+
+
+@pytest.mark.parametrize('endpoint,budget', [
+    ('/api/v1/gifts/list', 6),
+    ('/api/v1/gifts/list/report', 7),
+])
+def test_gifts_endpoint_query_budget(client, query_budget, test_auth_headers, endpoint, budget):
+    with query_budget(budget):
+        response = client.get(endpoint, headers=test_auth_headers)
+    assert response.status_code < 500
@@ -0,0 +1,125 @@
+import threading
+
+import pytest
+
+from click.testing import CliRunner
+
+from online_store.app import create_app
+from online_store.backend.models.database import db
+from online_store.backend.models.item import ItemModel
+from online_store.backend.models.order import StockUnavailableError
+from online_store.backend.stock import StockLedger
+from online_store.tools.microbench import microbench_command, run_microbench
+
+
+def _stock(app, item_id: int) -> int:
+    with app.app_context():
+        return db.session.query(ItemModel.in_stock_quantity).filter_by(id=item_id).scalar()
+
+
+@pytest.fixture
+def ledger(app):
+    with app.app_context():
+        item = ItemModel.query.get(1)
+        item.in_stock_quantity = 25
+        db.session.commit()
+        yield StockLedger(db.get_engine(app), shards=4, lease_size=10)
+
+
+def test_reserve_commit_release(app, ledger):
+    reservation = ledger.reserve(1, 2)
+    assert _stock(app, 1) == 13  # leased the 2 reserved and 10 more
+    assert ledger.available(1) == 10
+    ledger.commit(reservation)
+    with pytest.raises(ValueError):
+        ledger.release(reservation)
+
+    reservation = ledger.reserve(1, 20)
+    assert ledger.available(1) == 3 and _stock(app, 1) == 0
+    ledger.release(reservation)
+    assert ledger.available(1) == 23
+    assert ledger.consolidate() == 23
+    assert _stock(app, 1) == 23
+
+
+def test_reserve_unavailable(app, ledger):
+    with pytest.raises(StockUnavailableError):
+        ledger.reserve(1, 26)
+    with pytest.raises(StockUnavailableError):
+        ledger.reserve(999, 1)
+    assert _stock(app, 1) == 25
+
+
+def test_concurrent_reservations_never_oversell(app, ledger):
+    sold = []
+
+    def buy():
+        while True:
+            try:
+                ledger.commit(ledger.reserve(1, 1))
+            except StockUnavailableError:
+                return
+            sold.append(1)
+
+    threads = [threading.Thread(target=buy) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    ledger.consolidate()
+    assert len(sold) == 25
+    assert _stock(app, 1) == 0
+
+
+@pytest.fixture
+def ledger_app(app):
+    ledger_app = create_app(config={
+        'TESTING': True,
+        'SQLALCHEMY_DATABASE_URI': app.config['SQLALCHEMY_DATABASE_URI'],
+        'SQLALCHEMY_TRACK_MODIFICATIONS': False,
+        'STOCK_LEDGER_ENABLED': True,
+        'STOCK_LEDGER_CONSOLIDATE_INTERVAL': 0,
+        'SQL_SLOW_QUERY_LOG': app.config['SQL_SLOW_QUERY_LOG'],
+    })
+    return ledger_app
+
+
+def test_order_with_stock_ledger(ledger_app):
+    client = ledger_app.test_client()
+    stock = _stock(ledger_app, 1)
+    order = {'user': 1, 'items': [{'item_id': 1, 'quantity': 2}, {'item_id': 2}]}
+    assert client.post('/api/v1/store/order', json=order).status_code == 200
+    ledger = ledger_app.extensions['stock_ledger']
+    ledger.consolidate()
+    assert _stock(ledger_app, 1) == stock - 2
+    too_many = {'user': 1, 'items': [{'item_id': 2}, {'item_id': 1, 'quantity': stock}]}
+    client.post('/api/v1/store/order', json=too_many)
+    ledger.consolidate()  # the reservation of item 2 was released
+    assert _stock(ledger_app, 1) == stock - 2
+    with ledger_app.app_context():
+        assert db.session.execute('SELECT COUNT(*) FROM order_items').scalar() == 2
+
+
+def test_purchase_with_stock_ledger(ledger_app, test_auth_headers):
+    client = ledger_app.test_client()
+    stock = _stock(ledger_app, 2)
+    client.post('/api/v1/gifts/list/add?item_id=2&quantity=2', headers=test_auth_headers)
+    gift_id = client.get('/api/v1/gifts/list', headers=test_auth_headers).get_json()[-1]['id']
+    response = client.post(f'/api/v1/gifts/list/{gift_id}/purchase', headers=test_auth_headers)
+    assert response.status_code == 200
+    ledger_app.extensions['stock_ledger'].consolidate()
+    assert _stock(ledger_app, 2) == stock - 1
+
+
+@pytest.mark.parametrize('strategy', ['row', 'sharded'])
+def test_run_microbench(app, strategy):
+    with app.app_context():
+        result = run_microbench(db.get_engine(app), strategy, threads=4, stock=200, shards=4,
+                                lease_size=16)
+    assert result['sold'] == 200 and result['remaining'] == 0
+
+
+def test_microbench_command():
+    result = CliRunner().invoke(microbench_command, ['--threads', '2', '--stock', '50'])
+    assert result.exit_code == 0, result.output
+    assert 'sharded' in result.output
@@ -0,0 +1,143 @@
+import random
+import sys
+import threading
+
+import pytest
+
+from online_store.app import create_app
+from online_store.backend import suggest
+from online_store.backend.models.database import get_db
+from online_store.backend.suggest import ItemSuggestions, PrefixIndex, index_keys, normalize
+
+SUGGEST = '/api/v1/store/items/suggest'
+
+
+def ids(client, query, limit=10):
+    response = client.get(SUGGEST, query_string={'q': query, 'limit': limit})
+    assert response.status_code == 200
+    return [item['id'] for item in response.get_json()['items']]
+
+
+def test_index_keys():
+    assert normalize("  Crème-Brûlée  50's_SET ") == 'creme brulee 50 s set'
+    assert index_keys('Tea pot', 'Le Creuset') == {'tea pot', 'pot', 'le creuset', 'creuset'}
+    assert index_keys(None, '') == set()
+
+
+def test_prefix_index_ranking():
+    rng = random.Random(0)
+    words = ['tea', 'teapot', 'pot', 'kettle', 'copper', 'cop']
+    items = {item_id: (' '.join(rng.choices(words, k=3)), rng.choice(words), rng.randint(0, 5))
+             for item_id in range(1, 200)}
+    index = PrefixIndex(items)
+    index.update(index.positions(7, *items[7][:2]), -1)  # removed
+    for prefix in ('t', 'tea', 'teapot t', 'cop', 'copper kettle', 'x'):
+        ranked = list(index.ranked(prefix))
+        popularity = [popularity for _, popularity in ranked]
+        assert popularity == sorted(popularity, reverse=True)
+        expected = {item_id for item_id, (name, brand, _) in items.items() if item_id != 7 and
+                    any(key.startswith(prefix) for key in index_keys(name, brand))}
+        assert {item_id for item_id, _ in ranked} == expected
+
+
+def test_prefix_index_positions():
+    items = {item_id: (f'Pot {item_id}', 'Le Creuset', item_id) for item_id in range(1000, 0, -1)}
+    index = PrefixIndex(items)
+    assert list(index.keys) == sorted(index.keys)
+    for item_id in (1, 500, 1000):
+        positions = index.positions(item_id, *items[item_id][:2])
+        assert len(positions) == len(index_keys(*items[item_id][:2]))
+        assert all(index.ids[position] == item_id for position in positions)
+    assert index.positions(1001, 'Pot 1001', 'Le Creuset') == []
+
+
+def test_suggest(app, client, query_budget):
+    client.get(SUGGEST, query_string={'q': 'warm up'})
+    with app.app_context():
+        conn = get_db()
+        conn.executemany('INSERT INTO gifts (item_id, list_id, available, purchased) '
+                         'VALUES (?, 1, 1, 0)', [(6,), (6,), (8,)])
+        conn.commit()
+    client.get(SUGGEST, query_string={'q': 'warm up'})  # applies the new gifts
+    with query_budget(0):
+        assert sorted(ids(client, 'le cre')) == [1, 2]
+        assert ids(client, 'MIX', limit=2) == [6, 8]
+        assert ids(client, 'graham & gr') == [17, 19]
+        assert ids(client, 'zebra') == [] and ids(client, ' ') == []
+    item = client.get(SUGGEST, query_string={'q': 'tea'}).get_json()['items'][0]
+    assert item == {'id': 1, 'name': 'Tea pot', 'brand': 'Le Creuset', 'popularity': 1}
+
+
+@pytest.mark.parametrize('limit', ['0', '51', 'ten'])
+def test_suggest_invalid(client, limit):
+    response = client.get(SUGGEST, query_string={'q': 'tea', 'limit': limit})
+    assert response.status_code == 400
+    assert response.get_json()['status'] == 'error'
+
+
+def test_suggest_disabled(app):
+    disabled_app = create_app(config={
+        'TESTING': True,
+        'DATABASE': app.config['DATABASE'],
+        'SQLALCHEMY_DATABASE_URI': app.config['SQLALCHEMY_DATABASE_URI'],
+        'SQLALCHEMY_TRACK_MODIFICATIONS': False,
+        'SUGGEST_INDEX': False,
+        'SQL_SLOW_QUERY_LOG': app.config['SQL_SLOW_QUERY_LOG'],
+    })
+    assert disabled_app.test_client().get(SUGGEST, query_string={'q': 'tea'}).status_code == 501
+
+
+@pytest.mark.parametrize('delta_limit', [1024, 1])
+def test_suggest_follows_writes(app, client, monkeypatch, delta_limit):
+    monkeypatch.setattr(suggest, 'DELTA_LIMIT', delta_limit)
+    client.get(SUGGEST, query_string={'q': 'warm up'})
+    with app.app_context():  # e.g. by another worker
+        conn = get_db()
+        conn.execute("INSERT INTO items (id, name, brand, price, currency, in_stock_quantity) "
+                     "VALUES (22, 'Stand Fan', 'Dyson', 30, 'GBP', 5)")
+        conn.execute("UPDATE items SET name = 'Porcelain Tea Pot' WHERE id = 1")
+        conn.execute("UPDATE items SET in_stock_quantity = 0 WHERE id = 2")
+        conn.execute('DELETE FROM items WHERE id = 7')
+        conn.executemany('INSERT INTO gifts (item_id, list_id, available, purchased) '
+                         'VALUES (?, 1, 1, 0)', [(6,), (6,), (22,)])
+        conn.execute('INSERT INTO order_items (order_id, item, quantity) VALUES (1, 8, 3)')
+        conn.commit()
+
+    assert ids(client, 'stand') == [8, 6, 22]
+    assert ids(client, 'porc') == [1] and ids(client, 'tea pot') == [1]
+    assert sorted(ids(client, 'creuset')) == [1, 2]
+    with app.app_context():
+        conn = get_db()
+        conn.execute("UPDATE items SET brand = 'Vornado' WHERE id = 22")
+        conn.execute('DELETE FROM gifts WHERE item_id = 6')
+        conn.commit()
+    assert ids(client, 'stand') == [8, 22, 6]
+    assert ids(client, 'dyson') == [] and ids(client, 'vorn') == [22]
+    assert ids(client, 'mini') == [6]
+    suggestions = app.extensions['item_suggestions']
+    with app.app_context():
+        suggestions.build()  # from scratch, matching the incremental updates
+    assert ids(client, 'stand') == [8, 22, 6] and ids(client, 'vorn') == [22]
+
+
+def test_suggest_sees_whole_batches():
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)  # switch threads often, mid-batch if unlocked
+    suggestions = ItemSuggestions(engine=None)
+
+    def rename():
+        for seq in range(1, 101):  # every item renamed, alternately to and from a tea pot
+            name = 'Tea Pot' if seq % 2 else 'Kettle'
+            with suggestions._lock:
+                suggestions._apply_changes(
+                    [(seq, item_id, item_id, name, 'Oka', item_id) for item_id in range(1, 9)])
+
+    writer = threading.Thread(target=rename)
+    writer.start()
+    try:
+        while writer.is_alive():
+            found = suggestions.suggest('tea', limit=8)
+            assert len(found) in (0, 8) and all(item['name'] == 'Tea Pot' for item in found)
+    finally:
+        writer.join()
+        sys.setswitchinterval(interval)